@@ -0,0 +1,110 @@
+"""Run the API workload suite against a local stub LLM server.
+
+Results are written as JSON so they can be kept as a baseline and compared
+with later runs. Usage (from the repository root):
+
+    python -m benchmarks.run --sizes 500,5000 --requests 50 --out benchmarks/baselines/reference.json
+    python -m benchmarks.run --compare benchmarks/baselines/reference.json
+"""
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime
+
+from benchmarks.stub_server import StubServer
+from benchmarks.workloads import WORKLOADS, BenchmarkEnvironment, run_workload
+
+# Metrics compared against a baseline, and whether higher is worse
+COMPARED_METRICS = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+    'queries_max': True,
+    'throughput_rps': False,
+}
+
+
+def run_suite(sizes, workloads, requests, concurrency, latency, messages_per_conversation):
+    results = {
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'settings': {
+            'sizes': sizes,
+            'requests': requests,
+            'concurrency': concurrency,
+            'stub_latency': latency,
+            'messages_per_conversation': messages_per_conversation,
+        },
+        'results': {},
+    }
+
+    with StubServer(latency=latency, completion_tokens=64, seed=42) as stub:
+        for size in sizes:
+            env = BenchmarkEnvironment(stub.url, size, messages_per_conversation)
+            for name in workloads:
+                summary = run_workload(env, name, requests, concurrency)
+                results['results'][f'{name}@{size}'] = summary
+                print(f"{name + '@' + str(size):32} p50={summary['p50_ms']:>8}ms p95={summary['p95_ms']:>8}ms "
+                      f"p99={summary['p99_ms']:>8}ms rps={summary['throughput_rps']:>8} "
+                      f"queries={summary['queries_mean']}/{summary['queries_max']} errors={summary['errors']}")
+        results['stub'] = stub.settings.stats()
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """List metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for key, current in results['results'].items():
+        previous = baseline.get('results', {}).get(key)
+        if not previous:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if old in (None, 0) or new is None:
+                continue
+            change = (new - old) / old
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f'{key} {metric}: {old} -> {new} ({change:+.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='500,5000', help='total seeded messages per run, comma separated')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help=f'subset of {list(WORKLOADS)}')
+    parser.add_argument('--requests', type=int, default=50, help='requests per workload')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', default='fixed:0.05', help='stub latency distribution')
+    parser.add_argument('--messages-per-conversation', type=int, default=50)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    args = parser.parse_args()
+
+    workloads = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    for name in workloads:
+        if name not in WORKLOADS:
+            parser.error(f'Unknown workload: {name}')
+
+    results = run_suite([int(size) for size in args.sizes.split(',')], workloads, args.requests,
+                        args.concurrency, args.latency, args.messages_per_conversation)
+
+    if args.out:
+        with open(args.out, 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle), args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\nNo regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
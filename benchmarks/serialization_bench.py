@@ -0,0 +1,124 @@
+"""Serialization time and bytes on the wire for a large conversation.
+
+Usage (from the repository root):
+
+    python -m benchmarks.serialization_bench [--messages 5000] [--repeat 5] [--json]
+"""
+import argparse
+import gzip
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from flask.json.provider import DefaultJSONProvider
+
+from src.models.ai_provider import db, AIProvider, AIPersonality, Conversation, ChatMessage
+from src.main import create_app
+from src.services.compression import brotli
+from src.services.json_provider import FastJSONProvider, orjson
+
+
+def seed(message_count):
+    provider = AIProvider(name='bench', api_type='manus', api_key='x', default_model='bench-model')
+    db.session.add(provider)
+    db.session.flush()
+
+    personalities = [
+        AIPersonality(name=f'bench-{i}', display_name=f'Bench {i}', system_prompt='You are a benchmark.',
+                      color_theme='#10B981', provider_id=provider.id)
+        for i in range(2)
+    ]
+    db.session.add_all(personalities)
+    db.session.flush()
+
+    conversation = Conversation(title='bench', participants=json.dumps([p.id for p in personalities]))
+    db.session.add(conversation)
+    db.session.flush()
+
+    started = datetime.utcnow() - timedelta(days=1)
+    for i in range(message_count):
+        personality = personalities[i % 2]
+        message = ChatMessage(
+            conversation_id=conversation.id,
+            personality_id=personality.id,
+            provider_id=provider.id,
+            content=f'Message {i}: ' + 'lorem ipsum dolor sit amet ' * 12,
+            sender_type='ai',
+            model='bench-model',
+            prompt_tokens=420,
+            completion_tokens=96,
+            latency_ms=850,
+            created_at=started + timedelta(seconds=i)
+        )
+        message.set_metadata({
+            'usage': {'prompt_tokens': 420, 'completion_tokens': 96, 'total_tokens': 516},
+            'model': 'bench-model',
+            'provider': 'manus'
+        })
+        db.session.add(message)
+    db.session.commit()
+    return conversation.id
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 2)
+
+
+def run(message_count, repeat):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    results = {'messages': message_count, 'orjson': orjson is not None, 'brotli': brotli is not None}
+
+    with app.app_context():
+        db.create_all()
+        conversation_id = seed(message_count)
+        payload = {
+            'success': True,
+            'messages': [m.to_dict() for m in ChatMessage.query.filter_by(conversation_id=conversation_id).all()]
+        }
+
+        for name, provider_class in (('default', DefaultJSONProvider), ('fast', FastJSONProvider)):
+            provider = provider_class(app)
+            results[f'dumps_ms_{name}'] = timed(lambda: provider.dumps(payload), repeat)
+
+    client = app.test_client()
+    url = f'/api/conversations/{conversation_id}'
+    sparse_url = url + '?fields=id,content,sender_type,personality_id,created_at'
+
+    for name, provider_class in (('default', DefaultJSONProvider), ('fast', FastJSONProvider)):
+        app.json = provider_class(app)
+        results[f'request_ms_{name}'] = timed(lambda: client.get(url), repeat)
+        results[f'request_ms_{name}_sparse'] = timed(lambda: client.get(sparse_url), repeat)
+
+    for label, target in (('full', url), ('sparse', sparse_url)):
+        body = client.get(target).get_data()
+        results[f'bytes_{label}_identity'] = len(body)
+        results[f'bytes_{label}_gzip'] = len(gzip.compress(body, compresslevel=6))
+        if brotli is not None:
+            results[f'bytes_{label}_br'] = len(brotli.compress(body, quality=4))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    results = run(args.messages, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f'{key:32} {value}')
+
+
+if __name__ == '__main__':
+    main()
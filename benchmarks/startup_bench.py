@@ -0,0 +1,90 @@
+"""Import time and cold-start time of the application.
+
+Every measurement runs in a fresh interpreter, like a new gunicorn worker or an
+autoscaled instance. Usage (from the repository root):
+
+    python -m benchmarks.startup_bench [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+import src.main
+imported = time.perf_counter()
+app = src.main.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+created = time.perf_counter()
+response = app.test_client().get('/api/supported-types')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'cold_start_ms': (served - started) * 1000,
+    'modules_loaded': len(sys.modules),
+    'openai_imported': 'openai' in sys.modules,
+    'numpy_imported': 'numpy' in sys.modules,
+    'status': response.status_code,
+}))
+'''
+
+
+def probe():
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def import_time_top(limit=10):
+    """Slowest modules (cumulative microseconds) reported by -X importtime"""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import src.main'],
+                            cwd=ROOT, check=True, capture_output=True, text=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package"
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), name.strip()))
+    return [{'module': name, 'cumulative_ms': round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:limit]]
+
+
+def run(repeat):
+    samples = [probe() for _ in range(repeat)]
+    results = {
+        key: round(statistics.median(sample[key] for sample in samples), 1)
+        for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'cold_start_ms', 'modules_loaded')
+    }
+    results['openai_imported'] = samples[-1]['openai_imported']
+    results['numpy_imported'] = samples[-1]['numpy_imported']
+    results['slowest_imports'] = import_time_top()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            if key == 'slowest_imports':
+                print('slowest imports:')
+                for row in value:
+                    print(f"  {row['module']:40} {row['cumulative_ms']} ms")
+            else:
+                print(f'{key:20} {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""Local OpenAI-compatible stub server for benchmarks.
+
+Speaks the ``/chat/completions`` protocol used by ManusAdapter and the OpenAI
+client, with configurable latency, token rate, streaming and fault injection,
+so the backend can be load tested without paying for real provider calls.
+
+Usage (from the repository root):
+
+    python -m benchmarks.stub_server --port 8089 --latency lognormal:-1.2,0.5 --rate-429 0.05
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyDistribution:
+    """Parses and samples latency specs (seconds) such as:
+
+    - ``fixed:0.2``
+    - ``uniform:0.1,0.6``
+    - ``normal:0.4,0.1`` (mean, stddev; clipped at 0)
+    - ``lognormal:-1.2,0.5`` (mu, sigma of the underlying normal)
+    """
+
+    def __init__(self, spec: str = 'fixed:0'):
+        self.spec = spec
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(value) for value in params.split(',') if value]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f'Unknown latency distribution: {spec}')
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            return self.params[0] if self.params else 0.0
+        if self.kind == 'uniform':
+            return rng.uniform(*self.params)
+        if self.kind == 'normal':
+            return max(0.0, rng.gauss(*self.params))
+        return math.exp(rng.gauss(*self.params))
+
+
+class StubSettings:
+    def __init__(self, latency='fixed:0', tokens_per_second=0.0, completion_tokens=64, rate_429=0.0,
+                 rate_timeout=0.0, timeout_seconds=60.0, seed=None):
+        self.latency = LatencyDistribution(latency)
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.rate_429 = rate_429
+        self.rate_timeout = rate_timeout
+        self.timeout_seconds = timeout_seconds
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.injected_429 = 0
+        self.injected_timeouts = 0
+
+    def draw(self):
+        """Pick this request's fate and latency (the shared RNG is not thread-safe)"""
+        with self.lock:
+            self.requests += 1
+            roll = self.rng.random()
+            latency = self.latency.sample(self.rng)
+            if roll < self.rate_429:
+                self.injected_429 += 1
+                return '429', latency
+            if roll < self.rate_429 + self.rate_timeout:
+                self.injected_timeouts += 1
+                return 'timeout', latency
+            return 'ok', latency
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'injected_429': self.injected_429,
+                'injected_timeouts': self.injected_timeouts,
+            }
+
+
+def _words(count: int):
+    return [f'token{i}' for i in range(count)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings: StubSettings = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/stats', '/v1/stats'):
+            self._send_json(200, self.settings.stats())
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/chat/completions', '/v1/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        settings = self.settings
+        fate, latency = settings.draw()
+
+        if fate == 'timeout':
+            time.sleep(settings.timeout_seconds)
+            self.close_connection = True
+            return
+
+        time.sleep(latency)
+        if fate == '429':
+            self._send_json(429, {'error': {'message': 'Rate limit exceeded (injected)', 'type': 'rate_limit_error'}},
+                            headers={'Retry-After': '1'})
+            return
+
+        messages = body.get('messages') or []
+        prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in messages)
+        completion_tokens = min(settings.completion_tokens, int(body.get('max_tokens') or settings.completion_tokens))
+        choices = max(1, int(body.get('n') or 1))
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens * choices,
+            'total_tokens': prompt_tokens + completion_tokens * choices,
+        }
+        model = body.get('model', 'stub-model')
+
+        if body.get('stream'):
+            self._stream(model, completion_tokens, choices, usage)
+            return
+
+        self._send_json(200, {
+            'id': f'chatcmpl-{uuid.uuid4().hex[:12]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [
+                {'index': index, 'finish_reason': 'stop',
+                 'message': {'role': 'assistant', 'content': ' '.join(_words(completion_tokens))}}
+                for index in range(choices)
+            ],
+            'usage': usage,
+        })
+
+    def _stream(self, model: str, completion_tokens: int, choices: int, usage: dict):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        delay = 1.0 / self.settings.tokens_per_second if self.settings.tokens_per_second > 0 else 0.0
+        chunk_id = f'chatcmpl-{uuid.uuid4().hex[:12]}'
+        try:
+            for word in _words(completion_tokens):
+                if delay:
+                    time.sleep(delay)
+                for index in range(choices):
+                    chunk = {
+                        'id': chunk_id, 'object': 'chat.completion.chunk', 'model': model,
+                        'choices': [{'index': index, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+                    }
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+
+            final = {
+                'id': chunk_id, 'object': 'chat.completion.chunk', 'model': model,
+                'choices': [{'index': index, 'delta': {}, 'finish_reason': 'stop'} for index in range(choices)],
+                'usage': usage,
+            }
+            self.wfile.write(f'data: {json.dumps(final)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up mid-stream
+            pass
+
+
+class StubServer:
+    """Runs the stub in a background thread: ``with StubServer(...) as stub: stub.url``"""
+
+    def __init__(self, host='127.0.0.1', port=0, **settings):
+        handler = type('ConfiguredStubHandler', (StubHandler,), {'settings': StubSettings(**settings)})
+        self.settings = handler.settings
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='llm-stub', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='fixed:0.2', help='latency distribution, e.g. lognormal:-1.2,0.5')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='streaming token rate (0 = unthrottled)')
+    parser.add_argument('--completion-tokens', type=int, default=64)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--rate-timeout', type=float, default=0.0, help='fraction of requests that hang')
+    parser.add_argument('--timeout-seconds', type=float, default=60.0, help='how long hanging requests hang')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = StubServer(
+        host=args.host, port=args.port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens, rate_429=args.rate_429, rate_timeout=args.rate_timeout,
+        timeout_seconds=args.timeout_seconds, seed=args.seed
+    )
+    print(f'Stub LLM server listening on {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Workload drivers: seed a database, replay API traffic and record latency,
+throughput and per-request query counts."""
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from src.cli import init_db
+from src.main import create_app
+from src.models.ai_provider import db, AIProvider, AIPersonality, Conversation, ChatMessage
+from src.services.embeddings import embed_message
+
+
+class QueryCounter:
+    """Counts SQL statements executed by the current thread"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+    def close(self):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(latencies_ms, queries, errors, wall_seconds):
+    return {
+        'requests': len(latencies_ms),
+        'errors': errors,
+        'throughput_rps': round(len(latencies_ms) / wall_seconds, 2) if wall_seconds else None,
+        'p50_ms': round(percentile(latencies_ms, 0.50), 2),
+        'p95_ms': round(percentile(latencies_ms, 0.95), 2),
+        'p99_ms': round(percentile(latencies_ms, 0.99), 2),
+        'mean_ms': round(statistics.fmean(latencies_ms), 2),
+        'queries_mean': round(statistics.fmean(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+class BenchmarkEnvironment:
+    """A throwaway app + SQLite database seeded with conversations"""
+
+    def __init__(self, llm_url, total_messages, messages_per_conversation=50, config=None):
+        self.directory = tempfile.mkdtemp(prefix='ai-backend-bench-')
+        settings = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(self.directory, 'bench.db')}"}
+        settings.update(config or {})
+        self.app = create_app(settings)
+        self.llm_url = llm_url
+        self.total_messages = total_messages
+        self.messages_per_conversation = messages_per_conversation
+        self.conversation_ids = []
+        self.personality_ids = []
+
+        with self.app.app_context():
+            init_db()
+            self._seed()
+            self.queries = QueryCounter(db.engine)
+
+    def _seed(self):
+        provider = AIProvider(name='bench-stub', api_type='manus', api_base_url=self.llm_url,
+                              api_key='bench', default_model='stub-model', max_tokens=256)
+        db.session.add(provider)
+        db.session.flush()
+
+        personalities = [
+            AIPersonality(name=f'bench-{index}', display_name=f'Bench {index}', provider_id=provider.id,
+                          system_prompt='Sei un partecipante a un benchmark.')
+            for index in range(3)
+        ]
+        db.session.add_all(personalities)
+        db.session.flush()
+        self.personality_ids = [personality.id for personality in personalities]
+
+        conversation_count = max(1, self.total_messages // self.messages_per_conversation)
+        started = datetime.utcnow() - timedelta(days=7)
+        for conversation_index in range(conversation_count):
+            conversation = Conversation(title=f'Bench {conversation_index}', topic='benchmark',
+                                        participants=json.dumps(self.personality_ids))
+            db.session.add(conversation)
+            db.session.flush()
+            self.conversation_ids.append(conversation.id)
+
+            for index in range(self.messages_per_conversation):
+                personality = personalities[index % len(personalities)]
+                message = ChatMessage(
+                    conversation_id=conversation.id,
+                    personality_id=personality.id,
+                    provider_id=provider.id,
+                    content=f'Messaggio {index} della conversazione {conversation_index} ' + 'testo ' * 40,
+                    sender_type='ai',
+                    model='stub-model',
+                    prompt_tokens=300,
+                    completion_tokens=64,
+                    latency_ms=200,
+                    created_at=started + timedelta(seconds=conversation_index * 1000 + index)
+                )
+                embed_message(message)
+                db.session.add(message)
+            db.session.commit()
+
+
+WORKLOADS = {}
+
+
+def workload(name):
+    def register(fn):
+        WORKLOADS[name] = fn
+        return fn
+    return register
+
+
+@workload('list_conversations')
+def list_conversations(client, env, index):
+    return client.get('/api/conversations')
+
+
+@workload('conversation_detail')
+def conversation_detail(client, env, index):
+    conversation_id = env.conversation_ids[index % len(env.conversation_ids)]
+    return client.get(f'/api/conversations/{conversation_id}')
+
+
+@workload('send_message')
+def send_message(client, env, index):
+    conversation_id = env.conversation_ids[index % len(env.conversation_ids)]
+    return client.post(f'/api/conversations/{conversation_id}/messages', json={
+        'personality_id': env.personality_ids[index % len(env.personality_ids)],
+        'content': f'Domanda di benchmark numero {index}',
+    })
+
+
+@workload('auto_continue')
+def auto_continue(client, env, index):
+    conversation_id = env.conversation_ids[index % len(env.conversation_ids)]
+    return client.post(f'/api/conversations/{conversation_id}/auto-continue', json={'rounds': 1})
+
+
+def run_workload(env, name, requests, concurrency=1):
+    """Run one workload and summarize latency, throughput and query counts"""
+    driver = WORKLOADS[name]
+    latencies, queries, errors = [], [], 0
+    lock = threading.Lock()
+
+    def one(index):
+        nonlocal errors
+        client = env.app.test_client()
+        env.queries.reset()
+        started = time.perf_counter()
+        response = driver(client, env, index)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            queries.append(env.queries.count)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for index in range(requests):
+            one(index)
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(one, range(requests)))
+    return summarize(latencies, queries, errors, time.perf_counter() - started)
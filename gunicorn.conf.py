@@ -0,0 +1,14 @@
+# Production server settings: gunicorn -c gunicorn.conf.py src.wsgi:app
+# Run `flask --app src.main init-db` once per deploy before starting the server.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Threaded workers: each open /events stream holds one thread (see EVENTS_MAX_STREAM_SECONDS)
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# The app is built in the master and shared copy-on-write by the workers.
+# create_app() opens no database connections, so forking after it is safe.
+preload_app = True
@@ -0,0 +1,65 @@
+import os
+
+import click
+
+from src.models.ai_provider import db, AIProvider
+from src.models.schema import upgrade_schema
+
+
+def init_db():
+    """Create missing tables/columns and seed the default provider"""
+    # Replicas are copies of the primary; binds are also kept on db across apps
+    db.create_all(bind_key=None)
+    upgrade_schema()
+
+    # Create default OpenAI provider if it doesn't exist
+    existing_provider = AIProvider.query.filter_by(name='OpenAI Default').first()
+    if not existing_provider:
+        default_provider = AIProvider(
+            name='OpenAI Default',
+            api_type='openai',
+            api_base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1'),
+            api_key=os.getenv('OPENAI_API_KEY', ''),
+            default_model='gpt-4',
+            max_tokens=1000,
+            temperature=0.7
+        )
+        db.session.add(default_provider)
+        db.session.commit()
+        print("Created default OpenAI provider")
+
+
+@click.command('init-db')
+def init_db_command():
+    """Create the database schema and seed default data."""
+    init_db()
+    click.echo('Database initialized')
+
+
+@click.command('rebuild-usage')
+def rebuild_usage_command():
+    """Recompute the usage rollups from the message table."""
+    from src.services.usage import rebuild_rollups
+
+    click.echo(f'Rebuilt {rebuild_rollups()} usage buckets')
+
+
+@click.command('backfill-embeddings')
+@click.option('--batch', default=500, show_default=True, help='Messages embedded per commit.')
+def backfill_embeddings_command(batch):
+    """Embed stored messages that have no embedding from the configured embedder."""
+    from src.services.embeddings import backfill_embeddings
+
+    total = 0
+    while True:
+        embedded = backfill_embeddings(limit=batch)
+        total += embedded
+        if embedded < batch:
+            break
+    click.echo(f'Embedded {total} messages')
+
+
+def register_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_usage_command)
+    app.cli.add_command(backfill_embeddings_command)
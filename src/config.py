@@ -0,0 +1,183 @@
+import os
+
+BASE_DIR = os.path.dirname(__file__)
+
+
+def _normalize_url(url):
+    # Render/Heroku still hand out the deprecated postgres:// scheme
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def _database_url():
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        return f"sqlite:///{os.path.join(BASE_DIR, 'database', 'app.db')}"
+    return _normalize_url(url)
+
+
+def _replica_urls():
+    return [_normalize_url(url.strip()) for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+
+class Config:
+    """Default settings, override them by passing a config to create_app()"""
+    SECRET_KEY = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+    SQLALCHEMY_DATABASE_URI = _database_url()
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Read replicas (comma-separated DATABASE_REPLICA_URLS): GET requests read from them while
+    # they are within REPLICA_MAX_LAG_SECONDS; clients that just wrote keep reading the primary
+    SQLALCHEMY_REPLICA_URIS = _replica_urls()
+    REPLICA_MAX_LAG_SECONDS = 10
+    REPLICA_CHECK_INTERVAL = 1
+    REPLICA_STICKY_SECONDS = 60
+
+    # Origins allowed to call the API
+    CORS_ORIGINS = [
+        "https://ai-frontend-iyvt.onrender.com", # Il tuo frontend su Render
+        "http://localhost:5173", # Per lo sviluppo locale del frontend (se usi la porta predefinita di Vite)
+        # Aggiungi qui altre origini se necessario per lo sviluppo locale o altri ambienti
+    ]
+    # Read by flask-cors (app-wide and @cross_origin): clients echo X-Last-Write so their reads see their writes
+    CORS_EXPOSE_HEADERS = ['X-Last-Write']
+
+    # Long-term memory (relevance-based history retrieval)
+    EMBEDDER = 'hashing'
+    MEMORY_TOP_K = 3
+    # Retrieval scores the last MEMORY_MAX_SCAN messages; ones without an embedding are embedded in the
+    # background, MEMORY_BACKFILL_BATCH per transaction (or run `flask --app src.main backfill-embeddings` once)
+    MEMORY_MAX_SCAN = 2000
+    MEMORY_BACKFILL_BATCH = 200
+
+    # Alternative replies per send_message (candidates=k): one call with n, or concurrent calls without it
+    MAX_CANDIDATES = 5
+
+    # Response compression
+    COMPRESSION_MIN_SIZE = 1024
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 4
+
+    # Live conversation events (SSE): 'memory' (single process) or 'database' (shared by polling)
+    EVENTS_BACKEND = os.getenv('EVENTS_BACKEND', 'memory')
+    EVENTS_QUEUE_SIZE = 100
+    EVENTS_HEARTBEAT_INTERVAL = 15
+    EVENTS_MAX_STREAM_SECONDS = 300
+    EVENTS_POLL_INTERVAL = 0.25
+    # Messages can commit out of id order (write-behind), so the poller re-reads this much history
+    EVENTS_POLL_LOOKBACK_SECONDS = 10
+
+    # Idempotency-Key support for LLM-backed POSTs
+    IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+    IDEMPOTENCY_WAIT_SECONDS = 120
+    IDEMPOTENCY_LOCK_TIMEOUT_SECONDS = 600
+
+    # Metrics: set a shared directory when running several worker processes
+    METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+
+    # Per-request SQL profiling (Server-Timing headers, N+1 warnings)
+    SQL_PROFILING = os.getenv('SQL_PROFILING', '').lower() in ('1', 'true', 'yes')
+    SQL_PROFILING_SLOWEST = 3
+    SQL_N_PLUS_ONE_THRESHOLD = 5
+
+    # Tracing: fraction of requests traced, exported to 'memory' (see /api/debug/traces) or 'jsonl'
+    TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '0'))
+    TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'memory')
+    TRACING_FILE = os.getenv('TRACING_FILE', 'traces.jsonl')
+    TRACING_BUFFER_SIZE = 2000
+    TRACING_SQL = True
+    TRACING_DEBUG_ENDPOINT = os.getenv('TRACING_DEBUG_ENDPOINT', '').lower() in ('1', 'true', 'yes')
+    # Follow the sampled flag of incoming traceparent headers (only when all callers are trusted services)
+    TRACING_TRUST_TRACEPARENT = os.getenv('TRACING_TRUST_TRACEPARENT', '').lower() in ('1', 'true', 'yes')
+
+    # Provider health probes (HEALTH_PROBE_INTERVAL > 0 enables the background prober)
+    HEALTH_PROBE_TIMEOUT = 10
+    HEALTH_PROBE_MAX_TIMEOUT = 60
+    HEALTH_PROBE_MAX_WORKERS = 8
+    HEALTH_PROBE_MAX_TOKENS = 16
+    HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', '0'))
+    HEALTH_DEGRADED_LATENCY_MS = 5000
+    HEALTH_LATENCY_ALPHA = 0.3
+
+    # Admin routes (creating users, changing their limits) require X-Admin-Key to match this; unset = refused
+    ADMIN_API_KEY = os.getenv('ADMIN_API_KEY')
+
+    # Proxies in front of the app whose X-Forwarded-For/-Proto are trusted (1 on Render); with 0, anonymous
+    # clients are told apart by the socket address, which is the proxy's
+    PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', '0'))
+
+    # Per-client quotas (None or 0 = unlimited); clients authenticate with X-API-Key
+    QUOTAS_ENABLED = os.getenv('QUOTAS_ENABLED', '').lower() in ('1', 'true', 'yes')
+    QUOTA_REQUESTS_PER_MINUTE = 120
+    QUOTA_DAILY_TOKENS = 1_000_000
+    QUOTA_ANONYMOUS_REQUESTS_PER_MINUTE = 60
+    QUOTA_ANONYMOUS_DAILY_TOKENS = 200_000
+    QUOTA_FLUSH_INTERVAL = 10
+    QUOTA_CLIENT_CACHE_SECONDS = 60
+
+    # Provider call cassettes: 'record' wraps every provider and appends its calls to LLM_CASSETTE_PATH
+    # ('{pid}' is replaced per process), 'replay' answers every call from it, LLM_CASSETTE_SPEED times faster
+    # than recorded (0 = no wait); LLM_CASSETTE_MATCH = 'request' (hash of the prompt) or 'sequence'
+    LLM_CASSETTE_MODE = os.getenv('LLM_CASSETTE_MODE')
+    LLM_CASSETTE_PATH = os.getenv('LLM_CASSETTE_PATH', 'cassettes/llm.jsonl.gz')
+    LLM_CASSETTE_SPEED = float(os.getenv('LLM_CASSETTE_SPEED', '1'))
+    LLM_CASSETTE_MATCH = os.getenv('LLM_CASSETTE_MATCH', 'request')
+
+    # Request deadlines: X-Request-Timeout (seconds, capped) or the default, minus a margin kept for
+    # saving and sending the response; provider calls get the time left as their timeout
+    REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '110'))
+    REQUEST_DEADLINE_MAX_SECONDS = 600
+    REQUEST_DEADLINE_MARGIN_SECONDS = 3
+    AUTO_CONTINUE_MIN_TURN_SECONDS = 5
+
+    # Speculative drafts of the next auto-continue turn, generated after each auto-continue request (opt-in:
+    # costs tokens for drafts that get discarded); SPECULATION_WORKERS bounds the provider calls spent on them
+    # per process, and a draft no worker has started within SPECULATION_PREPARE_WAIT_SECONDS is not waited for
+    SPECULATION_ENABLED = os.getenv('SPECULATION_ENABLED', '').lower() in ('1', 'true', 'yes')
+    SPECULATION_WORKERS = 2
+    SPECULATION_TTL_SECONDS = 300
+    SPECULATION_PREPARE_WAIT_SECONDS = 0.5
+
+    # Cancellation: how often running LLM jobs check for client disconnects and cancel requests
+    CANCEL_POLL_INTERVAL = 0.5
+
+    # Write-behind for user messages on SQLite: acknowledged once queued (and logged, with a log dir),
+    # group-committed every WRITE_BEHIND_INTERVAL seconds; a full queue falls back to synchronous commits
+    WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', '').lower() in ('1', 'true', 'yes')
+    WRITE_BEHIND_LOG_DIR = os.getenv('WRITE_BEHIND_LOG_DIR')
+    WRITE_BEHIND_INTERVAL = 0.005
+    WRITE_BEHIND_BATCH_SIZE = 500
+    WRITE_BEHIND_MAX_PENDING = 5000
+    WRITE_BEHIND_ID_BLOCK = 100
+    # Failed commits of a message before it is moved to the dead-letter file (in the log dir)
+    WRITE_BEHIND_MAX_ATTEMPTS = 3
+
+    # Admission control: per-process concurrency pools with a short wait queue, shedding with 503 when full.
+    # Keep llm + stream (concurrency + queue) below GUNICORN_THREADS so cheap requests always get a thread
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '').lower() in ('1', 'true', 'yes')
+    ADMISSION_POOLS = {
+        'llm': {'concurrency': 3, 'queue': 2, 'queue_timeout': 2.0},
+        'stream': {'concurrency': 2, 'queue': 0},
+        'default': {'concurrency': 8, 'queue': 16, 'queue_timeout': 1.0},
+    }
+
+    # Provider call scheduling: per-provider concurrency cap (per process), with slots reserved for interactive
+    # calls; background/probe calls that waited SCHEDULER_AGING_SECONDS compete as interactive ones
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '').lower() in ('1', 'true', 'yes')
+    SCHEDULER_PROVIDER_CONCURRENCY = 4
+    SCHEDULER_PROVIDER_LIMITS = {}  # '<adapter type>:<api_base_url>' -> concurrency
+    SCHEDULER_INTERACTIVE_RESERVE = 1
+    SCHEDULER_AGING_SECONDS = 10
+    SCHEDULER_WEIGHTS = {'interactive': 4, 'background': 1, 'probe': 1}
+    SCHEDULER_MAX_WAIT = 60
+
+    # Serialized message cache for conversation detail (per process, LRU by size; 0 disables)
+    TRANSCRIPT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+    # Recent messages kept in memory per conversation for prompt assembly (per process; 0 disables)
+    RECENT_HISTORY_SIZE = 10
+    RECENT_HISTORY_MAX_CONVERSATIONS = 2000
+    RECENT_HISTORY_IDLE_SECONDS = 900
+    RECENT_HISTORY_REVALIDATE_SECONDS = 30
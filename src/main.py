@@ -5,76 +5,114 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from src.models.ai_provider import db, AIProvider, AIPersonality, Conversation, ChatMessage
+from werkzeug.middleware.proxy_fix import ProxyFix
+from src.config import Config
+from src.models.ai_provider import db
 from src.routes.user import user_bp
 from src.routes.ai_providers import ai_providers_bp
 from src.routes.ai_personalities import ai_personalities_bp
 from src.routes.conversations import conversations_bp
+from src.routes.usage import usage_bp
+from src.routes.metrics import metrics_bp
+from src.routes.debug import debug_bp
+from src.services.json_provider import FastJSONProvider
+from src.services.compression import init_compression
+from src.services.events import init_events
+from src.services.metrics import init_metrics
+from src.services.provider_health import init_provider_health
+from src.services.quotas import init_quotas
+from src.services.admission import init_admission
+from src.services.scheduler import init_scheduler
+from src.services.deadlines import init_deadlines
+from src.services.cancellation import init_cancellation
+from src.services.transcript_cache import init_transcript_cache
+from src.services.recent_history import init_recent_history
+from src.services.tracing import init_tracing
+from src.services.sql_profiler import init_sql_profiler
+from src.services.replicas import init_replicas
+from src.services.write_behind import init_write_behind
+from src.services.speculation import init_speculation
+from src.services.embeddings import init_embeddings
+from src.cli import init_db, register_commands
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+def create_app(config=None):
+    """Create and configure the Flask app.
 
-# Enable CORS for specific origins
-# Ho modificato questa riga per essere più esplicito sulle origini permesse
-CORS(app, resources={r"/api/*": {"origins": [
-    "https://ai-frontend-iyvt.onrender.com", # Il tuo frontend su Render
-    "http://localhost:5173", # Per lo sviluppo locale del frontend (se usi la porta predefinita di Vite )
-    # Aggiungi qui altre origini se necessario per lo sviluppo locale o altri ambienti
-]}})
-
-# Register blueprints
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(ai_providers_bp, url_prefix='/api')
-app.register_blueprint(ai_personalities_bp, url_prefix='/api')
-app.register_blueprint(conversations_bp, url_prefix='/api')
-
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize database
-db.init_app(app)
-
-with app.app_context():
-    db.create_all()
+    Has no side effects on the database: run ``flask --app src.main init-db``
+    to create the schema and seed the default provider.
+    """
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
     
-    # Create default OpenAI provider if it doesn't exist
-    existing_provider = AIProvider.query.filter_by(name='OpenAI Default').first()
-    if not existing_provider:
-        default_provider = AIProvider(
-            name='OpenAI Default',
-            api_type='openai',
-            api_base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1' ),
-            api_key=os.getenv('OPENAI_API_KEY', ''),
-            default_model='gpt-4',
-            max_tokens=1000,
-            temperature=0.7
-        )
-        db.session.add(default_provider)
-        db.session.commit()
-        print("Created default OpenAI provider")
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    # Escludi le route API dalla gestione dei file statici
-    if path.startswith('api/'):
-        return "API endpoint not found", 404
+    app.json = FastJSONProvider(app)
+    # Client addresses (anonymous quota buckets) come from the trusted proxies' headers
+    proxies = app.config.get('PROXY_FIX_X_FOR', 0)
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+    init_tracing(app)
+    init_metrics(app)
+    init_sql_profiler(app)
+    init_deadlines(app)
+    init_admission(app)
+    init_scheduler(app)
+    init_compression(app)
     
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-        return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+    # Enable CORS for specific origins
+    CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ORIGINS']}})
+    
+    # Register blueprints
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(ai_providers_bp, url_prefix='/api')
+    app.register_blueprint(ai_personalities_bp, url_prefix='/api')
+    app.register_blueprint(conversations_bp, url_prefix='/api')
+    app.register_blueprint(usage_bp, url_prefix='/api')
+    app.register_blueprint(debug_bp, url_prefix='/api')
+    app.register_blueprint(metrics_bp)
+    
+    # Initialize database
+    init_replicas(app)
+    db.init_app(app)
+    init_events(app)
+    init_provider_health(app)
+    init_quotas(app)
+    init_cancellation(app)
+    init_transcript_cache(app)
+    init_recent_history(app)
+    init_write_behind(app)
+    init_speculation(app)
+    init_embeddings(app)
+    register_commands(app)
+    
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        # Escludi le route API dalla gestione dei file statici
+        if path.startswith('api/'):
+            return "API endpoint not found", 404
+        
+        static_folder_path = app.static_folder
+        if static_folder_path is None:
+            return "Static folder not configured", 404
+        
+        if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
+            return send_from_directory(static_folder_path, path)
         else:
-            return "index.html not found", 404
-
+            index_path = os.path.join(static_folder_path, 'index.html')
+            if os.path.exists(index_path):
+                return send_from_directory(static_folder_path, 'index.html')
+            else:
+                return "index.html not found", 404
+    
+    return app
 
 
 if __name__ == '__main__':
+    # Local development: initialize the database, then start the dev server
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
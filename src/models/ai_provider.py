@@ -3,6 +3,16 @@ import json
 
 from . import db  # ✅ importa l'istanza db dallo stesso package
 
+def select_fields(values, fields=None):
+    """Keep only the requested fields (all of them when fields is None).
+
+    Values may be callables, which are only evaluated when their field is kept,
+    so expensive fields (lazy loads, JSON decoding) cost nothing when skipped.
+    """
+    if fields is not None:
+        values = {name: value for name, value in values.items() if name in fields}
+    return {name: value() if callable(value) else value for name, value in values.items()}
+
 class AIProvider(db.Model):
     __tablename__ = 'ai_providers'
     
@@ -18,10 +28,19 @@ class AIProvider(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Latest health probe (written by src.services.provider_health, leaves updated_at alone)
+    health_status = db.Column(db.String(20), nullable=True)
+    health_latency_ms = db.Column(db.Integer, nullable=True)
+    health_latency_score = db.Column(db.Float, nullable=True)
+    health_error = db.Column(db.Text, nullable=True)
+    health_error_type = db.Column(db.String(30), nullable=True)
+    health_consecutive_failures = db.Column(db.Integer, nullable=True)
+    health_checked_at = db.Column(db.DateTime, nullable=True)
+    
     personalities = db.relationship('AIPersonality', backref='provider', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'name': self.name,
             'api_type': self.api_type,
@@ -32,7 +51,19 @@ class AIProvider(db.Model):
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'personalities_count': len(self.personalities)
+            'personalities_count': lambda: len(self.personalities),
+            'health': self.health_to_dict
+        }, fields)
+    
+    def health_to_dict(self):
+        return {
+            'status': self.health_status or 'unknown',
+            'latency_ms': self.health_latency_ms,
+            'latency_score': self.health_latency_score,
+            'error': self.health_error,
+            'error_type': self.health_error_type,
+            'consecutive_failures': self.health_consecutive_failures or 0,
+            'checked_at': self.health_checked_at.isoformat() if self.health_checked_at else None
         }
 
 class AIPersonality(db.Model):
@@ -52,8 +83,8 @@ class AIPersonality(db.Model):
     
     messages = db.relationship('ChatMessage', backref='personality', lazy=True)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'name': self.name,
             'display_name': self.display_name,
@@ -62,11 +93,11 @@ class AIPersonality(db.Model):
             'avatar_url': self.avatar_url,
             'color_theme': self.color_theme,
             'provider_id': self.provider_id,
-            'provider_name': self.provider.name if self.provider else None,
+            'provider_name': lambda: self.provider.name if self.provider else None,
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+        }, fields)
 
 class Conversation(db.Model):
     __tablename__ = 'conversations'
@@ -78,6 +109,13 @@ class Conversation(db.Model):
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Last in-place edit of one of its messages (cached transcripts of every process are rebuilt after it)
+    edited_at = db.Column(db.DateTime, nullable=True)
+    
+    # Forks inherit their parent's messages up to fork_message_id instead of copying them (see services/forks.py)
+    parent_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=True, index=True)
+    fork_message_id = db.Column(db.Integer, nullable=True)
+    prefix_count = db.Column(db.Integer, nullable=True)
     
     messages = db.relationship('ChatMessage', backref='conversation', lazy=True, cascade='all, delete-orphan')
     
@@ -90,17 +128,29 @@ class Conversation(db.Model):
     def set_participants(self, participant_ids):
         self.participants = json.dumps(participant_ids)
     
-    def to_dict(self):
-        return {
+    def count_messages(self):
+        """Number of messages (inherited ones included), without loading them unless they already are"""
+        if 'messages' in self.__dict__:
+            return len(self.messages) + (self.prefix_count or 0)
+        precomputed = self.__dict__.get('_message_count')
+        if precomputed is not None:
+            return precomputed
+        own = db.session.query(db.func.count(ChatMessage.id)).filter(ChatMessage.conversation_id == self.id).scalar()
+        return own + (self.prefix_count or 0)
+    
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'title': self.title,
             'topic': self.topic,
-            'participants': self.get_participants(),
+            'participants': self.get_participants,
             'status': self.status,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'message_count': len(self.messages)
-        }
+            'parent_id': self.parent_id,
+            'fork_message_id': self.fork_message_id,
+            'message_count': self.count_messages
+        }, fields)
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
@@ -112,7 +162,22 @@ class ChatMessage(db.Model):
     message_type = db.Column(db.String(20), default='text')
     sender_type = db.Column(db.String(20), default='ai')
     message_metadata = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    # Usage accounting for AI messages (kept as columns so it can be aggregated in SQL)
+    provider_id = db.Column(db.Integer, db.ForeignKey('ai_providers.id'), nullable=True)
+    model = db.Column(db.String(100), nullable=True)
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=True)
+    
+    # Float32 embedding used for relevance-based history retrieval (deferred: never needed by to_dict)
+    embedding = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    embedding_model = db.Column(db.String(50), nullable=True)
+    
+    # Alternative replies generated for this turn; content holds the selected one
+    candidates = db.relationship('MessageCandidate', backref='message', lazy=True, cascade='all, delete-orphan',
+                                 passive_deletes=True, order_by='MessageCandidate.candidate_index')
     
     def get_metadata(self):
         try:
@@ -123,17 +188,117 @@ class ChatMessage(db.Model):
     def set_metadata(self, data):
         self.message_metadata = json.dumps(data) if data else None
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'conversation_id': self.conversation_id,
             'personality_id': self.personality_id,
-            'personality_name': self.personality.name if self.personality else None,
-            'personality_display_name': self.personality.display_name if self.personality else None,
-            'personality_color': self.personality.color_theme if self.personality else '#6B7280',
+            'personality_name': lambda: self.personality.name if self.personality else None,
+            'personality_display_name': lambda: self.personality.display_name if self.personality else None,
+            'personality_color': lambda: self.personality.color_theme if self.personality else '#6B7280',
             'content': self.content,
             'message_type': self.message_type,
             'sender_type': self.sender_type,
-            'metadata': self.get_metadata(),
+            'metadata': self.get_metadata,
+            'model': self.model,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'latency_ms': self.latency_ms,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }, fields)
+
+class MessageCandidate(db.Model):
+    """One of the alternative replies generated for an AI message"""
+    __tablename__ = 'message_candidates'
+    __table_args__ = (
+        db.UniqueConstraint('message_id', 'candidate_index', name='uq_message_candidate_index'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('chat_messages.id', ondelete='CASCADE'), nullable=False)
+    conversation_id = db.Column(db.Integer, nullable=False, index=True)
+    candidate_index = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self, selected_index=None):
+        return {
+            'id': self.id,
+            'message_id': self.message_id,
+            'index': self.candidate_index,
+            'content': self.content,
+            'completion_tokens': self.completion_tokens,
+            'selected': self.candidate_index == selected_index,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+class UsageRollup(db.Model):
+    """Token usage pre-aggregated per provider, personality, model and day"""
+    __tablename__ = 'usage_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'provider_id', 'personality_id', 'model', name='uq_usage_rollup_bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    provider_id = db.Column(db.Integer, nullable=False)
+    personality_id = db.Column(db.Integer, nullable=False)
+    model = db.Column(db.String(100), nullable=False, default='')
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    # Provider calls that were cancelled or failed: their tokens are counted, but no message was stored
+    aborted_count = db.Column(db.Integer, nullable=True, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    total_latency_ms = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        calls = self.message_count + (self.aborted_count or 0)
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'provider_id': self.provider_id,
+            'personality_id': self.personality_id,
+            'model': self.model,
+            'message_count': self.message_count,
+            'aborted_count': self.aborted_count or 0,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': (self.prompt_tokens or 0) + (self.completion_tokens or 0),
+            'avg_latency_ms': round(self.total_latency_ms / calls, 1) if calls else None
+        }
+
+class IdempotencyRecord(db.Model):
+    """Stored outcome of a request sent with an Idempotency-Key header"""
+    __tablename__ = 'idempotency_records'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), nullable=False, unique=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='in_progress')
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class CancelRequest(db.Model):
+    """Asks whichever worker runs a conversation's LLM jobs to stop them"""
+    __tablename__ = 'cancel_requests'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, nullable=False, index=True)
+    job_id = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class ReplicaHeartbeat(db.Model):
+    """Timestamp written to the primary; how old it is on a replica is that replica's lag"""
+    __tablename__ = 'replica_heartbeats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+class IdBlock(db.Model):
+    """Next unreserved id of a table whose ids are handed out in blocks before insert"""
+    __tablename__ = 'id_blocks'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
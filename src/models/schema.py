@@ -0,0 +1,37 @@
+from sqlalchemy import inspect, text
+
+from . import db
+
+
+def upgrade_schema():
+    """Add columns and indexes that were introduced after a table was first created.
+
+    ``db.create_all()`` only creates missing tables, so databases created by an
+    older version of the app would miss newer (nullable) columns. This adds them
+    in place with ``ALTER TABLE ... ADD COLUMN``, and creates missing indexes.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or column.primary_key:
+                    continue
+
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.append(f'{table.name}.{column.name}')
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    added.append(index.name)
+
+    return added
@@ -0,0 +1,42 @@
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+
+class RoutingSession(Session):
+    """Session that can send plain SELECTs to a read replica.
+
+    Reads go to the bind named by ``info['read_bind']`` (set per request by
+    src.services.replicas) until the session writes anything; flushes, DML and
+    raw SQL, and every read after them, stay on the primary. A read that fails
+    on the replica at the connection level is run again on the primary, as are
+    the request's later reads.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        read_bind = self.info.get('read_bind')
+        if read_bind is not None and bind is None:
+            if self._flushing or getattr(clause, 'is_dml', False):
+                self.info['read_bind'] = None
+            elif getattr(clause, 'is_select', False) and read_bind in self._db.engines:
+                return self._db.engines[read_bind]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _read_with_fallback(self, method, statement, *args, **kwargs):
+        read_bind = self.info.get('read_bind')
+        try:
+            return method(statement, *args, **kwargs)
+        except DBAPIError as e:
+            failed = isinstance(e, OperationalError) or e.connection_invalidated
+            if read_bind is None or not failed or not getattr(statement, 'is_select', False):
+                raise
+            self.info['read_bind'] = None
+            return method(statement, *args, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        return self._read_with_fallback(super().execute, statement, *args, **kwargs)
+
+    def scalar(self, statement, *args, **kwargs):
+        return self._read_with_fallback(super().scalar, statement, *args, **kwargs)
+
+    def scalars(self, statement, *args, **kwargs):
+        return self._read_with_fallback(super().scalars, statement, *args, **kwargs)
@@ -1,18 +1,44 @@
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+import hashlib
 
-db = SQLAlchemy()
+from . import db
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
 
+    # API key (only its SHA-256 is stored) and per-user quota overrides
+    api_key_hash = db.Column(db.String(64), unique=True, nullable=True, index=True)
+    requests_per_minute = db.Column(db.Integer, nullable=True)
+    daily_token_budget = db.Column(db.Integer, nullable=True)
+
     def __repr__(self):
         return f'<User {self.username}>'
 
+    @staticmethod
+    def hash_api_key(api_key):
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
     def to_dict(self):
         return {
             'id': self.id,
             'username': self.username,
-            'email': self.email
+            'email': self.email,
+            'requests_per_minute': self.requests_per_minute,
+            'daily_token_budget': self.daily_token_budget
         }
+
+class ClientUsage(db.Model):
+    """LLM tokens and requests per client and UTC day, persisted from the in-memory quota counters"""
+    __tablename__ = 'client_usage'
+    __table_args__ = (
+        db.UniqueConstraint('client', 'day', name='uq_client_usage_client_day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    client = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_cors import cross_origin
 from src.models.ai_provider import db, AIProvider, AIPersonality
+from src.services.http_cache import conditional_response, make_etag, precomputed_json, table_stamp
+from src.services.fieldsets import requested_fields
 import json
 
 ai_personalities_bp = Blueprint('ai_personalities', __name__)
@@ -10,11 +12,18 @@ ai_personalities_bp = Blueprint('ai_personalities', __name__)
 def get_personalities():
     """Get all AI personalities"""
     try:
-        personalities = AIPersonality.query.filter_by(is_active=True).all()
-        return jsonify({
-            'success': True,
-            'personalities': [personality.to_dict() for personality in personalities]
-        })
+        # provider_name depends on the providers table as well
+        etag = make_etag('personalities', table_stamp(AIPersonality), table_stamp(AIProvider))
+        
+        def build_response():
+            personalities = AIPersonality.query.filter_by(is_active=True).all()
+            fields = requested_fields('personalities')
+            return jsonify({
+                'success': True,
+                'personalities': [personality.to_dict(fields) for personality in personalities]
+            })
+        
+        return conditional_response(etag, build_response)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -151,9 +160,10 @@ def get_personalities_by_provider(provider_id):
             is_active=True
         ).all()
         
+        fields = requested_fields('personalities')
         return jsonify({
             'success': True,
-            'personalities': [personality.to_dict() for personality in personalities]
+            'personalities': [personality.to_dict(fields) for personality in personalities]
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -201,14 +211,18 @@ Quando non sei sicuro di qualcosa, lo ammetti onestamente.""",
     }
 }
 
+# Templates never change at runtime, so the response body is serialized once
+PERSONALITY_TEMPLATES_BODY = json.dumps({
+    'success': True,
+    'templates': PERSONALITY_TEMPLATES
+}, sort_keys=True).encode('utf-8')
+PERSONALITY_TEMPLATES_ETAG = make_etag(PERSONALITY_TEMPLATES_BODY)
+
 @ai_personalities_bp.route('/personality-templates', methods=['GET'])
 @cross_origin()
 def get_personality_templates():
     """Get predefined personality templates"""
-    return jsonify({
-        'success': True,
-        'templates': PERSONALITY_TEMPLATES
-    })
+    return precomputed_json(PERSONALITY_TEMPLATES_BODY, PERSONALITY_TEMPLATES_ETAG)
 
 @ai_personalities_bp.route('/personalities/from-template', methods=['POST'])
 @cross_origin()
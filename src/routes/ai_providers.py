@@ -1,7 +1,11 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_cors import cross_origin
 from src.models.ai_provider import db, AIProvider, AIPersonality
 from src.services.ai_adapter import AIAdapterFactory
+from src.services.http_cache import conditional_response, make_etag, table_stamp
+from src.services.fieldsets import requested_fields
+from src.services.provider_health import check_providers, health_stamp, record_health
+from src.services.quotas import llm_quota
 import json
 
 ai_providers_bp = Blueprint('ai_providers', __name__)
@@ -11,11 +15,19 @@ ai_providers_bp = Blueprint('ai_providers', __name__)
 def get_providers():
     """Get all AI providers"""
     try:
-        providers = AIProvider.query.filter_by(is_active=True).all()
-        return jsonify({
-            'success': True,
-            'providers': [provider.to_dict() for provider in providers]
-        })
+        # personalities_count depends on the personalities table as well, and
+        # probe results are stored without touching updated_at
+        etag = make_etag('providers', table_stamp(AIProvider), table_stamp(AIPersonality), health_stamp())
+        
+        def build_response():
+            providers = AIProvider.query.filter_by(is_active=True).all()
+            fields = requested_fields('providers')
+            return jsonify({
+                'success': True,
+                'providers': [provider.to_dict(fields) for provider in providers]
+            })
+        
+        return conditional_response(etag, build_response)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -148,6 +160,7 @@ def delete_provider(provider_id):
 
 @ai_providers_bp.route('/providers/<int:provider_id>/test', methods=['POST'])
 @cross_origin()
+@llm_quota()
 def test_provider(provider_id):
     """Test an AI provider connection"""
     try:
@@ -171,6 +184,9 @@ def test_provider(provider_id):
         
         result = adapter.send_message(test_messages)
         
+        record_health(provider, result)
+        db.session.commit()
+        
         if result['success']:
             return jsonify({
                 'success': True,
@@ -187,6 +203,57 @@ def test_provider(provider_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@ai_providers_bp.route('/providers/test-all', methods=['POST'])
+@cross_origin()
+@llm_quota()
+def test_all_providers():
+    """Probe all active providers concurrently and store their health"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        max_timeout = current_app.config.get('HEALTH_PROBE_MAX_TIMEOUT', 60)
+        timeout = data.get('timeout', current_app.config.get('HEALTH_PROBE_TIMEOUT', 10))
+        if not isinstance(timeout, (int, float)) or timeout <= 0 or timeout > max_timeout:
+            return jsonify({'success': False, 'error': f'timeout must be between 0 and {max_timeout} seconds'}), 400
+        
+        provider_ids = data.get('provider_ids')
+        if provider_ids is not None and not isinstance(provider_ids, list):
+            return jsonify({'success': False, 'error': 'provider_ids must be a list'}), 400
+        
+        results = check_providers(provider_ids, include_inactive=bool(data.get('include_inactive')), timeout=timeout)
+        
+        summary = {}
+        for item in results:
+            status = item['health']['status']
+            summary[status] = summary.get(status, 0) + 1
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'summary': summary
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@ai_providers_bp.route('/providers/health', methods=['GET'])
+@cross_origin()
+def get_providers_health():
+    """Get the latest stored health of the active providers, without probing"""
+    try:
+        providers = AIProvider.query.filter_by(is_active=True).order_by(AIProvider.id).all()
+        return jsonify({
+            'success': True,
+            'providers': [{
+                'provider_id': provider.id,
+                'name': provider.name,
+                'health': provider.health_to_dict()
+            } for provider in providers]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @ai_providers_bp.route('/supported-types', methods=['GET'])
 @cross_origin()
 def get_supported_types():
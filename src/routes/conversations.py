@@ -1,21 +1,81 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify
 from flask_cors import cross_origin
-from src.models.ai_provider import db, AIProvider, AIPersonality, Conversation, ChatMessage
-from src.services.ai_adapter import AIAdapterFactory
+from src.models.ai_provider import db, AIProvider, AIPersonality, Conversation, ChatMessage, MessageCandidate
+from src.services.ai_adapter import PROMPT_HISTORY_SIZE, AIAdapterFactory
+from src.services.usage import extract_token_counts, record_aborted_usage, record_usage
+from src.services.embeddings import embed_message, retrieve_relevant
+from src.services.forks import fork_conversation, in_transcript, lineage, materialize_forks, message_scope
+from src.services.http_cache import conditional_response, make_etag
+from src.services.fieldsets import requested_fields
+from src.services.events import get_hub
+from src.services.idempotency import idempotent
+from src.services.quotas import llm_quota
+from src.services.cancellation import cancellable
+from src.services.deadlines import DEADLINE_EXCEEDED, current_deadline
+from src.services.replicas import primary_reads
+from src.services.admission import admission_pool
+from src.services.scheduler import BACKGROUND, INTERACTIVE, call_priority
+from src.services.speculation import get_speculation, speculate_next_turn
+from src.services.turns import latest_message, next_speaker_index, prepare_turn
+from src.services.recent_history import recent_records
+from src.services.transcript_cache import get_transcript_cache, ordered_messages
+from src.services.write_behind import get_write_behind, pending_counts, pending_messages, with_pending
+from src.services.metrics import AUTO_CONTINUE_TURNS
+from src.services import tracing
+from sqlalchemy import func
+import time
+from collections import deque
 import json
 from datetime import datetime
 
 conversations_bp = Blueprint('conversations', __name__)
 
+def _build_ai_message(conversation_id, personality, result, extra_metadata=None):
+    """Create a ChatMessage from an adapter result, with usage stored as columns"""
+    usage = result.get('usage', {})
+    prompt_tokens, completion_tokens = extract_token_counts(usage)
+    
+    metadata = {
+        'usage': usage,
+        'model': result.get('model'),
+        'provider': result.get('provider')
+    }
+    if extra_metadata:
+        metadata.update(extra_metadata)
+    
+    message = ChatMessage(
+        conversation_id=conversation_id,
+        personality_id=personality.id,
+        provider_id=personality.provider_id,
+        content=result['content'],
+        sender_type='ai',
+        model=result.get('model'),
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        latency_ms=result.get('latency_ms'),
+        created_at=datetime.utcnow()
+    )
+    message.set_metadata(metadata)
+    embed_message(message)
+    return message
+
 @conversations_bp.route('/conversations', methods=['GET'])
 @cross_origin()
 def get_conversations():
     """Get all conversations"""
     try:
         conversations = Conversation.query.order_by(Conversation.updated_at.desc()).all()
+        fields = requested_fields('conversations')
+        
+        # Count all conversations' messages in one query instead of one per conversation
+        if fields is None or 'message_count' in fields:
+            counts = dict(db.session.query(ChatMessage.conversation_id, func.count(ChatMessage.id)).group_by(ChatMessage.conversation_id).all())
+            pending = pending_counts()
+            for conv in conversations:
+                conv._message_count = counts.get(conv.id, 0) + pending.get(conv.id, 0) + (conv.prefix_count or 0)
         return jsonify({
             'success': True,
-            'conversations': [conv.to_dict() for conv in conversations]
+            'conversations': [conv.to_dict(fields) for conv in conversations]
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -63,33 +123,188 @@ def create_conversation():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _conversation_stamp(conversation_id):
+    """Version stamp of a conversation detail response, computed in a single query"""
+    message_count = db.session.query(func.count(ChatMessage.id)).filter(
+        ChatMessage.conversation_id == conversation_id
+    ).scalar_subquery()
+    last_message_id = db.session.query(func.max(ChatMessage.id)).filter(
+        ChatMessage.conversation_id == conversation_id
+    ).scalar_subquery()
+    # Messages embed personality names/colors, participants embed provider names
+    personalities_updated = db.session.query(func.max(AIPersonality.updated_at)).scalar_subquery()
+    providers_updated = db.session.query(func.max(AIProvider.updated_at)).scalar_subquery()
+    
+    return db.session.query(
+        Conversation.updated_at,
+        Conversation.participants,
+        Conversation.title,
+        Conversation.topic,
+        Conversation.status,
+        Conversation.edited_at,
+        # A fork's inherited messages never change: where they come from is enough
+        Conversation.parent_id,
+        Conversation.fork_message_id,
+        Conversation.prefix_count,
+        message_count.label('message_count'),
+        last_message_id.label('last_message_id'),
+        personalities_updated.label('personalities_updated'),
+        providers_updated.label('providers_updated')
+    ).filter(Conversation.id == conversation_id).first()
+
 @conversations_bp.route('/conversations/<int:conversation_id>', methods=['GET'])
 @cross_origin()
 def get_conversation(conversation_id):
     """Get a specific conversation with messages"""
     try:
-        conversation = Conversation.query.get_or_404(conversation_id)
-        messages = ChatMessage.query.filter_by(conversation_id=conversation_id).order_by(ChatMessage.created_at.asc()).all()
-        
-        # Get participant details
-        participant_ids = conversation.get_participants()
-        participants = []
-        for pid in participant_ids:
-            personality = AIPersonality.query.get(pid)
-            if personality:
-                participants.append(personality.to_dict())
-        
-        return jsonify({
-            'success': True,
-            'conversation': conversation.to_dict(),
-            'participants': participants,
-            'messages': [msg.to_dict() for msg in messages]
-        })
+        stamp = _conversation_stamp(conversation_id)
+        if stamp is None:
+            return jsonify({'success': False, 'error': 'Conversation not found'}), 404
+        pending = pending_messages(conversation_id)
+        
+        def build_response():
+            conversation = Conversation.query.get_or_404(conversation_id)
+            message_count = stamp.message_count + (stamp.prefix_count or 0)
+            conversation._message_count = message_count + len(pending)
+            scope = message_scope(conversation)
+            last_message_id = stamp.last_message_id
+            if conversation.parent_id is not None:
+                last_message_id = db.session.query(func.max(ChatMessage.id)).filter(scope).scalar()
+            
+            # Get participant details in one query, keeping the conversation's order
+            participant_ids = conversation.get_participants()
+            participant_fields = requested_fields('participants', primary=False)
+            personalities = {
+                personality.id: personality
+                for personality in AIPersonality.query.filter(AIPersonality.id.in_(participant_ids)).all()
+            } if participant_ids else {}
+            participants = [personalities[pid].to_dict(participant_fields) for pid in participant_ids if pid in personalities]
+            
+            # A plain ?fields= applies to messages, the bulk of the response
+            message_fields = requested_fields('messages')
+            conversation_data = conversation.to_dict(requested_fields('conversation', primary=False))
+            
+            cache = get_transcript_cache()
+            json_provider = current_app.json
+            pretty = json_provider.compact is False or (json_provider.compact is None and current_app.debug)
+            if cache is not None and message_fields is None and not pretty and not pending and hasattr(json_provider, 'dumps_bytes'):
+                # Full transcripts come from the serialized-fragment cache
+                messages_json = cache.messages_json(
+                    conversation_id,
+                    message_count,
+                    last_message_id,
+                    (stamp.personalities_updated, stamp.edited_at),
+                    json_provider.dumps_bytes,
+                    scope
+                )
+                body = b''.join((
+                    b'{"conversation":', json_provider.dumps_bytes(conversation_data),
+                    b',"messages":', messages_json,
+                    b',"participants":', json_provider.dumps_bytes(participants),
+                    b',"success":true}\n'
+                ))
+                return current_app.response_class(body, mimetype=json_provider.mimetype)
+            
+            messages = ordered_messages(ChatMessage.query.filter(scope))
+            if pending:
+                # Messages still queued for write-behind are part of the transcript already
+                messages = with_pending(conversation_id, messages[::-1])[::-1]
+            return jsonify({
+                'success': True,
+                'conversation': conversation_data,
+                'participants': participants,
+                'messages': [msg.to_dict(message_fields) for msg in messages]
+            })
+        
+        etag = make_etag('conversation', conversation_id, tuple(stamp) + tuple(message.id for message in pending))
+        return conditional_response(etag, build_response, 'private, no-cache')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _format_sse(item, dumps):
+    lines = []
+    if item.get('id') is not None:
+        lines.append(f"id: {item['id']}")
+    lines.append(f"event: {item['type']}")
+    lines.append(f"data: {dumps(item['data'])}")
+    return '\n'.join(lines) + '\n\n'
+
+@conversations_bp.route('/conversations/<int:conversation_id>/events', methods=['GET'])
+@cross_origin()
+@primary_reads
+@admission_pool('stream')
+def conversation_events(conversation_id):
+    """Stream conversation events (new messages, updates) as Server-Sent Events"""
+    try:
+        conversation = Conversation.query.get(conversation_id)
+        if conversation is None:
+            return jsonify({'success': False, 'error': 'Conversation not found'}), 404
+        
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Last-Event-ID must be a message id'}), 400
+        
+        # Subscribe before replaying so nothing committed in between is lost
+        hub = get_hub()
+        subscription = hub.subscribe(conversation_id)
+        
+        replay = []
+        replayed_ids = []
+        if last_event_id is not None:
+            missed = ChatMessage.query.filter(
+                message_scope(conversation),
+                ChatMessage.id > last_event_id
+            ).order_by(ChatMessage.id.asc()).all()
+            missed = sorted(
+                [msg for msg in with_pending(conversation_id, missed) if msg.id > last_event_id],
+                key=lambda msg: msg.id
+            )
+            replay = [_format_sse({'id': msg.id, 'type': 'message', 'data': msg.to_dict()}, current_app.json.dumps) for msg in missed]
+            replayed_ids = [msg.id for msg in missed]
+        
+        dumps = current_app.json.dumps
+        heartbeat = current_app.config.get('EVENTS_HEARTBEAT_INTERVAL', 15)
+        max_duration = current_app.config.get('EVENTS_MAX_STREAM_SECONDS', 300)
+        
+        def stream():
+            # Runs after the request context is gone: everything it needs is captured above
+            started = time.monotonic()
+            # Ids are not in commit order (write-behind), so remember which were sent rather than the highest
+            sent_ids = deque(replayed_ids, maxlen=1000)
+            try:
+                yield "retry: 3000\n\n"
+                yield from replay
+                
+                while time.monotonic() - started < max_duration:
+                    item = subscription.get(timeout=heartbeat)
+                    if subscription.overflowed:
+                        # Too slow to keep up: make the client reconnect and resume from the database
+                        yield "event: reset\ndata: {}\n\n"
+                        return
+                    if item is None:
+                        yield ": heartbeat\n\n"
+                        continue
+                    if item.get('id') is not None:
+                        if item['id'] in sent_ids:
+                            continue
+                        sent_ids.append(item['id'])
+                    yield _format_sse(item, dumps)
+            finally:
+                hub.unsubscribe(subscription)
+        
+        response = Response(stream(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @conversations_bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
 @cross_origin()
+@llm_quota()
+@idempotent
 def send_message(conversation_id):
     """Send a message in a conversation"""
     try:
@@ -99,10 +314,15 @@ def send_message(conversation_id):
         personality_id = data.get('personality_id')
         content = data.get('content')
         sender_type = data.get('sender_type', 'ai')  # 'ai' or 'user'
+        candidates = data.get('candidates', 1)  # Alternative AI replies to generate
         
         if not content:
             return jsonify({'success': False, 'error': 'Message content is required'}), 400
         
+        max_candidates = current_app.config.get('MAX_CANDIDATES', 5)
+        if not isinstance(candidates, int) or isinstance(candidates, bool) or not 1 <= candidates <= max_candidates:
+            return jsonify({'success': False, 'error': f'Candidates must be between 1 and {max_candidates}'}), 400
+        
         if sender_type == 'ai' and not personality_id:
             return jsonify({'success': False, 'error': 'Personality ID required for AI messages'}), 400
         
@@ -117,9 +337,7 @@ def send_message(conversation_id):
                 return jsonify({'success': False, 'error': 'Personality not part of this conversation'}), 400
             
             # Get conversation history for context
-            recent_messages = ChatMessage.query.filter_by(
-                conversation_id=conversation_id
-            ).order_by(ChatMessage.created_at.desc()).limit(10).all()
+            recent_messages = recent_records(conversation, 10)
             
             # Create AI adapter
             provider = personality.provider
@@ -132,31 +350,58 @@ def send_message(conversation_id):
                 temperature=provider.temperature
             )
             
+            # Older messages relevant to this one, beyond the ones the prompt includes
+            relevant_messages = retrieve_relevant(
+                conversation,
+                content,
+                exclude_ids=[msg['id'] for msg in recent_messages[:PROMPT_HISTORY_SIZE] if msg['id'] is not None]
+            )
+            
             # Format messages for AI
             messages = adapter.format_messages(
                 system_prompt=personality.system_prompt,
                 user_message=content,
-                conversation_history=[msg.to_dict() for msg in reversed(recent_messages)]
+                conversation_history=recent_messages[::-1],
+                relevant_history=[msg.to_dict() for msg in relevant_messages]
             )
             
-            # Get AI response
-            result = adapter.send_message(messages)
+            # Get AI response (aborted if the client goes away or the conversation is cancelled)
+            with cancellable(conversation_id) as cancel_token, call_priority(INTERACTIVE, conversation_id):
+                if candidates > 1:
+                    result = adapter.send_candidates(messages, candidates)
+                else:
+                    result = adapter.send_message(messages)
+            
+            if not result['success'] and result.get('usage'):
+                # Cancelled and failed calls were still (partly) paid for
+                record_aborted_usage(provider.id, personality.id, result)
+                db.session.commit()
+            if result.get('error_type') == DEADLINE_EXCEEDED or cancel_token.reason == DEADLINE_EXCEEDED:
+                return jsonify({'success': False, 'error': 'Request deadline exceeded', 'deadline_exceeded': True}), 504
+            if result.get('error_type') == 'cancelled':
+                return jsonify({'success': False, 'error': 'Request cancelled', 'cancelled': True}), 499
             
             if not result['success']:
                 return jsonify({'success': False, 'error': f'AI response failed: {result["error"]}'}), 500
             
             # Create message with AI response
-            message = ChatMessage(
-                conversation_id=conversation_id,
-                personality_id=personality_id,
-                content=result['content'],
-                sender_type='ai',
-                metadata=json.dumps({
-                    'usage': result.get('usage', {}),
-                    'model': result.get('model'),
-                    'provider': result.get('provider')
+            if result.get('candidates'):
+                # The first candidate is the turn's reply until another one is selected
+                message = _build_ai_message(conversation_id, personality, result, {
+                    'candidates': len(result['candidates']),
+                    'candidate_index': 0
                 })
-            )
+                message.candidates = [
+                    MessageCandidate(
+                        conversation_id=conversation_id,
+                        candidate_index=index,
+                        content=candidate,
+                        completion_tokens=result['candidate_usage'][index]
+                    )
+                    for index, candidate in enumerate(result['candidates'])
+                ]
+            else:
+                message = _build_ai_message(conversation_id, personality, result)
         else:
             # User message
             message = ChatMessage(
@@ -165,25 +410,99 @@ def send_message(conversation_id):
                 content=content,
                 sender_type='user'
             )
+            embed_message(message)
+            
+            # With write-behind the message is acknowledged once queued and committed in a later batch
+            writer = get_write_behind()
+            pending = writer.submit(message) if writer is not None else None
+            if pending is not None:
+                return jsonify({
+                    'success': True,
+                    'message': pending.to_dict()
+                })
         
         db.session.add(message)
+        record_usage(message)
         
         # Update conversation timestamp
         conversation.updated_at = datetime.utcnow()
         
         db.session.commit()
         
-        return jsonify({
+        response = {
             'success': True,
             'message': message.to_dict()
+        }
+        if sender_type == 'ai' and result.get('candidates'):
+            response['candidates'] = [candidate.to_dict(0) for candidate in message.candidates]
+        return jsonify(response)
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@conversations_bp.route('/conversations/<int:conversation_id>/messages/<int:message_id>/candidates', methods=['GET'])
+@cross_origin()
+def get_message_candidates(conversation_id, message_id):
+    """Get the alternative replies generated for a message"""
+    try:
+        conversation = Conversation.query.get_or_404(conversation_id)
+        message = ChatMessage.query.get(message_id)
+        # A fork lists the candidates of the messages it inherits too
+        if message is None or not in_transcript(conversation, message):
+            return jsonify({'success': False, 'error': 'Message not found'}), 404
+        selected = message.get_metadata().get('candidate_index')
+        return jsonify({
+            'success': True,
+            'message_id': message.id,
+            'selected_index': selected,
+            'candidates': [candidate.to_dict(selected) for candidate in message.candidates]
         })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@conversations_bp.route('/conversations/<int:conversation_id>/messages/<int:message_id>/candidates/<int:candidate_index>/select', methods=['POST'])
+@cross_origin()
+def select_message_candidate(conversation_id, message_id, candidate_index):
+    """Make one of a message's candidates its content (the reply later turns build on)"""
+    try:
+        message = ChatMessage.query.filter_by(id=message_id, conversation_id=conversation_id).first()
+        if message is None:
+            conversation = Conversation.query.get_or_404(conversation_id)
+            inherited = ChatMessage.query.get(message_id)
+            if inherited is not None and in_transcript(conversation, inherited):
+                return jsonify({'success': False, 'error': f'Message is inherited from conversation {inherited.conversation_id}'}), 409
+            return jsonify({'success': False, 'error': 'Message not found'}), 404
+        candidate = MessageCandidate.query.filter_by(message_id=message.id, candidate_index=candidate_index).first()
+        if candidate is None:
+            return jsonify({'success': False, 'error': 'Candidate not found'}), 404
+        
+        metadata = message.get_metadata()
+        if metadata.get('candidate_index') != candidate_index:
+            # Forks inheriting the message keep the reply they were forked with
+            materialize_forks(message.conversation, through=message)
+            message.content = candidate.content
+            metadata['candidate_index'] = candidate_index
+            message.set_metadata(metadata)
+            embed_message(message)
+            
+            # Cached transcripts of every process are rebuilt after an edit; the new timestamp changes the ETag
+            message.conversation.updated_at = message.conversation.edited_at = datetime.utcnow()
+            db.session.commit()
         
+        return jsonify({
+            'success': True,
+            'message': message.to_dict(),
+            'candidates': [item.to_dict(candidate_index) for item in message.candidates]
+        })
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @conversations_bp.route('/conversations/<int:conversation_id>/auto-continue', methods=['POST'])
 @cross_origin()
+@llm_quota(cost=lambda req: (req.get_json(silent=True) or {}).get('rounds', 1))
+@idempotent
 def auto_continue_conversation(conversation_id):
     """Automatically continue conversation between AIs"""
     try:
@@ -199,105 +518,207 @@ def auto_continue_conversation(conversation_id):
             return jsonify({'success': False, 'error': 'Need at least 2 participants for auto-continue'}), 400
         
         # Get the last message to determine who should respond next
-        last_message = ChatMessage.query.filter_by(
-            conversation_id=conversation_id
-        ).order_by(ChatMessage.created_at.desc()).first()
+        last_message = latest_message(conversation)
         
         if not last_message:
             return jsonify({'success': False, 'error': 'No messages in conversation to continue from'}), 400
         
         new_messages = []
-        current_speaker_idx = 0
+        turns = []
+        
+        # Turns are only started when one can still finish before the request deadline
+        deadline = current_deadline()
+        expected_turn_seconds = current_app.config.get('AUTO_CONTINUE_MIN_TURN_SECONDS', 5)
+        deadline_exceeded = False
         
         # Determine next speaker
-        if last_message.personality_id:
-            try:
-                current_speaker_idx = participants.index(last_message.personality_id)
-                current_speaker_idx = (current_speaker_idx + 1) % len(participants)
-            except ValueError:
-                current_speaker_idx = 0
-        
-        # Generate conversation rounds
-        for round_num in range(rounds):
-            for turn in range(len(participants)):
-                speaker_id = participants[(current_speaker_idx + turn) % len(participants)]
-                personality = AIPersonality.query.get(speaker_id)
+        current_speaker_idx = next_speaker_index(participants, last_message)
+        
+        # Generate conversation rounds; stops between turns (or mid-reply) once cancelled.
+        # Turns are batch work: their provider calls yield to interactive ones
+        with cancellable(conversation_id) as cancel_token, call_priority(BACKGROUND, conversation_id):
+            for round_num in range(rounds):
+                if cancel_token.cancelled:
+                    break
+                for turn in range(len(participants)):
+                    if cancel_token.cancelled:
+                        break
+                    if deadline is not None and deadline.remaining() < expected_turn_seconds:
+                        deadline_exceeded = True
+                        break
+                    speaker_id = participants[(current_speaker_idx + turn) % len(participants)]
+                    turn_started = time.monotonic()
+                    with tracing.start_span('auto_continue.turn', {
+                        'conversation.id': conversation_id,
+                        'auto_continue.round': round_num + 1,
+                        'auto_continue.turn': turn + 1,
+                        'personality.id': speaker_id
+                    }) as span:
+                        personality = AIPersonality.query.get(speaker_id)
                 
-                if not personality or not personality.is_active:
-                    continue
+                        if not personality or not personality.is_active:
+                            AUTO_CONTINUE_TURNS.inc(outcome='skipped')
+                            span.set_attribute('auto_continue.outcome', 'skipped')
+                            turns.append({'round': round_num + 1, 'turn': turn + 1, 'personality_id': speaker_id, 'outcome': 'skipped'})
+                            continue
                 
-                # Get recent conversation history
-                recent_messages = ChatMessage.query.filter_by(
-                    conversation_id=conversation_id
-                ).order_by(ChatMessage.created_at.desc()).limit(10).all()
+                        adapter, messages = prepare_turn(conversation, personality)
                 
-                # Create context message for the AI
-                if recent_messages:
-                    last_msg = recent_messages[0]
-                    if last_msg.personality_id and last_msg.personality_id != speaker_id:
-                        other_personality = AIPersonality.query.get(last_msg.personality_id)
-                        context_message = f"{other_personality.display_name if other_personality else 'Someone'} ha detto: \"{last_msg.content}\". Rispondi a questa affermazione continuando la conversazione."
-                    else:
-                        context_message = "Continua la conversazione basandoti sui messaggi precedenti."
-                else:
-                    context_message = "Inizia o continua la conversazione."
+                        # Get AI response, or the draft speculatively generated for this turn
+                        speculation = get_speculation()
+                        result = speculation.take(
+                            conversation_id, personality.id, adapter, messages, adapter.call_timeout()
+                        ) if speculation is not None else None
+                        if result is None:
+                            result = adapter.send_message(messages)
                 
-                # Create AI adapter
-                provider = personality.provider
-                adapter = AIAdapterFactory.create_adapter(
-                    api_type=provider.api_type,
-                    api_key=provider.api_key,
-                    api_base_url=provider.api_base_url,
-                    model=provider.default_model,
-                    max_tokens=provider.max_tokens,
-                    temperature=provider.temperature
-                )
-                
-                # Format messages for AI
-                messages = adapter.format_messages(
-                    system_prompt=personality.system_prompt,
-                    user_message=context_message,
-                    conversation_history=[msg.to_dict() for msg in reversed(recent_messages)]
-                )
-                
-                # Get AI response
-                result = adapter.send_message(messages)
-                
-                if result['success']:
-                    # Create message
-                    message = ChatMessage(
-                        conversation_id=conversation_id,
-                        personality_id=speaker_id,
-                        content=result['content'],
-                        sender_type='ai',
-                        metadata=json.dumps({
-                            'usage': result.get('usage', {}),
-                            'model': result.get('model'),
-                            'provider': result.get('provider'),
-                            'auto_generated': True,
-                            'round': round_num + 1,
-                            'turn': turn + 1
-                        })
-                    )
+                        if result.get('error_type') == 'cancelled':
+                            outcome = DEADLINE_EXCEEDED if cancel_token.reason == DEADLINE_EXCEEDED else 'cancelled'
+                            record_aborted_usage(personality.provider_id, personality.id, result)
+                        elif result.get('error_type') == DEADLINE_EXCEEDED:
+                            outcome = DEADLINE_EXCEEDED
+                        else:
+                            outcome = 'success' if result['success'] else 'failed'
+                        deadline_exceeded = deadline_exceeded or outcome == DEADLINE_EXCEEDED
+                        AUTO_CONTINUE_TURNS.inc(outcome=outcome)
+                        span.set_attribute('auto_continue.outcome', outcome)
+                        turns.append({'round': round_num + 1, 'turn': turn + 1, 'personality_id': speaker_id, 'outcome': outcome})
+                        expected_turn_seconds = max(expected_turn_seconds, time.monotonic() - turn_started)
+                        if result['success']:
+                            # Create message
+                            metadata = {
+                                'auto_generated': True,
+                                'round': round_num + 1,
+                                'turn': turn + 1
+                            }
+                            if result.get('speculative'):
+                                metadata['speculative'] = True
+                            message = _build_ai_message(conversation_id, personality, result, metadata)
                     
-                    db.session.add(message)
-                    new_messages.append(message)
+                            db.session.add(message)
+                            record_usage(message)
+                            new_messages.append(message)
+                            turns[-1]['message'] = message
+                if deadline_exceeded:
+                    break
         
         # Update conversation timestamp
         conversation.updated_at = datetime.utcnow()
         
         db.session.commit()
+        if new_messages and not cancel_token.cancelled:
+            speculate_next_turn(conversation_id)
         
+        # Messages generated before a cancellation or the deadline are kept (they were paid for)
+        for completed in turns:
+            message = completed.pop('message', None)
+            completed['message_id'] = message.id if message is not None else None
         return jsonify({
             'success': True,
             'new_messages': [msg.to_dict() for msg in new_messages],
-            'message': f'Generated {len(new_messages)} new messages'
+            'message': f'Generated {len(new_messages)} new messages',
+            'turns': turns,
+            'cancelled': cancel_token.cancelled and cancel_token.reason != DEADLINE_EXCEEDED,
+            'deadline_exceeded': deadline_exceeded
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@conversations_bp.route('/conversations/<int:conversation_id>/cancel', methods=['POST'])
+@cross_origin()
+def cancel_conversation_jobs(conversation_id):
+    """Cancel the LLM calls running for a conversation (optionally only the one sent with X-Job-Id: job_id)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        job_id = data.get('job_id')
+        cancelled = current_app.extensions['cancellation'].request_cancel(conversation_id, job_id)
+        return jsonify({
+            'success': True,
+            'cancelled_here': cancelled,
+            'message': 'Cancellation requested'
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@conversations_bp.route('/conversations/<int:conversation_id>/fork', methods=['POST'])
+@cross_origin()
+def fork_conversation_at(conversation_id):
+    """Fork a conversation at one of its messages (the latest by default), sharing the transcript up to it"""
+    try:
+        conversation = Conversation.query.get_or_404(conversation_id)
+        data = request.get_json(silent=True) or {}
+        
+        at_message = request.args.get('at_message', data.get('at_message'))
+        if at_message is None:
+            message = ChatMessage.query.filter(message_scope(conversation)).order_by(
+                ChatMessage.created_at.desc(), ChatMessage.id.desc()
+            ).first()
+            if message is None:
+                return jsonify({'success': False, 'error': 'No messages in conversation to fork from'}), 400
+        else:
+            try:
+                message = ChatMessage.query.get(int(at_message))
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'at_message must be a message id'}), 400
+            if message is None or not in_transcript(conversation, message):
+                return jsonify({'success': False, 'error': 'Message not found in this conversation'}), 404
+        
+        # Messages up to at_message are referenced, not copied
+        fork = fork_conversation(conversation, message, data.get('title'))
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'conversation': fork.to_dict(),
+            'message': 'Conversation forked successfully'
         })
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@conversations_bp.route('/conversations/<int:conversation_id>/export', methods=['GET'])
+@cross_origin()
+def export_conversation(conversation_id):
+    """Export a conversation's whole transcript, inherited messages included, with the forks it comes from"""
+    try:
+        conversation = Conversation.query.get_or_404(conversation_id)
+        
+        segments = lineage(conversation)
+        titles = dict(db.session.query(Conversation.id, Conversation.title).filter(
+            Conversation.id.in_([segment_id for segment_id, _ in segments])
+        ).all())
+        messages = ordered_messages(ChatMessage.query.filter(message_scope(conversation)))
+        messages = with_pending(conversation_id, messages[::-1])[::-1]
+        
+        participant_ids = conversation.get_participants()
+        personalities = {
+            personality.id: personality
+            for personality in AIPersonality.query.filter(AIPersonality.id.in_(participant_ids)).all()
+        } if participant_ids else {}
+        
+        return jsonify({
+            'success': True,
+            'conversation': conversation.to_dict(),
+            # Root first; each segment is that conversation's own messages up to through_message_id
+            'lineage': [
+                {
+                    'conversation_id': segment_id,
+                    'title': titles.get(segment_id),
+                    'through_message_id': last.id if last is not None else None
+                }
+                for segment_id, last in segments
+            ],
+            'participants': [personalities[pid].to_dict() for pid in participant_ids if pid in personalities],
+            'messages': [msg.to_dict() for msg in messages],
+            'exported_at': datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @conversations_bp.route('/conversations/<int:conversation_id>', methods=['PUT'])
 @cross_origin()
 def update_conversation(conversation_id):
@@ -345,6 +766,11 @@ def delete_conversation(conversation_id):
     try:
         conversation = Conversation.query.get_or_404(conversation_id)
         
+        # Forks inheriting its messages get their own copies first
+        materialize_forks(conversation)
+        
+        # Candidates are deleted in bulk rather than loaded through each message
+        MessageCandidate.query.filter_by(conversation_id=conversation_id).delete(synchronize_session=False)
         db.session.delete(conversation)
         db.session.commit()
         
@@ -0,0 +1,36 @@
+from flask import Blueprint, current_app, request, jsonify
+from src.services.tracing import RingBufferExporter, app_tracer
+
+debug_bp = Blueprint('debug', __name__)
+
+def _trace_buffer():
+    """The in-memory span buffer, when the debug endpoint is enabled"""
+    if not (current_app.debug or current_app.config.get('TRACING_DEBUG_ENDPOINT')):
+        return None
+    exporter = app_tracer().exporter
+    return exporter if isinstance(exporter, RingBufferExporter) else None
+
+@debug_bp.route('/debug/traces', methods=['GET'])
+def get_traces():
+    """List the most recent sampled traces"""
+    buffer = _trace_buffer()
+    if buffer is None:
+        return jsonify({'success': False, 'error': 'Trace buffer not available'}), 404
+
+    limit = max(1, min(request.args.get('limit', 20, type=int), 200))
+    traces = buffer.traces(limit)
+    if request.args.get('spans') != '1':
+        traces = [{key: value for key, value in trace.items() if key != 'spans'} for trace in traces]
+    return jsonify({'success': True, 'traces': traces})
+
+@debug_bp.route('/debug/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """Get all buffered spans of a trace"""
+    buffer = _trace_buffer()
+    if buffer is None:
+        return jsonify({'success': False, 'error': 'Trace buffer not available'}), 404
+
+    trace = buffer.trace(trace_id)
+    if trace is None:
+        return jsonify({'success': False, 'error': 'Trace not found'}), 404
+    return jsonify({'success': True, 'trace': trace})
@@ -0,0 +1,26 @@
+from flask import Blueprint, current_app, jsonify
+from src.services.metrics import REGISTRY, multiproc_dir
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose metrics in the Prometheus text format"""
+    body = REGISTRY.render(multiproc_dir(current_app))
+    return current_app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+@metrics_bp.route('/metrics/admission', methods=['GET'])
+def get_admission_stats():
+    """Admission pools of this process: in-flight requests, queue depth and shed counts"""
+    controller = current_app.extensions.get('admission')
+    if controller is None:
+        return jsonify({'success': False, 'error': 'Admission control is disabled'}), 404
+    return jsonify({'success': True, 'pools': controller.stats()})
+
+@metrics_bp.route('/metrics/scheduler', methods=['GET'])
+def get_scheduler_stats():
+    """Provider call queues of this process: slots in use and calls waiting per priority"""
+    scheduler = current_app.extensions.get('scheduler')
+    if scheduler is None:
+        return jsonify({'success': False, 'error': 'Call scheduling is disabled'}), 404
+    return jsonify({'success': True, 'providers': scheduler.stats()})
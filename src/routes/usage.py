@@ -0,0 +1,63 @@
+from flask import Blueprint, request, jsonify
+from flask_cors import cross_origin
+from src.services.usage import USAGE_DIMENSIONS, query_usage
+from datetime import datetime
+
+usage_bp = Blueprint('usage', __name__)
+
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+@usage_bp.route('/usage', methods=['GET'])
+@cross_origin()
+def get_usage():
+    """Get aggregated token usage from the daily rollups"""
+    try:
+        try:
+            start = _parse_day(request.args.get('start'))
+            end = _parse_day(request.args.get('end'))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Dates must use the YYYY-MM-DD format'}), 400
+
+        if start and end and start > end:
+            return jsonify({'success': False, 'error': 'start must be before end'}), 400
+
+        group_by = [name.strip() for name in request.args.get('group_by', '').split(',') if name.strip()]
+        for name in group_by:
+            if name not in USAGE_DIMENSIONS:
+                return jsonify({
+                    'success': False,
+                    'error': f'Unsupported group_by value: {name}. Supported values: {list(USAGE_DIMENSIONS)}'
+                }), 400
+
+        usage = query_usage(
+            start=start,
+            end=end,
+            group_by=group_by or None,
+            provider=request.args.get('provider_id', type=int),
+            personality=request.args.get('personality_id', type=int),
+            model=request.args.get('model')
+        )
+        totals = query_usage(
+            start=start,
+            end=end,
+            group_by=[],
+            provider=request.args.get('provider_id', type=int),
+            personality=request.args.get('personality_id', type=int),
+            model=request.args.get('model')
+        )
+
+        return jsonify({
+            'success': True,
+            'usage': usage,
+            'totals': totals[0] if totals else {
+                'message_count': 0,
+                'aborted_count': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'total_tokens': 0,
+                'avg_latency_ms': None
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
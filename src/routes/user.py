@@ -1,5 +1,8 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from src.models.user import User, db
+from src.services.auth import admin_required, authenticated_user, is_admin
+from src.services.quotas import current_client
+import secrets
 
 user_bp = Blueprint('user', __name__)
 
@@ -9,13 +12,22 @@ def get_users():
     return jsonify([user.to_dict() for user in users])
 
 @user_bp.route('/users', methods=['POST'])
+@admin_required
 def create_user():
     
     data = request.json
-    user = User(username=data['username'], email=data['email'])
+    api_key = secrets.token_urlsafe(32)
+    user = User(
+        username=data['username'],
+        email=data['email'],
+        api_key_hash=User.hash_api_key(api_key),
+        requests_per_minute=data.get('requests_per_minute'),
+        daily_token_budget=data.get('daily_token_budget')
+    )
     db.session.add(user)
     db.session.commit()
-    return jsonify(user.to_dict()), 201
+    # The key is only ever shown here
+    return jsonify({**user.to_dict(), 'api_key': api_key}), 201
 
 @user_bp.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
@@ -23,15 +35,40 @@ def get_user(user_id):
     return jsonify(user.to_dict())
 
 @user_bp.route('/users/<int:user_id>', methods=['PUT'])
+@admin_required
 def update_user(user_id):
     user = User.query.get_or_404(user_id)
     data = request.json
     user.username = data.get('username', user.username)
     user.email = data.get('email', user.email)
+    user.requests_per_minute = data.get('requests_per_minute', user.requests_per_minute)
+    user.daily_token_budget = data.get('daily_token_budget', user.daily_token_budget)
     db.session.commit()
     return jsonify(user.to_dict())
 
+@user_bp.route('/users/<int:user_id>/api-key', methods=['POST'])
+def rotate_api_key(user_id):
+    user = User.query.get_or_404(user_id)
+    # Users rotate their own key by presenting the current one
+    if not is_admin(request):
+        caller = authenticated_user(request)
+        if caller is None or caller.id != user.id:
+            return jsonify({'success': False, 'error': 'Authenticate with the current API key of this user'}), 403
+    api_key = secrets.token_urlsafe(32)
+    user.api_key_hash = User.hash_api_key(api_key)
+    db.session.commit()
+    return jsonify({**user.to_dict(), 'api_key': api_key})
+
+@user_bp.route('/quota', methods=['GET'])
+def get_quota():
+    manager = current_app.extensions.get('quotas')
+    client = current_client()
+    if manager is None or client is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **manager.status(client)})
+
 @user_bp.route('/users/<int:user_id>', methods=['DELETE'])
+@admin_required
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
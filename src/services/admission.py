@@ -0,0 +1,178 @@
+"""Admission control for API requests.
+
+Requests are admitted into bounded concurrency pools: views marked
+``@llm_quota`` (provider calls that hold a thread for seconds to minutes) go to
+``llm``, the SSE stream to ``stream`` and everything else under ``/api`` to
+``default`` (``admission_pool(name)`` overrides this). A request that finds its
+pool busy waits in a short queue; when the queue is full, or the wait exceeds
+the pool's ``queue_timeout``, it is shed with ``503`` and a ``Retry-After``
+estimated from recent service times. Slow LLM traffic can then only take its
+own share of the worker threads and cheap reads keep their latency.
+
+Pools are per process, like gunicorn's threads; size them so that the llm and
+stream pools (concurrency plus queue) leave threads for the default pool.
+"""
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+from flask import current_app, g, jsonify, request
+
+from src.services.metrics import REGISTRY
+
+ADMISSION_IN_FLIGHT = REGISTRY.gauge(
+    'admission_in_flight', 'Requests running in each admission pool', ['pool'])
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    'admission_queue_depth', 'Requests waiting for a slot in each admission pool', ['pool'])
+ADMISSION_SHED = REGISTRY.counter(
+    'admission_shed_total', 'Requests refused with 503 by admission control', ['pool', 'reason'])
+ADMISSION_WAIT = REGISTRY.histogram(
+    'admission_queue_wait_seconds', 'Time admitted requests waited for a slot', ['pool'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+class Pool:
+    def __init__(self, name: str, concurrency: int, queue: int = 0, queue_timeout: float = 0):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed: Dict[str, int] = {}
+        self.avg_seconds: Optional[float] = None
+        self.cond = threading.Condition()
+
+    def acquire(self) -> Optional[str]:
+        """Take a slot, waiting in the queue if needed; returns why the request was shed otherwise"""
+        started = time.monotonic()
+        with self.cond:
+            if self.active >= self.concurrency or self.waiting:
+                if self.waiting >= self.max_queue:
+                    return self._shed('queue_full')
+                self.waiting += 1
+                try:
+                    deadline = started + self.queue_timeout
+                    while self.active >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return self._shed('queue_timeout')
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+        ADMISSION_WAIT.observe(time.monotonic() - started, pool=self.name)
+        return None
+
+    def _shed(self, reason: str) -> str:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        ADMISSION_SHED.inc(pool=self.name, reason=reason)
+        return reason
+
+    def release(self, seconds: float):
+        with self.cond:
+            self.active -= 1
+            self.avg_seconds = seconds if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * seconds
+            self.cond.notify()
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog has likely drained"""
+        per_request = self.avg_seconds if self.avg_seconds is not None else 1.0
+        return max(1, min(120, math.ceil(per_request * (self.waiting + 1) / max(1, self.concurrency))))
+
+    def stats(self) -> Dict:
+        return {
+            'concurrency': self.concurrency,
+            'queue_size': self.max_queue,
+            'in_flight': self.active,
+            'queue_depth': self.waiting,
+            'admitted': self.admitted,
+            'shed': dict(self.shed),
+            'avg_seconds': round(self.avg_seconds, 3) if self.avg_seconds is not None else None
+        }
+
+
+class AdmissionController:
+    def __init__(self, pools: Dict[str, Dict]):
+        self.pools = {name: Pool(name, **settings) for name, settings in pools.items()}
+
+    def pool_for(self, view) -> Pool:
+        name = getattr(view, 'admission_pool', None)
+        if name is None:
+            name = 'llm' if getattr(view, 'quota_llm', False) else 'default'
+        return self.pools.get(name) or self.pools['default']
+
+    def stats(self) -> Dict:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    def collect(self, gauge, attribute: str):
+        for name, pool in self.pools.items():
+            gauge.set(getattr(pool, attribute), pool=name)
+
+
+def admission_pool(name: str):
+    """Admit a view through the named pool instead of the default one"""
+    def decorator(view):
+        view.admission_pool = name
+        return view
+    return decorator
+
+
+def _admit():
+    if not request.path.startswith('/api/') or request.method == 'OPTIONS':
+        return None
+    controller = current_app.extensions['admission']
+    pool = controller.pool_for(current_app.view_functions.get(request.endpoint))
+    reason = pool.acquire()
+    if reason is None:
+        g.admission = [pool, time.monotonic()]
+        return None
+
+    retry_after = pool.retry_after()
+    response = jsonify({'success': False, 'error': 'Server is busy, retry later', 'retry_after': retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _release(slot):
+    if slot[0] is not None:
+        pool, started = slot
+        slot[0] = None
+        pool.release(time.monotonic() - started)
+
+
+def _release_after_request(response):
+    slot = g.pop('admission', None)
+    if slot is None:
+        return response
+    if response.is_streamed:
+        # Streamed responses keep their slot until the body has been sent
+        response.call_on_close(lambda: _release(slot))
+    else:
+        # Not every client closes the response (test clients, some WSGI servers on errors)
+        _release(slot)
+    return response
+
+
+def _release_on_teardown(exc=None):
+    # after_request does not run when the view raised
+    slot = g.pop('admission', None)
+    if slot is not None:
+        _release(slot)
+
+
+def init_admission(app):
+    """Put API requests through admission pools when ADMISSION_ENABLED is set"""
+    if not app.config.get('ADMISSION_ENABLED'):
+        return
+    controller = AdmissionController(app.config['ADMISSION_POOLS'])
+    app.extensions['admission'] = controller
+    ADMISSION_IN_FLIGHT.collect = lambda gauge: controller.collect(gauge, 'active')
+    ADMISSION_QUEUE_DEPTH.collect = lambda gauge: controller.collect(gauge, 'waiting')
+    app.before_request(_admit)
+    app.after_request(_release_after_request)
+    app.teardown_request(_release_on_teardown)
@@ -1,19 +1,67 @@
-import openai
-import requests
+import contextvars
 import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
+from flask import current_app, has_app_context
+from src.services import cancellation, deadlines, metrics, scheduler as scheduling, tracing
+
+# A 400 whose error names the n parameter means the provider does not accept it
+N_PARAMETER = re.compile(r'(?<![\\\w])n(?!\w)')
+
+# Providers (scheduler keys) that rejected n, until when; their candidates are generated with one call each
+N_UNSUPPORTED_SECONDS = 3600
+_N_UNSUPPORTED: Dict[str, float] = {}
+
+
+def rejects_n(result: Dict[str, Any]) -> bool:
+    """Whether a failed call with n > 1 was refused because of n (not a transient failure)"""
+    return result.get('status_code') == 400 and bool(N_PARAMETER.search(result.get('error') or ''))
+
+
+def total_usage(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Token counts of several calls added up"""
+    usage = {}
+    for result in results:
+        for key, value in (result.get('usage') or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                usage[key] = usage.get(key, 0) + value
+    return usage
+
+
+def extract_completion_tokens(usage: Optional[Dict]) -> Optional[int]:
+    usage = usage or {}
+    value = usage.get('completion_tokens', usage.get('output_tokens'))
+    return value if isinstance(value, int) else None
+
+# Most recent messages sent verbatim in a prompt (older ones can come back through retrieval)
+PROMPT_HISTORY_SIZE = 5
+
+# Failure classes of provider HTTP status codes
+HTTP_ERROR_TYPES = {
+    401: 'auth',
+    403: 'auth',
+    408: 'timeout',
+    429: 'rate_limit',
+    504: 'timeout'
+}
 
 class AIAdapter:
     """Base class for AI adapters"""
     
-    def __init__(self, api_key: str, api_base_url: str, model: str, max_tokens: int = 1000, temperature: float = 0.7):
+    provider_name = 'unknown'
+    
+    def __init__(self, api_key: str, api_base_url: str, model: str, max_tokens: int = 1000, temperature: float = 0.7, timeout: float = 30):
         self.api_key = api_key
         self.api_base_url = api_base_url
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
+        self.timeout = timeout
     
-    def format_messages(self, system_prompt: str, user_message: str, conversation_history: List[Dict] = None) -> List[Dict]:
+    @tracing.traced('format_messages')
+    def format_messages(self, system_prompt: str, user_message: str, conversation_history: List[Dict] = None, relevant_history: List[Dict] = None) -> List[Dict]:
         """Format messages for the AI API"""
         messages = []
         
@@ -24,9 +72,22 @@ class AIAdapter:
                 "content": system_prompt
             })
         
+        # Add older messages retrieved by relevance (long-term memory)
+        if relevant_history:
+            lines = []
+            for msg in relevant_history:
+                if msg.get('content'):
+                    speaker = msg.get('personality_display_name') or ('Utente' if msg.get('sender_type') == 'user' else 'AI')
+                    lines.append(f"- {speaker}: {msg['content']}")
+            if lines:
+                messages.append({
+                    "role": "system",
+                    "content": "Messaggi precedenti rilevanti di questa conversazione:\n" + "\n".join(lines)
+                })
+        
         # Add conversation history
         if conversation_history:
-            for msg in conversation_history[-5:]:  # Last 5 messages for context
+            for msg in conversation_history[-PROMPT_HISTORY_SIZE:]:
                 if msg.get('sender_type') == 'ai' and msg.get('content'):
                     messages.append({
                         "role": "assistant",
@@ -44,31 +105,256 @@ class AIAdapter:
             "content": user_message
         })
         
+        tracing.current_span().set_attribute('prompt.messages', len(messages))
         return messages
     
-    def send_message(self, messages: List[Dict]) -> Dict[str, Any]:
-        """Send message to AI and get response"""
-        raise NotImplementedError("Subclasses must implement send_message")
+    # Calls are not started with less time than this left before the request deadline
+    min_call_seconds = 1.0
+    
+    def call_timeout(self) -> float:
+        """Timeout of a provider call: the adapter's own, capped by the time left before the request deadline"""
+        return min(self.timeout, deadlines.remaining_time(self.timeout))
+    
+    def send_message(self, messages: List[Dict], n: int = 1) -> Dict[str, Any]:
+        """Send message to AI and get response (n > 1 asks a supports_n adapter for that many choices)"""
+        # Inside a cancellable job the reply is streamed, so it can be aborted mid-generation
+        token = cancellation.current_token()
+        if token is not None and token.cancelled:
+            return self.cancelled_result(messages, [], None, sent=False)
+        if deadlines.remaining_time(self.timeout) < self.min_call_seconds:
+            return {
+                'success': False,
+                'error': 'Not enough time left before the request deadline',
+                'error_type': deadlines.DEADLINE_EXCEEDED,
+                'content': None
+            }
+        
+        # Calls wait for a slot of the provider, interactive ones first
+        scheduler = scheduling.current_scheduler()
+        if scheduler is None:
+            return self._call(messages, token, n)
+        # Waiting stops while there is still time for the call itself
+        remaining = deadlines.remaining_time()
+        max_wait = scheduler.max_wait if remaining is None else remaining - self.min_call_seconds
+        with scheduler.slot(self.scheduler_key, max_wait, token) as refused:
+            if refused == 'cancelled':
+                return self.cancelled_result(messages, [], None, sent=False)
+            if refused is not None:
+                expired = deadlines.remaining_time(self.timeout) < self.min_call_seconds
+                return {
+                    'success': False,
+                    'error': 'No provider slot became free in time',
+                    'error_type': deadlines.DEADLINE_EXCEEDED if expired else 'queue_timeout',
+                    'content': None
+                }
+            return self._call(messages, token, n)
+    
+    @property
+    def scheduler_key(self) -> str:
+        """Provider whose concurrency cap this adapter's calls count against"""
+        return f'{self.provider_name}:{self.api_base_url or ""}'
+    
+    def _call(self, messages: List[Dict], token, n: int = 1) -> Dict[str, Any]:
+        # Only adapters with supports_n take an n argument
+        choices = {'n': n} if n > 1 else {}
+        inflight = metrics.LLM_INFLIGHT.labels(provider=self.provider_name)
+        inflight.inc()
+        with tracing.start_span('llm.call', {
+            'gen_ai.system': self.provider_name,
+            'gen_ai.request.model': self.model,
+            'gen_ai.request.max_tokens': self.max_tokens,
+            'prompt.messages': len(messages),
+            'llm.timeout': self.call_timeout()
+        }, new_trace=False) as span:
+            started = time.perf_counter()
+            try:
+                if token is not None and self.supports_streaming:
+                    result = self._stream_message(messages, token, **choices)
+                else:
+                    result = self._send_message(messages, **choices)
+            finally:
+                elapsed = time.perf_counter() - started
+                inflight.dec()
+            if result.get('error_type') == 'timeout' and deadlines.remaining_time(1.0) <= 0:
+                # The timeout was the request deadline's, not the adapter's
+                result['error_type'] = deadlines.DEADLINE_EXCEEDED
+            result['latency_ms'] = int(elapsed * 1000)
+            self._record_metrics(result, elapsed)
+            self._record_span(span, result)
+        return result
+    
+    def _record_span(self, span, result: Dict[str, Any]):
+        """Attach the outcome of a provider call to its tracing span"""
+        usage = result.get('usage') or {}
+        span.set_attributes({
+            'gen_ai.response.model': result.get('model') or self.model,
+            'gen_ai.usage.input_tokens': usage.get('prompt_tokens'),
+            'gen_ai.usage.output_tokens': usage.get('completion_tokens'),
+            'llm.retries': result.get('retries', 0),
+            'llm.streamed': result.get('streamed', False)
+        })
+        if not result.get('success'):
+            span.status = 'error'
+            span.set_attribute('error.type', result.get('error_type', 'unexpected'))
+    
+    def _record_metrics(self, result: Dict[str, Any], elapsed: float):
+        """Record latency, token and failure metrics for a provider call"""
+        model = result.get('model') or self.model
+        if not result.get('success'):
+            metrics.LLM_FAILURES.inc(provider=self.provider_name, error_type=result.get('error_type', 'unexpected'))
+            # Aborted generations were still (partly) paid for
+            if result.get('error_type') != 'cancelled':
+                return
+        else:
+            metrics.LLM_CALL_DURATION.observe(elapsed, provider=self.provider_name, model=model)
+            first_token = result.get('first_token_ms')
+            metrics.LLM_TIME_TO_FIRST_TOKEN.observe(
+                first_token / 1000 if first_token is not None else elapsed,
+                provider=self.provider_name,
+                model=model
+            )
+        usage = result.get('usage') or {}
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            if usage.get(kind):
+                metrics.LLM_TOKENS.inc(usage[kind], provider=self.provider_name, model=model, kind=kind.split('_')[0])
+    
+    # Adapters whose provider returns several choices from one call (the OpenAI-compatible n parameter)
+    supports_n = False
+    
+    def send_candidates(self, messages: List[Dict], count: int) -> Dict[str, Any]:
+        """Generate count alternative replies, with a single call where the provider supports n.
+
+        The result is a send_message result for the first reply plus ``candidates``
+        (every reply's content) and ``candidate_usage`` (completion tokens of each,
+        None when the provider only reports the total). Candidates the provider did
+        not return, or all of them when it has no n, come from concurrent calls.
+        """
+        results, rejected = [], []
+        if self.supports_n and count > 1 and _N_UNSUPPORTED.get(self.scheduler_key, 0) < time.monotonic():
+            result = self.send_message(messages, n=count)
+            if not result['success'] and rejects_n(result):
+                # Stop sending n to this provider for a while; the refused call may still have cost tokens
+                _N_UNSUPPORTED[self.scheduler_key] = time.monotonic() + N_UNSUPPORTED_SECONDS
+                rejected.append(result)
+            elif not result['success']:
+                return result
+            else:
+                results.append(result)
+        missing = count - sum(len(result.get('candidates') or [result['content']]) for result in results)
+        if missing == 1:
+            results.append(self.send_message(messages))
+        elif missing > 1:
+            with ThreadPoolExecutor(max_workers=missing, thread_name_prefix='llm-candidate') as executor:
+                # Each call runs in a copy of this context: same app, deadline, cancel token and priority
+                futures = [executor.submit(contextvars.copy_context().run, self.send_message, messages) for _ in range(missing)]
+                results.extend(future.result() for future in futures)
+        return self.merge_candidates(results + rejected)
+    
+    @staticmethod
+    def merge_candidates(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """One result out of the calls that produced candidates, with their usage added up"""
+        succeeded = [result for result in results if result['success']]
+        if not succeeded:
+            failed = dict(next((result for result in results if result.get('error_type') == 'cancelled'), results[0]))
+            failed['usage'] = total_usage(results)
+            return failed
+        
+        merged = dict(succeeded[0])
+        merged['candidates'], merged['candidate_usage'] = [], []
+        for result in succeeded:
+            contents = result.get('candidates') or [result['content']]
+            merged['candidates'].extend(contents)
+            if len(contents) == 1:
+                merged['candidate_usage'].append(extract_completion_tokens(result.get('usage')))
+            else:
+                merged['candidate_usage'].extend([None] * len(contents))
+        # Calls that failed or were cancelled next to successful ones were still paid for
+        merged['usage'] = total_usage(results)
+        merged['usage_estimated'] = any(result.get('usage_estimated') for result in results)
+        merged['latency_ms'] = max(result.get('latency_ms') or 0 for result in results)
+        merged['candidate_calls'] = len(results)
+        return merged
+    
+    def _send_message(self, messages: List[Dict]) -> Dict[str, Any]:
+        """Provider specific implementation of send_message"""
+        raise NotImplementedError("Subclasses must implement _send_message")
+    
+    supports_streaming = False
+    
+    def _stream_message(self, messages: List[Dict], token) -> Dict[str, Any]:
+        """Provider specific streaming call that stops reading once token is cancelled"""
+        raise NotImplementedError("Streaming adapters must implement _stream_message")
+    
+    @staticmethod
+    def estimate_usage(messages: List[Dict], parts: List[str]) -> Dict[str, int]:
+        """Rough token counts (about 4 characters per token) for calls aborted before the provider reported usage"""
+        prompt_chars = sum(len(str(message.get('content') or '')) for message in messages)
+        completion_chars = sum(len(part) for part in parts)
+        prompt_tokens = max(1, prompt_chars // 4)
+        completion_tokens = max(len(parts), completion_chars // 4)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+    
+    def cancelled_result(self, messages: List[Dict], parts: List[str], usage: Optional[Dict], model: str = None, sent: bool = True) -> Dict[str, Any]:
+        """Result of a call aborted by cancellation, with the tokens consumed so far"""
+        return {
+            'success': False,
+            'error': 'Generation cancelled',
+            'error_type': 'cancelled',
+            'content': None,
+            'partial_content': ''.join(parts),
+            'usage': usage or (self.estimate_usage(messages, parts) if sent else {}),
+            'usage_estimated': usage is None and sent,
+            'model': model or self.model,
+            'provider': self.provider_name,
+            'streamed': True
+        }
+    
+    def stream_result(self, messages: List[Dict], parts: List[str], usage: Optional[Dict], model: str, first_token_ms: Optional[int]) -> Dict[str, Any]:
+        """Result of a streamed call that ran to completion"""
+        return {
+            'success': True,
+            'content': ''.join(parts),
+            'usage': usage or self.estimate_usage(messages, parts),
+            'usage_estimated': usage is None,
+            'model': model or self.model,
+            'provider': self.provider_name,
+            'first_token_ms': first_token_ms,
+            'streamed': True
+        }
 
 class OpenAIAdapter(AIAdapter):
     """OpenAI API adapter"""
     
-    def __init__(self, api_key: str, api_base_url: str = "https://api.openai.com/v1", model: str = "gpt-4", max_tokens: int = 1000, temperature: float = 0.7):
-        super().__init__(api_key, api_base_url, model, max_tokens, temperature)
+    provider_name = 'openai'
+    
+    def __init__(self, api_key: str, api_base_url: str = "https://api.openai.com/v1", model: str = "gpt-4", max_tokens: int = 1000, temperature: float = 0.7, timeout: float = 30):
+        super().__init__(api_key, api_base_url, model, max_tokens, temperature, timeout)
+        
+        # The SDK is large, so it is only imported once an OpenAI adapter is used
+        import openai
         
         # Configure OpenAI client
         openai.api_key = self.api_key
         if api_base_url != "https://api.openai.com/v1":
             openai.api_base = api_base_url
     
-    def send_message(self, messages: List[Dict]) -> Dict[str, Any]:
+    supports_n = True
+    
+    def _send_message(self, messages: List[Dict], n: int = 1) -> Dict[str, Any]:
         """Send message to OpenAI API"""
+        import openai
+        
         try:
             # Validate API key
             if not self.api_key or self.api_key.strip() == "":
                 return {
                     'success': False,
                     'error': 'API key is missing or empty',
+                    'error_type': 'missing_key',
                     'content': None
                 }
             
@@ -78,57 +364,157 @@ class OpenAIAdapter(AIAdapter):
                 messages=messages,
                 max_tokens=self.max_tokens,
                 temperature=self.temperature,
-                timeout=30
+                timeout=self.call_timeout(),
+                n=n
             )
             
             # Extract response
-            content = response.choices[0].message.content
+            choices = sorted(response.choices, key=lambda choice: choice.index)
+            content = choices[0].message.content
             usage = response.usage._asdict() if hasattr(response.usage, '_asdict') else dict(response.usage)
             
-            return {
+            result = {
                 'success': True,
                 'content': content,
                 'usage': usage,
                 'model': response.model,
                 'provider': 'openai'
             }
+            if n > 1:
+                result['candidates'] = [choice.message.content for choice in choices]
+            return result
             
         except openai.error.AuthenticationError as e:
             return {
                 'success': False,
                 'error': f'Authentication failed: {str(e)}',
+                'error_type': 'auth',
                 'content': None
             }
         except openai.error.RateLimitError as e:
             return {
                 'success': False,
                 'error': f'Rate limit exceeded: {str(e)}',
+                'error_type': 'rate_limit',
+                'content': None
+            }
+        except openai.error.Timeout as e:
+            return {
+                'success': False,
+                'error': f'Request timeout: {str(e)}',
+                'error_type': 'timeout',
+                'content': None
+            }
+        except openai.error.InvalidRequestError as e:
+            return {
+                'success': False,
+                'error': f'Invalid request ({e.param}): {str(e)}',
+                'error_type': 'http_error',
+                'status_code': e.http_status,
                 'content': None
             }
         except openai.error.APIError as e:
             return {
                 'success': False,
                 'error': f'OpenAI API error: {str(e)}',
+                'error_type': 'api_error',
                 'content': None
             }
         except Exception as e:
             return {
                 'success': False,
                 'error': f'Unexpected error: {str(e)}',
+                'error_type': 'unexpected',
+                'content': None
+            }
+
+    supports_streaming = True
+    
+    def _stream_message(self, messages: List[Dict], token, n: int = 1) -> Dict[str, Any]:
+        """Stream from the OpenAI API, stopping between chunks once token is cancelled"""
+        import openai
+        
+        if not self.api_key or self.api_key.strip() == "":
+            return {
+                'success': False,
+                'error': 'API key is missing or empty',
+                'error_type': 'missing_key',
                 'content': None
             }
+        
+        started = time.perf_counter()
+        parts, usage, model, first_token_ms = [], None, self.model, None
+        other_parts = {}
+        try:
+            response = openai.ChatCompletion.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                timeout=self.call_timeout(),
+                n=n,
+                stream=True,
+                stream_options={'include_usage': True}
+            )
+            try:
+                for chunk in response:
+                    if token.cancelled:
+                        break
+                    model = chunk.get('model') or model
+                    if chunk.get('usage'):
+                        usage = dict(chunk['usage'])
+                    for choice in chunk.get('choices') or []:
+                        content = (choice.get('delta') or {}).get('content')
+                        if content and choice.get('index', 0) == 0:
+                            if first_token_ms is None:
+                                first_token_ms = int((time.perf_counter() - started) * 1000)
+                            parts.append(content)
+                        elif content:
+                            other_parts.setdefault(choice['index'], []).append(content)
+            finally:
+                # Closing the stream drops the connection, so the provider stops generating
+                close = getattr(response, 'close', None)
+                if close is not None:
+                    close()
+        except openai.error.AuthenticationError as e:
+            return {'success': False, 'error': f'Authentication failed: {str(e)}', 'error_type': 'auth', 'content': None}
+        except openai.error.RateLimitError as e:
+            return {'success': False, 'error': f'Rate limit exceeded: {str(e)}', 'error_type': 'rate_limit', 'content': None}
+        except openai.error.Timeout as e:
+            return {'success': False, 'error': f'Request timeout: {str(e)}', 'error_type': 'timeout', 'content': None}
+        except openai.error.InvalidRequestError as e:
+            return {'success': False, 'error': f'Invalid request ({e.param}): {str(e)}', 'error_type': 'http_error',
+                    'status_code': e.http_status, 'content': None}
+        except openai.error.APIError as e:
+            return {'success': False, 'error': f'OpenAI API error: {str(e)}', 'error_type': 'api_error', 'content': None}
+        except Exception as e:
+            return {'success': False, 'error': f'Unexpected error: {str(e)}', 'error_type': 'unexpected', 'content': None}
+        
+        if token.cancelled:
+            return self.cancelled_result(messages, parts, usage, model)
+        result = self.stream_result(messages, parts, usage, model, first_token_ms)
+        if n > 1:
+            result['candidates'] = [result['content']] + [''.join(other_parts[index]) for index in sorted(other_parts)]
+        return result
 
 class ManusAdapter(AIAdapter):
     """Manus API adapter"""
     
-    def send_message(self, messages: List[Dict]) -> Dict[str, Any]:
+    provider_name = 'manus'
+    
+    supports_n = True
+    
+    def _send_message(self, messages: List[Dict], n: int = 1) -> Dict[str, Any]:
         """Send message to Manus API"""
+        import requests
+        
         try:
             # Validate API key
             if not self.api_key or self.api_key.strip() == "":
                 return {
                     'success': False,
                     'error': 'API key is missing or empty',
+                    'error_type': 'missing_key',
                     'content': None
                 }
             
@@ -144,30 +530,25 @@ class ManusAdapter(AIAdapter):
                 'max_tokens': self.max_tokens,
                 'temperature': self.temperature
             }
+            if n > 1:
+                data['n'] = n
             
             # Make API call
             response = requests.post(
                 f"{self.api_base_url}/chat/completions",
                 headers=headers,
                 json=data,
-                timeout=30
+                timeout=self.call_timeout()
             )
             
             if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                return {
-                    'success': True,
-                    'content': content,
-                    'usage': result.get('usage', {}),
-                    'model': result.get('model', self.model),
-                    'provider': 'manus'
-                }
+                return self._parse_choices(response.json(), n)
             else:
                 return {
                     'success': False,
                     'error': f'API request failed with status {response.status_code}: {response.text}',
+                    'error_type': HTTP_ERROR_TYPES.get(response.status_code, 'http_error'),
+                    'status_code': response.status_code,
                     'content': None
                 }
                 
@@ -175,49 +556,185 @@ class ManusAdapter(AIAdapter):
             return {
                 'success': False,
                 'error': 'Request timeout',
+                'error_type': 'timeout',
                 'content': None
             }
         except requests.exceptions.RequestException as e:
             return {
                 'success': False,
                 'error': f'Request error: {str(e)}',
+                'error_type': 'request_error',
                 'content': None
             }
         except Exception as e:
             return {
                 'success': False,
                 'error': f'Unexpected error: {str(e)}',
+                'error_type': 'unexpected',
+                'content': None
+            }
+
+    supports_streaming = True
+    
+    def _parse_choices(self, body: Dict, n: int = 1) -> Dict[str, Any]:
+        """Result of a non-streamed completion"""
+        choices = sorted(body['choices'], key=lambda choice: choice.get('index', 0))
+        result = {
+            'success': True,
+            'content': choices[0]['message']['content'],
+            'usage': body.get('usage', {}),
+            'model': body.get('model', self.model),
+            'provider': 'manus'
+        }
+        if n > 1:
+            result['candidates'] = [choice['message']['content'] for choice in choices]
+        return result
+    
+    def _stream_message(self, messages: List[Dict], token, n: int = 1) -> Dict[str, Any]:
+        """Stream from the Manus API, closing the connection as soon as token is cancelled"""
+        import requests
+        
+        if not self.api_key or self.api_key.strip() == "":
+            return {
+                'success': False,
+                'error': 'API key is missing or empty',
+                'error_type': 'missing_key',
                 'content': None
             }
+        
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        data = {
+            'model': self.model,
+            'messages': messages,
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+            'stream': True,
+            'stream_options': {'include_usage': True}
+        }
+        if n > 1:
+            data['n'] = n
+        
+        started = time.perf_counter()
+        parts, usage, model, first_token_ms = [], None, self.model, None
+        other_parts = {}
+        try:
+            response = requests.post(
+                f"{self.api_base_url}/chat/completions",
+                headers=headers,
+                json=data,
+                timeout=self.call_timeout(),
+                stream=True
+            )
+        except requests.exceptions.Timeout:
+            return {'success': False, 'error': 'Request timeout', 'error_type': 'timeout', 'content': None}
+        except requests.exceptions.RequestException as e:
+            if token.cancelled:
+                return self.cancelled_result(messages, parts, usage)
+            return {'success': False, 'error': f'Request error: {str(e)}', 'error_type': 'request_error', 'content': None}
+        
+        # Closing the response from the cancelling thread unblocks a pending read
+        remove_callback = token.add_callback(response.close)
+        try:
+            if response.status_code != 200:
+                return {
+                    'success': False,
+                    'error': f'API request failed with status {response.status_code}: {response.text}',
+                    'error_type': HTTP_ERROR_TYPES.get(response.status_code, 'http_error'),
+                    'status_code': response.status_code,
+                    'content': None
+                }
+            
+            if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+                # The provider ignored stream=True and answered in one piece
+                return self._parse_choices(response.json(), n)
+            
+            for line in response.iter_lines(decode_unicode=True):
+                if token.cancelled:
+                    break
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                chunk = json.loads(payload)
+                model = chunk.get('model') or model
+                if chunk.get('usage'):
+                    usage = chunk['usage']
+                for choice in chunk.get('choices') or []:
+                    content = (choice.get('delta') or {}).get('content')
+                    if content and choice.get('index', 0) == 0:
+                        if first_token_ms is None:
+                            first_token_ms = int((time.perf_counter() - started) * 1000)
+                        parts.append(content)
+                    elif content:
+                        other_parts.setdefault(choice['index'], []).append(content)
+        except Exception as e:
+            if not token.cancelled:
+                return {'success': False, 'error': f'Stream error: {str(e)}', 'error_type': 'request_error', 'content': None}
+        finally:
+            remove_callback()
+            response.close()
+        
+        if token.cancelled:
+            return self.cancelled_result(messages, parts, usage, model)
+        result = self.stream_result(messages, parts, usage, model, first_token_ms)
+        if n > 1:
+            result['candidates'] = [result['content']] + [''.join(other_parts[index]) for index in sorted(other_parts)]
+        return result
 
 class AIAdapterFactory:
     """Factory for creating AI adapters"""
     
     @staticmethod
-    def create_adapter(api_type: str, api_key: str, api_base_url: str, model: str, max_tokens: int = 1000, temperature: float = 0.7) -> AIAdapter:
+    def create_adapter(api_type: str, api_key: str, api_base_url: str, model: str, max_tokens: int = 1000, temperature: float = 0.7, timeout: float = 30) -> AIAdapter:
         """Create appropriate AI adapter based on API type"""
         
-        if api_type.lower() == 'openai':
-            return OpenAIAdapter(
+        # LLM_CASSETTE_MODE records every provider's calls, or replays them all from a cassette
+        settings = current_app.config if has_app_context() else {}
+        cassette_mode = settings.get('LLM_CASSETTE_MODE')
+        
+        if api_type.lower() == 'cassette' or cassette_mode == 'replay':
+            from src.services.cassette import ReplayAdapter
+            return ReplayAdapter(
+                api_key=api_key,
+                api_base_url=api_base_url if api_type.lower() == 'cassette' else settings.get('LLM_CASSETTE_PATH'),
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=timeout,
+                speed=settings.get('LLM_CASSETTE_SPEED', 1.0),
+                sequence_fallback=settings.get('LLM_CASSETTE_MATCH') == 'sequence'
+            )
+        elif api_type.lower() == 'openai':
+            adapter = OpenAIAdapter(
                 api_key=api_key,
                 api_base_url=api_base_url,
                 model=model,
                 max_tokens=max_tokens,
-                temperature=temperature
+                temperature=temperature,
+                timeout=timeout
             )
         elif api_type.lower() == 'manus':
-            return ManusAdapter(
+            adapter = ManusAdapter(
                 api_key=api_key,
                 api_base_url=api_base_url,
                 model=model,
                 max_tokens=max_tokens,
-                temperature=temperature
+                temperature=temperature,
+                timeout=timeout
             )
         else:
             raise ValueError(f"Unsupported API type: {api_type}")
+        
+        if cassette_mode == 'record':
+            from src.services.cassette import RecordingAdapter
+            adapter = RecordingAdapter(adapter, settings['LLM_CASSETTE_PATH'])
+        return adapter
     
     @staticmethod
     def get_supported_types() -> List[str]:
         """Get list of supported API types"""
-        return ['openai', 'manus']
-
+        return ['openai', 'manus', 'cassette']
@@ -0,0 +1,47 @@
+"""Authentication of admin and user API calls.
+
+Admin routes (creating users, changing their limits, deleting them) need an
+``X-Admin-Key`` header matching ``ADMIN_API_KEY``; with no admin key
+configured they are refused. Users authenticate with their own API key
+(``X-API-Key`` or ``Authorization: Bearer``).
+"""
+import hmac
+from functools import wraps
+from typing import Optional
+
+from flask import current_app, jsonify, request
+
+from src.models.user import User
+
+
+def request_api_key(req) -> Optional[str]:
+    """The user API key the request carries, if any"""
+    api_key = req.headers.get('X-API-Key')
+    authorization = req.headers.get('Authorization', '')
+    if not api_key and authorization.startswith('Bearer '):
+        api_key = authorization[7:].strip()
+    return api_key or None
+
+
+def is_admin(req) -> bool:
+    expected = current_app.config.get('ADMIN_API_KEY')
+    provided = req.headers.get('X-Admin-Key')
+    return bool(expected and provided) and hmac.compare_digest(provided.encode('utf-8'), expected.encode('utf-8'))
+
+
+def authenticated_user(req) -> Optional[User]:
+    """The user whose API key the request carries"""
+    api_key = request_api_key(req)
+    if api_key is None:
+        return None
+    return User.query.filter_by(api_key_hash=User.hash_api_key(api_key)).first()
+
+
+def admin_required(view):
+    """Refuse the view to callers without the admin key"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin(request):
+            return jsonify({'success': False, 'error': 'Admin authentication required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,230 @@
+"""Cooperative cancellation of LLM work.
+
+Routes run provider calls inside ``cancellable(conversation_id)``, which
+registers a ``CancelToken`` for the request. The token is cancelled when the
+client's connection drops (checked on the raw socket exposed by gunicorn or the
+Werkzeug server), when the request deadline passes, or when
+``POST /conversations/<id>/cancel`` is called, in any worker: cancel requests
+are also written to ``cancel_requests``, which each process with running jobs
+polls. Adapters stream while a token is active and stop reading (closing the
+provider connection) as soon as it is cancelled.
+"""
+import contextvars
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Set
+
+from flask import current_app, has_request_context, request
+
+from src.models.ai_provider import db, CancelRequest
+from src.services.deadlines import DEADLINE_EXCEEDED, current_deadline
+
+logger = logging.getLogger(__name__)
+
+_current_token: contextvars.ContextVar[Optional['CancelToken']] = contextvars.ContextVar('cancel_token', default=None)
+
+
+class CancelToken:
+    def __init__(self, conversation_id: Optional[int] = None, job_id: Optional[str] = None, client_socket=None,
+                 deadline=None):
+        self.conversation_id = conversation_id
+        self.job_id = job_id
+        self.client_socket = client_socket
+        self.deadline = deadline
+        self.started_at = datetime.utcnow()
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = 'cancelled'):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.debug('Cancel callback failed', exc_info=True)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds; True if cancelled meanwhile"""
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback on cancellation (right away if already cancelled); returns a remover"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+def _client_socket(environ):
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+
+
+def peer_closed(sock) -> bool:
+    """True when the client closed its side of the connection.
+
+    The request body has been read by then, so a readable socket with nothing
+    to read means EOF (a pipelined request would show up as data instead).
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class JobRegistry:
+    """Running cancellable jobs of this process, watched by a lazy background thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.jobs: Dict[int, Set[CancelToken]] = {}
+        self.lock = threading.Lock()
+        self.interval = app.config.get('CANCEL_POLL_INTERVAL', 0.5)
+        self._watcher = None
+        self._last_poll = datetime.utcnow()
+        self._last_cleanup = 0.0
+
+    def register(self, token: CancelToken):
+        with self.lock:
+            self.jobs.setdefault(token.conversation_id, set()).add(token)
+            if self._watcher != os.getpid():
+                # Started lazily, so it runs in the worker and not in a preloading master
+                threading.Thread(target=self._run, name='cancel-watcher', daemon=True).start()
+                self._watcher = os.getpid()
+
+    def unregister(self, token: CancelToken):
+        with self.lock:
+            tokens = self.jobs.get(token.conversation_id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.jobs[token.conversation_id]
+
+    def cancel_local(self, conversation_id: int, job_id: Optional[str] = None, reason: str = 'cancelled',
+                     before: Optional[datetime] = None) -> int:
+        with self.lock:
+            tokens = list(self.jobs.get(conversation_id, ()))
+        cancelled = 0
+        for token in tokens:
+            if job_id is not None and token.job_id != job_id:
+                continue
+            if before is not None and token.started_at > before:
+                continue
+            token.cancel(reason)
+            cancelled += 1
+        return cancelled
+
+    def request_cancel(self, conversation_id: int, job_id: Optional[str] = None) -> int:
+        """Cancel matching jobs here and ask the other workers to do the same"""
+        cancelled = self.cancel_local(conversation_id, job_id)
+        db.session.add(CancelRequest(conversation_id=conversation_id, job_id=job_id))
+        db.session.commit()
+        return cancelled
+
+    def _run(self):
+        idle_since = None
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                tokens = [token for tokens in self.jobs.values() for token in tokens]
+                # Stop after a while without jobs; the next register() starts a new watcher
+                if not tokens:
+                    idle_since = idle_since or time.monotonic()
+                    if time.monotonic() - idle_since > 30:
+                        self._watcher = None
+                        return
+                    continue
+            idle_since = None
+
+            for token in tokens:
+                if token.cancelled:
+                    continue
+                if token.deadline is not None and token.deadline.expired:
+                    token.cancel(DEADLINE_EXCEEDED)
+                elif token.client_socket is not None and peer_closed(token.client_socket):
+                    token.cancel('client_disconnected')
+
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception:
+                logger.exception('Polling cancel requests failed')
+
+    def poll(self):
+        """Apply cancel requests written by other workers since the last poll"""
+        since = self._last_poll - timedelta(seconds=1)
+        self._last_poll = datetime.utcnow()
+        for cancel in CancelRequest.query.filter(CancelRequest.created_at >= since).all():
+            self.cancel_local(cancel.conversation_id, cancel.job_id, before=cancel.created_at)
+
+        if time.monotonic() - self._last_cleanup > 600:
+            self._last_cleanup = time.monotonic()
+            CancelRequest.query.filter(
+                CancelRequest.created_at < datetime.utcnow() - timedelta(hours=1)
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+
+@contextmanager
+def cancelled_by(token: CancelToken):
+    """Run the block's provider calls under token, without registering it as a conversation's job"""
+    context_token = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(context_token)
+
+
+@contextmanager
+def cancellable(conversation_id: int):
+    """Run the block as a cancellable job of the conversation"""
+    registry = current_app.extensions['cancellation']
+    token = CancelToken(
+        conversation_id,
+        job_id=request.headers.get('X-Job-Id') if has_request_context() else None,
+        client_socket=_client_socket(request.environ) if has_request_context() else None,
+        deadline=current_deadline()
+    )
+    registry.register(token)
+    context_token = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(context_token)
+        registry.unregister(token)
+
+
+def init_cancellation(app):
+    app.extensions['cancellation'] = JobRegistry(app)
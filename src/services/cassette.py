@@ -0,0 +1,237 @@
+"""Record/replay of provider calls ("cassettes").
+
+A cassette is a gzip-compressed JSONL file with one line per provider call:
+the hash of the request (model, messages, max_tokens, temperature, and n when
+several choices were asked for), the result the adapter returned and the
+call's latency. It is written by
+``RecordingAdapter``, which wraps a real adapter, and served back by
+``ReplayAdapter``, which waits the recorded latency divided by
+``LLM_CASSETTE_SPEED`` (0 = no wait) before answering, so whole workloads can
+be rerun through the routes, database and serialization without network
+access.
+
+Replay looks a call up by its request hash (repeated requests are answered in
+recorded order); with ``LLM_CASSETTE_MATCH = 'sequence'`` a miss falls back to
+the next unused recording, for replays against a database whose history
+differs from the recording's. A call asking for n choices that was not
+recorded that way is refused like a provider without n would refuse it, so
+the candidates are replayed from the separate calls that were recorded.
+
+Select it per provider with ``api_type='cassette'`` and the cassette path as
+``api_base_url``, or for every provider with ``LLM_CASSETTE_MODE`` ('record'
+or 'replay') and ``LLM_CASSETTE_PATH``. When several processes record, put
+``{pid}`` in the path so each writes its own file.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from src.services.ai_adapter import AIAdapter
+
+# Result fields worth replaying (the rest is recomputed by AIAdapter.send_message)
+RECORDED_FIELDS = ('success', 'content', 'candidates', 'usage', 'model', 'error', 'error_type', 'status_code',
+                   'first_token_ms', 'streamed')
+
+
+def request_key(model: str, messages: List[Dict], max_tokens: int, temperature: float, n: int = 1) -> str:
+    request = {
+        'model': model,
+        'messages': messages,
+        'max_tokens': max_tokens,
+        'temperature': temperature
+    }
+    if n > 1:
+        # Only when set, so single-choice keys stay those of older cassettes
+        request['n'] = n
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def read_cassette(path: str) -> List[Dict]:
+    """All complete records of a cassette (a recording cut short by a crash keeps what was flushed)"""
+    records = []
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as cassette:
+            for line in cassette:
+                if line.strip():
+                    records.append(json.loads(line))
+    except (EOFError, zlib.error, json.JSONDecodeError):
+        pass
+    return records
+
+
+class CassetteWriter:
+    """Appends records to a cassette; one gzip member per process, flushed after every record"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self._file = None
+
+    def write(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self._file is None or self._file[0] != os.getpid():
+                path = self.path.format(pid=os.getpid())
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._file = (os.getpid(), gzip.open(path, 'ab'))
+            handle = self._file[1]
+            handle.write(line.encode('utf-8'))
+            handle.flush()
+
+
+class Cassette:
+    """Recorded calls indexed by request hash, shared by the adapters replaying one file"""
+
+    def __init__(self, records: List[Dict]):
+        self.records = records
+        self.by_key: Dict[str, deque] = {}
+        for index, record in enumerate(records):
+            self.by_key.setdefault(record['key'], deque()).append(index)
+        self.used = set()
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key: str, sequence_fallback: bool) -> Optional[Dict]:
+        with self.lock:
+            indexes = self.by_key.get(key)
+            if indexes:
+                # Repeats of a request get the next recording; the last one is reused once they run out
+                index = indexes.popleft() if len(indexes) > 1 else indexes[0]
+            elif sequence_fallback:
+                while self.cursor < len(self.records) and self.cursor in self.used:
+                    self.cursor += 1
+                if self.cursor >= len(self.records):
+                    return None
+                index = self.cursor
+            else:
+                return None
+            self.used.add(index)
+            return self.records[index]
+
+
+_writers: Dict[str, CassetteWriter] = {}
+_cassettes: Dict[str, Cassette] = {}
+_lock = threading.Lock()
+
+
+def get_writer(path: str) -> CassetteWriter:
+    with _lock:
+        if path not in _writers:
+            _writers[path] = CassetteWriter(path)
+        return _writers[path]
+
+
+def get_cassette(path: str) -> Cassette:
+    with _lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(read_cassette(path))
+        return _cassettes[path]
+
+
+def cassette_path(url: Optional[str]) -> str:
+    if not url:
+        raise ValueError('A cassette provider needs the cassette path as api_base_url')
+    return url[len('file://'):] if url.startswith('file://') else url
+
+
+class RecordingAdapter(AIAdapter):
+    """Calls the wrapped adapter and appends each call to a cassette"""
+
+    def __init__(self, inner: AIAdapter, path: str):
+        super().__init__(inner.api_key, inner.api_base_url, inner.model, inner.max_tokens, inner.temperature, inner.timeout)
+        self.inner = inner
+        self.provider_name = inner.provider_name
+        self.supports_streaming = inner.supports_streaming
+        self.supports_n = inner.supports_n
+        self.writer = get_writer(path)
+
+    def _send_message(self, messages: List[Dict], **choices) -> Dict[str, Any]:
+        return self.inner._send_message(messages, **choices)
+
+    def _stream_message(self, messages: List[Dict], token, **choices) -> Dict[str, Any]:
+        return self.inner._stream_message(messages, token, **choices)
+
+    def send_message(self, messages: List[Dict], n: int = 1) -> Dict[str, Any]:
+        result = super().send_message(messages, n)
+        # Aborted calls depend on timing, not on the request: they are not worth replaying
+        if result.get('error_type') not in ('cancelled', 'deadline_exceeded'):
+            self.writer.write({
+                'key': request_key(self.model, messages, self.max_tokens, self.temperature, n),
+                'provider': self.provider_name,
+                'model': self.model,
+                'latency_ms': result.get('latency_ms'),
+                'recorded_at': time.time(),
+                'result': {field: result[field] for field in RECORDED_FIELDS if field in result}
+            })
+        return result
+
+
+class ReplayAdapter(AIAdapter):
+    """Answers calls from a cassette, after the recorded latency scaled by speed"""
+
+    provider_name = 'cassette'
+    supports_streaming = True
+    supports_n = True
+
+    def __init__(self, api_key: str, api_base_url: str, model: str, max_tokens: int = 1000, temperature: float = 0.7,
+                 timeout: float = 30, speed: float = 1.0, sequence_fallback: bool = False):
+        super().__init__(api_key, api_base_url, model, max_tokens, temperature, timeout)
+        self.cassette = get_cassette(cassette_path(api_base_url))
+        self.speed = speed
+        self.sequence_fallback = sequence_fallback
+
+    def _send_message(self, messages: List[Dict], n: int = 1) -> Dict[str, Any]:
+        return self._replay(messages, None, n)
+
+    def _stream_message(self, messages: List[Dict], token, n: int = 1) -> Dict[str, Any]:
+        return self._replay(messages, token, n)
+
+    def _replay(self, messages: List[Dict], token, n: int = 1) -> Dict[str, Any]:
+        key = request_key(self.model, messages, self.max_tokens, self.temperature, n)
+        record = self.cassette.lookup(key, self.sequence_fallback and n == 1)
+        if record is None and n > 1:
+            # Recorded as separate calls: refuse n, so the caller falls back to them
+            return {
+                'success': False,
+                'error': "Unsupported parameter: 'n' was not recorded for this request",
+                'error_type': 'http_error',
+                'status_code': 400,
+                'content': None
+            }
+        if record is None:
+            return {
+                'success': False,
+                'error': 'No recorded call matches this request',
+                'error_type': 'cassette_miss',
+                'content': None
+            }
+
+        delay = (record.get('latency_ms') or 0) / 1000 / self.speed if self.speed else 0.0
+        timeout = self.call_timeout()
+        if delay > timeout:
+            self._wait(timeout, token)
+            if token is None or not token.cancelled:
+                return {'success': False, 'error': 'Request timeout', 'error_type': 'timeout', 'content': None}
+        elif delay:
+            self._wait(delay, token)
+        if token is not None and token.cancelled:
+            return self.cancelled_result(messages, [], None, record.get('model'))
+
+        result = dict(record['result'])
+        result['provider'] = self.provider_name
+        result['replayed'] = True
+        return result
+
+    @staticmethod
+    def _wait(seconds: float, token):
+        if token is not None:
+            token.wait(seconds)
+        else:
+            time.sleep(seconds)
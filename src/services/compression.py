@@ -0,0 +1,71 @@
+import gzip
+from typing import List
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+
+def supported_encodings() -> List[str]:
+    """Content encodings this server can produce, in order of preference"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def etag_variants(etag: str) -> List[str]:
+    """ETags a client may hold for a (possibly compressed) representation"""
+    return [etag] + [f'{etag}-{encoding}' for encoding in supported_encodings()]
+
+
+def _choose_encoding():
+    for encoding in supported_encodings():
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress_response(response):
+    """Compress large, compressible responses according to Accept-Encoding"""
+    if (
+        response.status_code < 200
+        or response.status_code >= 300
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if (response.content_length or 0) < current_app.config.get('COMPRESSION_MIN_SIZE', 1024):
+        return response
+
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=current_app.config.get('BROTLI_QUALITY', 4))
+    else:
+        compressed = gzip.compress(data, compresslevel=current_app.config.get('GZIP_LEVEL', 6))
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+
+    # A compressed body is a different representation, so it needs its own strong ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+
+    return response
+
+
+def init_compression(app):
+    """Register response compression on the app"""
+    app.after_request(compress_response)
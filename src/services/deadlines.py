@@ -0,0 +1,89 @@
+"""Per-request deadlines.
+
+Each API request gets a deadline from the ``X-Request-Timeout`` header
+(seconds, capped by ``REQUEST_DEADLINE_MAX_SECONDS``) or
+``REQUEST_DEADLINE_SECONDS``, minus ``REQUEST_DEADLINE_MARGIN_SECONDS`` kept
+for persisting and serializing the response. Adapter calls derive their
+timeout from the time left, running cancellable jobs are cancelled with reason
+``deadline_exceeded`` when it passes, and multi-turn work stops starting turns
+that would not fit.
+"""
+import contextvars
+import math
+import time
+from typing import Optional
+
+from flask import current_app, g, jsonify, request
+
+DEADLINE_EXCEEDED = 'deadline_exceeded'
+
+_current_deadline: contextvars.ContextVar[Optional['Deadline']] = contextvars.ContextVar('deadline', default=None)
+
+
+class Deadline:
+    __slots__ = ('seconds', 'expires_at')
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the current deadline (default when there is none)"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else default
+
+
+def _request_seconds() -> Optional[float]:
+    config = current_app.config
+    seconds = config.get('REQUEST_DEADLINE_SECONDS')
+    header = request.headers.get('X-Request-Timeout')
+    if header:
+        seconds = float(header)
+        # float() also parses 'nan' and 'inf', which would never expire
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError
+        maximum = config.get('REQUEST_DEADLINE_MAX_SECONDS')
+        if maximum:
+            seconds = min(seconds, maximum)
+    if not seconds:
+        return None
+    return max(0.0, seconds - config.get('REQUEST_DEADLINE_MARGIN_SECONDS', 0))
+
+
+def _start_deadline():
+    if not request.path.startswith('/api/'):
+        return None
+    try:
+        seconds = _request_seconds()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'X-Request-Timeout must be a finite positive number of seconds'}), 400
+    if seconds is not None:
+        g.deadline_token = _current_deadline.set(Deadline(seconds))
+    return None
+
+
+def _end_deadline(exc=None):
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        try:
+            _current_deadline.reset(token)
+        except ValueError:
+            # Torn down from another context (e.g. a streamed response)
+            _current_deadline.set(None)
+
+
+def init_deadlines(app):
+    app.before_request(_start_deadline)
+    app.teardown_request(_end_deadline)
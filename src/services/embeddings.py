@@ -0,0 +1,213 @@
+import logging
+import math
+import os
+import re
+import threading
+import zlib
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+from flask import current_app
+from sqlalchemy import bindparam, or_, select, update
+
+from src.models.ai_provider import db, ChatMessage, Conversation
+from src.services.forks import message_scope
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+class HashingEmbedder:
+    """Offline text embedder based on feature hashing of word unigrams and bigrams.
+
+    Needs no model download or network access: every token is hashed into one of
+    ``dim`` buckets with a signed count, then the vector is L2-normalized so that
+    a dot product between two vectors is their cosine similarity.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def _features(self, text: str) -> Iterable[str]:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        yield from tokens
+        for first, second in zip(tokens, tokens[1:]):
+            yield f'{first} {second}'
+
+    def embed(self, text: str) -> 'np.ndarray':
+        import numpy as np
+
+        counts: Dict[int, float] = {}
+        for feature in self._features(text or ''):
+            digest = zlib.crc32(feature.encode('utf-8'))
+            index = digest % self.dim
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            counts[index] = counts.get(index, 0.0) + sign
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for index, count in counts.items():
+            # Sublinear term frequency keeps repeated words from dominating
+            vector[index] = math.copysign(1.0 + math.log(abs(count)), count) if count else 0.0
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+# Embedders available through the EMBEDDER config value
+_EMBEDDER_FACTORIES: Dict[str, Callable[[], object]] = {
+    'hashing': HashingEmbedder,
+}
+_embedders: Dict[str, object] = {}
+
+
+def register_embedder(name: str, factory: Callable[[], object]):
+    """Register a local embedding model; it must expose ``name`` and ``embed(text)``"""
+    _EMBEDDER_FACTORIES[name] = factory
+    _embedders.pop(name, None)
+
+
+def get_embedder():
+    """Get the embedder configured for the current app"""
+    name = current_app.config.get('EMBEDDER', 'hashing')
+    if name not in _embedders:
+        if name not in _EMBEDDER_FACTORIES:
+            raise ValueError(f'Unknown embedder: {name}')
+        _embedders[name] = _EMBEDDER_FACTORIES[name]()
+    return _embedders[name]
+
+
+def embed_message(message: ChatMessage):
+    """Store the message embedding as a compact float32 blob"""
+    import numpy as np
+
+    embedder = get_embedder()
+    message.embedding = embedder.embed(message.content).astype(np.float32).tobytes()
+    message.embedding_model = embedder.name
+
+
+def backfill_embeddings(scope=None, limit: int = 500) -> int:
+    """Embed up to limit messages (within scope, newest first) that have no embedding from the current embedder.
+
+    Runs in its own short transaction on the primary, whatever the caller's session is doing.
+    """
+    import numpy as np
+
+    embedder = get_embedder()
+    table = ChatMessage.__table__
+    query = select(table.c.id, table.c.content).where(
+        or_(table.c.embedding_model.is_(None), table.c.embedding_model != embedder.name)
+    )
+    if scope is not None:
+        query = query.where(scope)
+    query = query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit)
+
+    with db.engine.begin() as connection:
+        rows = connection.execute(query).all()
+        if rows:
+            # Core, not the ORM: no flush events, so caches and drafts don't take it for an edit
+            connection.execute(
+                update(table).where(table.c.id == bindparam('message_id')).values(
+                    embedding=bindparam('embedding'), embedding_model=bindparam('embedding_model')
+                ),
+                [
+                    {
+                        'message_id': message_id,
+                        'embedding': embedder.embed(content).astype(np.float32).tobytes(),
+                        'embedding_model': embedder.name
+                    }
+                    for message_id, content in rows
+                ]
+            )
+    return len(rows)
+
+
+class EmbeddingBackfill:
+    """Background worker embedding the messages retrieval found without an embedding"""
+
+    def __init__(self, app):
+        self.app = app
+        self.batch = app.config.get('MEMORY_BACKFILL_BATCH', 200)
+        self.pending: Dict[int, object] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self._worker = None
+
+    def request(self, conversation_id: int, scope):
+        if not self.batch:
+            return
+        with self.lock:
+            self.pending[conversation_id] = scope
+            if self._worker != os.getpid():
+                self._worker = os.getpid()
+                threading.Thread(target=self._run, name='embedding-backfill', daemon=True).start()
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while True:
+                with self.lock:
+                    if not self.pending:
+                        break
+                    conversation_id, scope = self.pending.popitem()
+                try:
+                    with self.app.app_context():
+                        while backfill_embeddings(scope, self.batch) == self.batch:
+                            pass
+                except Exception:
+                    logger.exception('Embedding backfill failed for conversation %s', conversation_id)
+
+
+def retrieve_relevant(conversation: Conversation, query_text: str, exclude_ids: Iterable[int] = (), k: Optional[int] = None,
+                      min_score: float = 0.1) -> List[ChatMessage]:
+    """Get the k past messages most similar to query_text, oldest first"""
+    import numpy as np
+
+    k = current_app.config.get('MEMORY_TOP_K', 3) if k is None else k
+    if k <= 0 or not query_text:
+        return []
+
+    embedder = get_embedder()
+    scope = message_scope(conversation)
+    # Only the most recent MEMORY_MAX_SCAN messages are scored
+    rows = db.session.query(ChatMessage.id, ChatMessage.embedding, ChatMessage.embedding_model).filter(
+        scope
+    ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(
+        current_app.config.get('MEMORY_MAX_SCAN', 2000)
+    ).all()
+    # Messages stored before embeddings existed (or by another embedder) are embedded in the
+    # background, outside the request's transaction; until then retrieval skips them
+    if any(model != embedder.name for _, _, model in rows):
+        current_app.extensions['embedding_backfill'].request(conversation.id, scope)
+
+    excluded = set(exclude_ids)
+    rows = [
+        (message_id, blob) for message_id, blob, model in rows
+        if message_id not in excluded and blob and model == embedder.name
+    ]
+    if not rows:
+        return []
+
+    ids = np.fromiter((message_id for message_id, _ in rows), dtype=np.int64, count=len(rows))
+    matrix = np.frombuffer(b''.join(blob for _, blob in rows), dtype=np.float32).reshape(len(rows), -1)
+    scores = matrix @ embedder.embed(query_text)
+
+    top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+    top = top[np.argsort(-scores[top])]
+    selected = [int(ids[i]) for i in top if scores[i] >= min_score]
+    if not selected:
+        return []
+
+    return ChatMessage.query.filter(ChatMessage.id.in_(selected)).order_by(ChatMessage.created_at.asc()).all()
+
+
+def init_embeddings(app):
+    """Create the app's embedding backfill worker (started on first use)"""
+    app.extensions['embedding_backfill'] = EmbeddingBackfill(app)
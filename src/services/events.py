@@ -0,0 +1,308 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.models.ai_provider import db, Conversation, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Conversation fields sent with 'conversation' events (skips the message_count lazy load)
+CONVERSATION_EVENT_FIELDS = {'id', 'title', 'topic', 'participants', 'status', 'created_at', 'updated_at'}
+
+
+class Subscription:
+    """A subscriber's bounded event queue"""
+
+    def __init__(self, conversation_id: int, max_queue: int):
+        self.conversation_id = conversation_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def put(self, item: Dict):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Slow consumer: drop it, the client resumes with Last-Event-ID
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    """In-process publish/subscribe hub for conversation events"""
+
+    def __init__(self, backend, max_queue: int = 100):
+        self.backend = backend
+        self.max_queue = max_queue
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, conversation_id: int) -> Subscription:
+        self.backend.ensure_started()
+        subscription = Subscription(conversation_id, self.max_queue)
+        with self._lock:
+            self._subscribers[conversation_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.conversation_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.conversation_id]
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribed_conversations(self) -> set:
+        with self._lock:
+            return set(self._subscribers)
+
+    def wants_events(self) -> bool:
+        """Whether committed changes must be serialized for publish"""
+        return self.backend.publishes and self.has_subscribers()
+
+    def publish(self, events: List[Dict]):
+        """Publish committed events through the backend"""
+        self.backend.publish(events)
+
+    def dispatch(self, item: Dict):
+        """Deliver an event to the local subscribers of its conversation"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(item['conversation_id'], ()))
+        for subscription in subscribers:
+            subscription.put(item)
+
+
+class InProcessBackend:
+    """Delivers events to subscribers of the publishing process only"""
+    publishes = True
+
+    def __init__(self):
+        self.hub = None
+
+    def attach(self, hub: EventHub, app):
+        self.hub = hub
+
+    def ensure_started(self):
+        pass
+
+    def publish(self, events: List[Dict]):
+        for item in events:
+            self.hub.dispatch(item)
+
+
+class DatabasePollingBackend:
+    """Shares events between workers by polling the database for new rows.
+
+    Publishing is a no-op: every worker's poller picks up committed messages
+    (including its own) from chat_messages, so all subscribers see the same
+    stream whichever worker served the write. Deleted conversations leave no
+    row behind, so the poller checks that the ones with local subscribers
+    still exist.
+    """
+    publishes = False
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.hub = None
+        self.app = None
+        self.lookback = 10.0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._started = False
+        self._newest_message = None
+        self._seen_messages: Dict[int, datetime] = {}
+        self._last_conversation_update = None
+        self._deleted_conversations = set()
+
+    def attach(self, hub: EventHub, app):
+        self.hub = hub
+        self.app = app
+        self.interval = app.config.get('EVENTS_POLL_INTERVAL', self.interval)
+        self.lookback = app.config.get('EVENTS_POLL_LOOKBACK_SECONDS', self.lookback)
+
+    def ensure_started(self):
+        # Started on first subscription, so it runs in the worker and not in a preloading master
+        with self._lock:
+            if not self._started:
+                # Seeded before the first subscription is registered: rows committed after this
+                # are delivered by the first poll instead of being taken as already seen
+                self._seed()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(self.app,), name='event-poller', daemon=True)
+                self._thread.start()
+
+    def publish(self, events: List[Dict]):
+        pass
+
+    def _run(self, app):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with app.app_context():
+                    self.poll()
+            except Exception:
+                logger.exception('Event polling failed')
+
+    def _seed(self):
+        self._poll_messages(deliver=False)
+        self._last_conversation_update = db.session.query(db.func.max(Conversation.updated_at)).scalar()
+        self._started = True
+
+    def poll(self):
+        if not self._started:
+            self._seed()
+            return
+
+        self._poll_messages(deliver=self.hub.has_subscribers())
+        self._poll_deletions()
+
+        query = Conversation.query
+        if self._last_conversation_update is not None:
+            query = query.filter(Conversation.updated_at > self._last_conversation_update)
+        for conversation in query.order_by(Conversation.updated_at.asc()).limit(500).all():
+            self._last_conversation_update = conversation.updated_at
+            if self.hub.has_subscribers():
+                self.hub.dispatch(conversation_event(conversation))
+
+    def _poll_deletions(self):
+        subscribed = self.hub.subscribed_conversations()
+        # Announced once per conversation while it has subscribers
+        self._deleted_conversations &= subscribed
+        subscribed -= self._deleted_conversations
+        if not subscribed:
+            return
+        existing = {row[0] for row in db.session.query(Conversation.id).filter(Conversation.id.in_(subscribed))}
+        for conversation_id in subscribed - existing:
+            self._deleted_conversations.add(conversation_id)
+            self.hub.dispatch({
+                'id': None,
+                'type': 'conversation_deleted',
+                'conversation_id': conversation_id,
+                'data': {'id': conversation_id}
+            })
+
+    def _poll_messages(self, deliver: bool):
+        # Ids do not follow commit order (write-behind reserves them in blocks ahead of the
+        # insert), so re-read the last lookback seconds of rows and skip the ones already seen
+        since = self._newest_message - timedelta(seconds=self.lookback) if self._newest_message else None
+        query = db.session.query(ChatMessage.id, ChatMessage.created_at)
+        if since is not None:
+            query = query.filter(ChatMessage.created_at >= since)
+        else:
+            query = query.order_by(ChatMessage.created_at.desc()).limit(500)
+        unseen = []
+        for message_id, created_at in query.all():
+            if created_at is None or message_id in self._seen_messages:
+                continue
+            self._seen_messages[message_id] = created_at
+            unseen.append(message_id)
+            if self._newest_message is None or created_at > self._newest_message:
+                self._newest_message = created_at
+        if since is not None:
+            self._seen_messages = {
+                message_id: created_at for message_id, created_at in self._seen_messages.items() if created_at >= since
+            }
+
+        if not deliver:
+            return
+        for start in range(0, len(unseen), 500):
+            messages = ChatMessage.query.filter(ChatMessage.id.in_(unseen[start:start + 500])).order_by(
+                ChatMessage.created_at.asc(), ChatMessage.id.asc()
+            ).all()
+            for message in messages:
+                self.hub.dispatch(message_event(message))
+
+
+EVENT_BACKENDS = {
+    'memory': InProcessBackend,
+    'database': DatabasePollingBackend,
+}
+
+
+def message_event(message: ChatMessage) -> Dict:
+    return {
+        'id': message.id,
+        'type': 'message',
+        'conversation_id': message.conversation_id,
+        'data': message.to_dict()
+    }
+
+
+def conversation_event(conversation: Conversation, deleted: bool = False) -> Dict:
+    return {
+        'id': None,
+        'type': 'conversation_deleted' if deleted else 'conversation',
+        'conversation_id': conversation.id,
+        'data': {'id': conversation.id} if deleted else conversation.to_dict(CONVERSATION_EVENT_FIELDS)
+    }
+
+
+def get_hub() -> EventHub:
+    return current_app.extensions['event_hub']
+
+
+def _collect_events(session, flush_context):
+    """Serialize inserted messages and changed conversations while the session can still query"""
+    if not has_app_context() or 'event_hub' not in current_app.extensions:
+        return
+    # Nobody to deliver to; a subscriber connecting between this flush and the commit gets
+    # the message when it next resumes with Last-Event-ID
+    if not get_hub().wants_events():
+        return
+
+    pending = session.info.setdefault('pending_events', [])
+    for obj in session.new:
+        if isinstance(obj, ChatMessage):
+            pending.append(message_event(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Conversation) and session.is_modified(obj, include_collections=False):
+            pending.append(conversation_event(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Conversation):
+            pending.append(conversation_event(obj, deleted=True))
+
+
+def _publish_events(session):
+    # after_commit also fires when a savepoint is released; wait for the real commit
+    if session.in_nested_transaction():
+        return
+    events = session.info.pop('pending_events', None)
+    if events and has_app_context() and 'event_hub' in current_app.extensions:
+        get_hub().publish(events)
+
+
+def _discard_events(session, previous_transaction):
+    # A rolled back savepoint leaves the outer transaction (and its events) alive
+    if not previous_transaction.nested:
+        session.info.pop('pending_events', None)
+
+
+def init_events(app):
+    """Create the app's event hub and start its backend"""
+    backend_name = app.config.get('EVENTS_BACKEND', 'memory')
+    if backend_name not in EVENT_BACKENDS:
+        raise ValueError(f'Unknown events backend: {backend_name}')
+
+    hub = EventHub(EVENT_BACKENDS[backend_name](), max_queue=app.config.get('EVENTS_QUEUE_SIZE', 100))
+    hub.backend.attach(hub, app)
+    app.extensions['event_hub'] = hub
+
+    if not event.contains(Session, 'after_flush', _collect_events):
+        event.listen(Session, 'after_flush', _collect_events)
+        event.listen(Session, 'after_commit', _publish_events)
+        event.listen(Session, 'after_soft_rollback', _discard_events)
@@ -0,0 +1,17 @@
+from typing import Optional, Set
+
+from flask import request
+
+
+def requested_fields(resource: str, primary: bool = True) -> Optional[Set[str]]:
+    """Get the sparse fieldset requested for a resource, or None for all fields.
+
+    ``?fields[messages]=id,content`` selects fields of a given resource, while a
+    plain ``?fields=id,content`` applies to the primary resource of the endpoint.
+    """
+    value = request.args.get(f'fields[{resource}]')
+    if value is None and primary:
+        value = request.args.get('fields')
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
@@ -0,0 +1,154 @@
+"""Copy-on-write conversation forks.
+
+A fork references its parent's transcript up to the message it was forked at
+(``parent_id``, ``fork_message_id``) instead of copying it, so forking is one
+insert whatever the transcript length. ``prefix_count`` keeps how many
+messages are inherited, for message counts.
+
+A conversation's own messages always sort after the ones it inherits, so a
+transcript is a chain of segments, root first: each ancestor's own messages up
+to the point the next one forked, then the conversation's own messages.
+``message_scope`` turns that chain into the filter history reads use
+(transcripts, recent history, retrieval, export). Messages are only ever
+forked from their owner, which keeps chains as short as the fork tree is deep.
+
+Inherited messages are copied into a fork only before the parent changes
+them: when the parent is deleted, or when one of them is edited (a candidate
+selected). The fork then inherits from its grandparent directly. Copies keep
+timestamps, content, metadata, embeddings and candidates, but not
+``provider_id``, so rebuilt usage rollups do not count their tokens twice.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import undefer
+
+from src.models.ai_provider import db, ChatMessage, Conversation, MessageCandidate
+
+
+def _position(message: ChatMessage) -> tuple:
+    return message.created_at, message.id
+
+
+def _up_to(conversation_id: int, last: Optional[ChatMessage]):
+    """Own messages of conversation_id, up to last in transcript order when given"""
+    own = ChatMessage.conversation_id == conversation_id
+    if last is None:
+        return own
+    return and_(own, or_(
+        ChatMessage.created_at < last.created_at,
+        and_(ChatMessage.created_at == last.created_at, ChatMessage.id <= last.id)
+    ))
+
+
+def lineage(conversation: Conversation) -> List[Tuple[int, Optional[ChatMessage]]]:
+    """Segments of conversation's transcript, root first: (conversation id, last message inherited or None)"""
+    segments = [(conversation.id, None)]
+    current = conversation
+    while current.parent_id is not None:
+        parent = db.session.get(Conversation, current.parent_id)
+        fork_message = db.session.get(ChatMessage, current.fork_message_id) if current.fork_message_id else None
+        if parent is None or fork_message is None or any(parent.id == cid for cid, _ in segments):
+            break
+        segments.append((parent.id, fork_message))
+        current = parent
+    return segments[::-1]
+
+
+def message_scope(conversation: Conversation):
+    """SQL criterion selecting the messages of conversation's transcript, inherited ones included"""
+    if conversation.parent_id is None:
+        return ChatMessage.conversation_id == conversation.id
+    return or_(*(_up_to(conversation_id, last) for conversation_id, last in lineage(conversation)))
+
+
+def in_transcript(conversation: Conversation, message: ChatMessage) -> bool:
+    for conversation_id, last in lineage(conversation):
+        if message.conversation_id == conversation_id:
+            return last is None or _position(message) <= _position(last)
+    return False
+
+
+def fork_conversation(source: Conversation, message: ChatMessage, title: Optional[str] = None) -> Conversation:
+    """A new conversation continuing source's transcript from message (which must be part of it)"""
+    # Forking from the message's owner keeps the chain short when message is itself inherited
+    owner = source if message.conversation_id == source.id else db.session.get(Conversation, message.conversation_id)
+    inherited = db.session.query(func.count(ChatMessage.id)).filter(_up_to(owner.id, message)).scalar()
+    fork = Conversation(
+        title=title or f'{source.title} (fork)',
+        topic=source.topic,
+        participants=source.participants,
+        parent_id=owner.id,
+        fork_message_id=message.id,
+        prefix_count=(owner.prefix_count or 0) + inherited
+    )
+    db.session.add(fork)
+    return fork
+
+
+def _copy(message: ChatMessage, conversation_id: int, candidates: List[tuple]) -> ChatMessage:
+    copy = ChatMessage(
+        conversation_id=conversation_id,
+        personality_id=message.personality_id,
+        content=message.content,
+        message_type=message.message_type,
+        sender_type=message.sender_type,
+        message_metadata=message.message_metadata,
+        created_at=message.created_at,
+        model=message.model,
+        prompt_tokens=message.prompt_tokens,
+        completion_tokens=message.completion_tokens,
+        latency_ms=message.latency_ms,
+        embedding=message.embedding,
+        embedding_model=message.embedding_model
+    )
+    copy.candidates = [
+        MessageCandidate(
+            conversation_id=conversation_id,
+            candidate_index=candidate_index,
+            content=content,
+            completion_tokens=completion_tokens,
+            created_at=created_at
+        )
+        for candidate_index, content, completion_tokens, created_at in candidates
+    ]
+    return copy
+
+
+def materialize_forks(conversation: Conversation, through: Optional[ChatMessage] = None) -> List[Conversation]:
+    """Copy conversation's messages into the forks inheriting them (only those inheriting through, when given)"""
+    forks = []
+    for fork in Conversation.query.filter_by(parent_id=conversation.id).all():
+        fork_message = db.session.get(ChatMessage, fork.fork_message_id) if fork.fork_message_id else None
+        if through is not None and (fork_message is None or _position(through) > _position(fork_message)):
+            continue
+        forks.append((fork, fork_message))
+    if not forks:
+        return []
+
+    # Load the messages once, up to the furthest fork point
+    points = [fork_message for _, fork_message in forks if fork_message is not None]
+    furthest = max(points, key=_position) if points else None
+    inherited = ChatMessage.query.options(undefer(ChatMessage.embedding)).filter(
+        _up_to(conversation.id, furthest)
+    ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).all() if furthest is not None else []
+    # Read as rows: loaded candidates would be deleted again by the parent's cascade
+    candidates = {}
+    for row in db.session.query(
+        MessageCandidate.message_id, MessageCandidate.candidate_index, MessageCandidate.content,
+        MessageCandidate.completion_tokens, MessageCandidate.created_at
+    ).filter(MessageCandidate.conversation_id == conversation.id).order_by(MessageCandidate.candidate_index):
+        candidates.setdefault(row[0], []).append(tuple(row[1:]))
+
+    now = datetime.utcnow()
+    for fork, fork_message in forks:
+        for message in inherited if fork_message is not None else ():
+            if _position(message) > _position(fork_message):
+                break
+            db.session.add(_copy(message, fork.id, candidates.get(message.id, [])))
+        fork.parent_id = conversation.parent_id
+        fork.fork_message_id = conversation.fork_message_id
+        fork.prefix_count = conversation.prefix_count
+        fork.updated_at = now
+    return [fork for fork, _ in forks]
@@ -0,0 +1,47 @@
+import hashlib
+from typing import Callable
+
+from flask import current_app, request, Response
+from sqlalchemy import func
+
+from src.models.ai_provider import db
+from src.services.compression import etag_variants
+
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag value from cheap version stamps"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def table_stamp(model) -> tuple:
+    """Version stamp of a whole table: row count, highest id and latest update"""
+    return db.session.query(
+        func.count(model.id),
+        func.max(model.id),
+        func.max(model.updated_at)
+    ).one()
+
+
+def conditional_response(etag: str, build_response: Callable[[], Response], cache_control: str = 'no-cache') -> Response:
+    """Answer If-None-Match with 304 before building (and serializing) the full response"""
+    for variant in etag_variants(etag):
+        if request.if_none_match.contains(variant):
+            # Echo the variant the client holds, which may be a compressed one
+            response = current_app.response_class(status=304)
+            response.set_etag(variant)
+            break
+    else:
+        response = build_response()
+        response.set_etag(etag)
+
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def precomputed_json(body: bytes, etag: str, cache_control: str = 'public, max-age=3600') -> Response:
+    """Serve a static JSON body (computed once at import time) with conditional GET support"""
+    return conditional_response(
+        etag,
+        lambda: current_app.response_class(body, mimetype='application/json'),
+        cache_control
+    )
@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, make_response, request
+from sqlalchemy.exc import IntegrityError
+
+from src.models.ai_provider import db, IdempotencyRecord
+
+# Requests running in this process, by key, so duplicates can wait on them
+_inflight = {}
+_inflight_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+def _request_hash() -> str:
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _cleanup_expired():
+    """Delete expired records, at most once a minute per process"""
+    global _last_cleanup
+    if time.monotonic() - _last_cleanup < 60:
+        return
+    _last_cleanup = time.monotonic()
+    IdempotencyRecord.query.filter(IdempotencyRecord.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _claim(key: str, request_hash: str):
+    """Insert an in-progress record for key, returns the existing record if there is one"""
+    ttl = current_app.config.get('IDEMPOTENCY_TTL_SECONDS', 86400)
+    try:
+        db.session.add(IdempotencyRecord(
+            key=key,
+            request_hash=request_hash,
+            status='in_progress',
+            expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+        ))
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+        return IdempotencyRecord.query.filter_by(key=key).first()
+
+
+def _replay(record: IdempotencyRecord):
+    response = current_app.response_class(record.response_body, status=record.response_status, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_for(key: str, timeout: float):
+    """Wait until the request holding key finishes (locally or in another worker)"""
+    deadline = time.monotonic() + timeout
+    with _inflight_lock:
+        local = _inflight.get(key)
+
+    while time.monotonic() < deadline:
+        if local is not None:
+            local.wait(deadline - time.monotonic())
+        else:
+            time.sleep(0.1)
+
+        db.session.expire_all()
+        record = IdempotencyRecord.query.filter_by(key=key).first()
+        if record is None or record.status != 'in_progress':
+            return record
+    return IdempotencyRecord.query.filter_by(key=key).first()
+
+
+def idempotent(view):
+    """Make a POST endpoint safe to retry with an Idempotency-Key header.
+
+    The first request with a key runs the view and stores its response. A retry
+    that arrives while it is still running waits for it (single flight) instead
+    of calling the provider again, and later retries replay the stored response.
+    Server errors and cancelled requests (499) are not stored, so the client can
+    retry them.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'success': False, 'error': 'Idempotency-Key must be at most 255 characters'}), 400
+
+        _cleanup_expired()
+        request_hash = _request_hash()
+        lock_timeout = current_app.config.get('IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', 600)
+
+        while True:
+            record = _claim(key, request_hash)
+            if record is None:
+                break
+
+            if record.request_hash != request_hash:
+                return jsonify({'success': False, 'error': 'Idempotency-Key was already used for a different request'}), 422
+            if record.expires_at < datetime.utcnow() or (
+                record.status == 'in_progress'
+                and record.created_at < datetime.utcnow() - timedelta(seconds=lock_timeout)
+            ):
+                # Expired, or abandoned by a worker that died mid-request: start over
+                db.session.delete(record)
+                db.session.commit()
+                continue
+            if record.status == 'completed':
+                return _replay(record)
+
+            record = _wait_for(key, current_app.config.get('IDEMPOTENCY_WAIT_SECONDS', 120))
+            if record is None:
+                # The original request failed with a server error: run it again
+                continue
+            if record.status == 'completed':
+                return _replay(record)
+            return jsonify({'success': False, 'error': 'A request with this Idempotency-Key is still in progress'}), 409
+
+        done = threading.Event()
+        with _inflight_lock:
+            _inflight[key] = done
+
+        try:
+            response = make_response(view(*args, **kwargs))
+            db.session.rollback()
+            record = IdempotencyRecord.query.filter_by(key=key).first()
+            if record is not None:
+                if response.status_code >= 500 or response.status_code == 499:
+                    db.session.delete(record)
+                else:
+                    record.status = 'completed'
+                    record.response_status = response.status_code
+                    record.response_body = response.get_data(as_text=True)
+                db.session.commit()
+            return response
+        except Exception:
+            db.session.rollback()
+            IdempotencyRecord.query.filter_by(key=key).delete(synchronize_session=False)
+            db.session.commit()
+            raise
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+            done.set()
+
+    return wrapper
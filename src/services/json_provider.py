@@ -0,0 +1,54 @@
+import typing as t
+
+from flask.json.provider import DefaultJSONProvider
+
+from src.services import tracing
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that uses orjson when it is installed.
+
+    Output matches the default provider: keys are sorted when ``sort_keys`` is
+    set, and dates, decimals, UUIDs and dataclasses go through the same
+    ``default`` hook. Falls back to the standard library when orjson is missing
+    or when a caller passes options orjson does not support.
+    """
+
+    def _orjson_options(self) -> int:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj: t.Any, **kwargs: t.Any) -> str:
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode('utf-8')
+
+    def dumps_bytes(self, obj: t.Any) -> bytes:
+        """Serialize straight to bytes, skipping the str round trip"""
+        if orjson is None:
+            return super().dumps(obj).encode('utf-8')
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options())
+
+    def loads(self, s: str | bytes, **kwargs: t.Any) -> t.Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: t.Any, **kwargs: t.Any):
+        obj = self._prepare_response_obj(args, kwargs)
+
+        # Pretty printing (debug mode) keeps the default implementation
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+
+        with tracing.start_span('json.serialize', new_trace=False) as span:
+            body = self.dumps_bytes(obj) + b'\n'
+            span.set_attribute('response.bytes', len(body))
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,377 @@
+"""Prometheus-style metrics with a tiny in-process registry.
+
+Each labeled series has its own lock, so recording only contends with other
+threads touching the very same series. When ``METRICS_MULTIPROC_DIR`` is set,
+every process periodically writes a snapshot there and ``/metrics`` merges the
+snapshots of all workers.
+"""
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+
+
+class _Series:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+class _CounterSeries(_Series):
+    def __init__(self):
+        super().__init__()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+
+class _GaugeSeries(_Series):
+    def __init__(self):
+        super().__init__()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        with self.lock:
+            self.value = value
+
+
+class _HistogramSeries(_Series):
+    def __init__(self, buckets: Sequence[float]):
+        super().__init__()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self) -> _Series:
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def snapshot(self) -> List:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount: float = 1.0, **labels):
+        self.labels(**labels).inc(amount)
+
+    def snapshot(self):
+        return [[list(key), series.value] for key, series in list(self._series.items())]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect: Optional[Callable[['Gauge'], None]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _new_series(self):
+        return _GaugeSeries()
+
+    def set(self, value: float, **labels):
+        self.labels(**labels).set(value)
+
+    def snapshot(self):
+        if self.collect is not None:
+            self.collect(self)
+        return [[list(key), series.value] for key, series in list(self._series.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float, **labels):
+        self.labels(**labels).observe(value)
+
+    def snapshot(self):
+        rows = []
+        for key, series in list(self._series.items()):
+            with series.lock:
+                rows.append([list(key), list(series.counts), series.sum])
+        return rows
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def snapshot(self) -> Dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    # Multi-process support
+
+    def write_snapshot(self, directory: str):
+        """Atomically write this process's values to the shared directory"""
+        path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'pid': os.getpid(), 'metrics': self.snapshot()}, handle)
+        os.replace(temporary, path)
+
+    def ensure_flusher(self, directory: str, interval: float):
+        """Start the per-process snapshot writer (lazily, so it runs in each worker)"""
+        if self._flusher is not None and self._flusher[0] == os.getpid():
+            return
+        with self._flusher_lock:
+            if self._flusher is not None and self._flusher[0] == os.getpid():
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.write_snapshot(directory)
+                    except OSError:
+                        pass
+
+            thread = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+            thread.start()
+            self._flusher = (os.getpid(), thread)
+
+    def collect_snapshots(self, directory: str) -> List[Dict]:
+        self.write_snapshot(directory)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not (filename.startswith('metrics_') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as handle:
+                    snapshots.append(json.load(handle))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    # Exposition
+
+    def render(self, directory: Optional[str] = None) -> str:
+        if directory:
+            snapshots = self.collect_snapshots(directory)
+        else:
+            snapshots = [{'pid': os.getpid(), 'metrics': self.snapshot()}]
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            merged = _merge(metric, snapshots)
+            for key, value in sorted(merged.items()):
+                labels = dict(zip(metric.labelnames, key))
+                if metric.kind == 'histogram':
+                    counts, total = value
+                    cumulative = 0
+                    for bound, count in zip(list(metric.buckets) + [math.inf], counts):
+                        cumulative += count
+                        le = '+Inf' if bound == math.inf else repr(float(bound))
+                        lines.append(f'{name}_bucket{_format_labels(labels, le=le)} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+                else:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _merge(metric: Metric, snapshots: List[Dict]) -> Dict:
+    """Sum a metric across processes; gauges only count processes that are still alive"""
+    merged = {}
+    for snapshot in snapshots:
+        if metric.kind == 'gauge' and not _pid_alive(snapshot['pid']):
+            continue
+        for row in snapshot['metrics'].get(metric.name, []):
+            key = tuple(row[0])
+            if metric.kind == 'histogram':
+                counts, total = merged.get(key, ([0] * (len(metric.buckets) + 1), 0.0))
+                merged[key] = ([a + b for a, b in zip(counts, row[1])], total + row[2])
+            else:
+                merged[key] = merged.get(key, 0.0) + row[1]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str], **extra) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests', ['method', 'route', 'status'])
+LLM_CALL_DURATION = REGISTRY.histogram(
+    'llm_call_duration_seconds', 'Latency of provider calls', ['provider', 'model'], buckets=LLM_BUCKETS)
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    'llm_time_to_first_token_seconds', 'Time until the first token arrives (the whole reply when not streaming)',
+    ['provider', 'model'], buckets=LLM_BUCKETS)
+LLM_TOKENS = REGISTRY.counter(
+    'llm_tokens_total', 'Tokens consumed by provider calls', ['provider', 'model', 'kind'])
+LLM_FAILURES = REGISTRY.counter(
+    'llm_failures_total', 'Failed provider calls by failure class', ['provider', 'error_type'])
+LLM_INFLIGHT = REGISTRY.gauge(
+    'llm_inflight_calls', 'Provider calls currently in flight', ['provider'])
+AUTO_CONTINUE_TURNS = REGISTRY.counter(
+    'auto_continue_turns_total', 'Auto-continue turns by outcome', ['outcome'])
+DB_QUERY_DURATION = REGISTRY.histogram(
+    'db_query_duration_seconds', 'Time spent executing SQL statements', [])
+
+
+DB_POOL = REGISTRY.gauge(
+    'db_pool_connections', 'Database connection pool usage', ['bind', 'state'])
+
+
+def _collect_pool(app, gauge: Gauge):
+    from src.models.ai_provider import db
+
+    with app.app_context():
+        engines = db.engines
+    for bind, engine in engines.items():
+        pool = engine.pool
+        for state, method_name in (('checked_out', 'checkedout'), ('size', 'size'), ('overflow', 'overflow')):
+            method = getattr(pool, method_name, None)
+            if method is not None:
+                # QueuePool reports unused overflow capacity as a negative number
+                gauge.set(max(0, method()), bind=bind or 'default', state=state)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if starts:
+        DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop())
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute: drop its start time from the pooled connection
+    connection = exception_context.connection
+    starts = connection.info.get('metrics_query_start') if connection is not None else None
+    if starts:
+        DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop())
+
+
+def multiproc_dir(app) -> Optional[str]:
+    return app.config.get('METRICS_MULTIPROC_DIR') or None
+
+
+def record_metrics_activity(app):
+    """Make sure this process publishes its values when running multi-process"""
+    directory = multiproc_dir(app)
+    if directory:
+        REGISTRY.ensure_flusher(directory, app.config.get('METRICS_FLUSH_INTERVAL', 5))
+
+
+def init_metrics(app):
+    """Instrument requests and SQL statements of the app"""
+    from flask import g, request
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    DB_POOL.collect = lambda gauge: _collect_pool(app, gauge)
+
+    directory = multiproc_dir(app)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_request_start = time.perf_counter()
+        record_metrics_activity(app)
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop('metrics_request_start', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=request.method,
+                route=route,
+                status=response.status_code
+            )
+        return response
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
@@ -0,0 +1,232 @@
+"""Provider health probes.
+
+Probes run concurrently (one short completion per provider) under a shared
+timeout and the outcome is stored on the provider row, so routing and the UI
+can read the latest status, latency and error without a live call. With
+``HEALTH_PROBE_INTERVAL`` set, each worker process also refreshes them in the
+background.
+"""
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from flask import current_app
+from sqlalchemy import func, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src.models.ai_provider import db, AIProvider
+from src.services.ai_adapter import AIAdapterFactory
+from src.services.cancellation import CancelToken, cancelled_by
+from src.services.scheduler import PROBE, call_priority
+
+logger = logging.getLogger(__name__)
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+DOWN = 'down'
+
+# Failures that still prove the provider is reachable
+DEGRADED_ERROR_TYPES = {'rate_limit', 'queue_timeout'}
+
+PROBE_SYSTEM_PROMPT = "You are a helpful assistant. Respond with exactly: 'Connection test successful!'"
+PROBE_USER_MESSAGE = "Test connection"
+
+
+def _provider_settings(provider: AIProvider) -> Dict:
+    """Plain copy of what a probe needs, safe to hand to another thread"""
+    return {
+        'id': provider.id,
+        'api_type': provider.api_type,
+        'api_key': provider.api_key,
+        'api_base_url': provider.api_base_url,
+        'model': provider.default_model,
+    }
+
+
+def probe(settings: Dict, timeout: float, max_tokens: int = 16, token: Optional[CancelToken] = None) -> Dict:
+    """Send one short completion to a provider (streamed and stopped when token is cancelled)"""
+    try:
+        adapter = AIAdapterFactory.create_adapter(
+            api_type=settings['api_type'],
+            api_key=settings['api_key'],
+            api_base_url=settings['api_base_url'],
+            model=settings['model'],
+            max_tokens=max_tokens,
+            temperature=0,
+            timeout=timeout
+        )
+        messages = adapter.format_messages(system_prompt=PROBE_SYSTEM_PROMPT, user_message=PROBE_USER_MESSAGE)
+        with call_priority(PROBE), cancelled_by(token or CancelToken()):
+            return adapter.send_message(messages)
+    except Exception as e:
+        return {'success': False, 'error': str(e), 'error_type': 'unexpected', 'content': None}
+
+
+def probe_providers(providers: Iterable[AIProvider], timeout: float, max_workers: int = 8,
+                    max_tokens: int = 16) -> Dict[int, Dict]:
+    """Probe providers concurrently; probes still running after timeout count as timeouts"""
+    settings = [_provider_settings(provider) for provider in providers]
+    if not settings:
+        return {}
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(settings)), thread_name_prefix='provider-probe')
+    started = time.perf_counter()
+    tokens = {item['id']: CancelToken() for item in settings}
+    futures = {
+        # Each probe runs in a copy of this context so its spans join the current trace
+        executor.submit(contextvars.copy_context().run, probe, item, timeout, max_tokens, tokens[item['id']]): item['id']
+        for item in settings
+    }
+    done, _ = wait(futures, timeout=timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+    # Probes still waiting for a slot or streaming stop now instead of running on after being reported
+    for future, provider_id in futures.items():
+        if future not in done:
+            tokens[provider_id].cancel('timeout')
+
+    results = {}
+    for future, provider_id in futures.items():
+        if future in done:
+            results[provider_id] = future.result()
+        else:
+            results[provider_id] = {
+                'success': False,
+                'error': f'Probe did not finish within {timeout:g}s',
+                'error_type': 'timeout',
+                'content': None,
+                'latency_ms': int((time.perf_counter() - started) * 1000)
+            }
+    return results
+
+
+def health_values(provider: AIProvider, result: Dict, now: datetime, degraded_latency_ms: int,
+                  alpha: float) -> Dict:
+    """Column values describing a probe result, folding latency into a moving average"""
+    latency = result.get('latency_ms')
+    if result.get('success'):
+        score = provider.health_latency_score
+        if latency is not None:
+            score = latency if score is None else alpha * latency + (1 - alpha) * score
+        return {
+            'health_status': DEGRADED if latency is not None and latency > degraded_latency_ms else HEALTHY,
+            'health_latency_ms': latency,
+            'health_latency_score': round(score, 1) if score is not None else None,
+            'health_error': None,
+            'health_error_type': None,
+            'health_consecutive_failures': 0,
+            'health_checked_at': now,
+        }
+
+    error_type = result.get('error_type', 'unexpected')
+    return {
+        'health_status': DEGRADED if error_type in DEGRADED_ERROR_TYPES else DOWN,
+        'health_latency_ms': latency,
+        'health_latency_score': provider.health_latency_score,
+        'health_error': (result.get('error') or '')[:1000],
+        'health_error_type': error_type,
+        'health_consecutive_failures': (provider.health_consecutive_failures or 0) + 1,
+        'health_checked_at': now,
+    }
+
+
+def record_health(provider: AIProvider, result: Dict) -> Dict:
+    """Store a probe result on the provider (without touching updated_at) and return it"""
+    config = current_app.config
+    values = health_values(
+        provider,
+        result,
+        datetime.utcnow(),
+        config.get('HEALTH_DEGRADED_LATENCY_MS', 5000),
+        config.get('HEALTH_LATENCY_ALPHA', 0.3)
+    )
+    db.session.execute(
+        update(AIProvider)
+        .where(AIProvider.id == provider.id)
+        .values(updated_at=AIProvider.updated_at, **values)
+        .execution_options(synchronize_session=False)
+    )
+    # Reflect the values on the instance without marking it dirty (a flush would bump updated_at)
+    for name, value in values.items():
+        set_committed_value(provider, name, value)
+    return values
+
+
+def check_providers(provider_ids: Optional[List[int]] = None, include_inactive: bool = False,
+                    timeout: Optional[float] = None) -> List[Dict]:
+    """Probe providers concurrently, persist their health and return it"""
+    config = current_app.config
+    query = AIProvider.query
+    if not include_inactive:
+        query = query.filter_by(is_active=True)
+    if provider_ids is not None:
+        query = query.filter(AIProvider.id.in_(provider_ids))
+    providers = query.order_by(AIProvider.id).all()
+
+    results = probe_providers(
+        providers,
+        timeout or config.get('HEALTH_PROBE_TIMEOUT', 10),
+        config.get('HEALTH_PROBE_MAX_WORKERS', 8),
+        config.get('HEALTH_PROBE_MAX_TOKENS', 16)
+    )
+
+    for provider in providers:
+        record_health(provider, results[provider.id])
+    db.session.commit()
+
+    return [{
+        'provider_id': provider.id,
+        'name': provider.name,
+        'health': provider.health_to_dict()
+    } for provider in providers]
+
+
+def health_stamp():
+    """Changes whenever a probe result is stored (for ETags over provider data)"""
+    return db.session.query(func.max(AIProvider.health_checked_at)).scalar()
+
+
+# Background prober
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+def _run_prober(app, interval: float):
+    while True:
+        # Jitter so the workers of one deployment drift apart
+        time.sleep(interval * random.uniform(0.9, 1.1))
+        try:
+            with app.app_context():
+                # Another worker probed recently: its results are already shared through the database
+                latest = health_stamp()
+                if latest is not None and latest > datetime.utcnow() - timedelta(seconds=interval / 2):
+                    continue
+                check_providers()
+        except Exception:
+            logger.exception('Background provider probe failed')
+
+
+def ensure_prober(app):
+    """Start the background prober of this process, when an interval is configured"""
+    global _prober
+    interval = app.config.get('HEALTH_PROBE_INTERVAL') or 0
+    if interval <= 0 or (_prober is not None and _prober[0] == os.getpid()):
+        return
+    with _prober_lock:
+        if _prober is not None and _prober[0] == os.getpid():
+            return
+        thread = threading.Thread(target=_run_prober, args=(app, interval), name='provider-prober', daemon=True)
+        thread.start()
+        _prober = (os.getpid(), thread)
+
+
+def init_provider_health(app):
+    """Start the background prober lazily, so it runs in each worker rather than a preloading master"""
+    if app.config.get('HEALTH_PROBE_INTERVAL'):
+        app.before_request(lambda: ensure_prober(app))
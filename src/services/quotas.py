@@ -0,0 +1,313 @@
+"""Per-client request quotas and daily LLM-token budgets.
+
+Clients are users identified by an API key (``X-API-Key`` or
+``Authorization: Bearer``), or the remote address for anonymous callers.
+Every ``/api`` request takes from the client's token bucket (LLM-backed views
+take ``quota_cost(request)``), and LLM-backed views are refused once the
+client's tokens for the UTC day reach its budget. Both checks only touch
+in-memory state; token usage is written to ``client_usage`` by a background
+flusher, which also picks up what other worker processes consumed.
+
+Rate buckets are per process, so with several workers the effective request
+rate is up to workers x the configured one; the daily budget is shared through
+the database and may be overshot by what was used since the last flush.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy.exc import IntegrityError
+
+from src.models import db
+from src.models.user import ClientUsage, User
+from src.services.auth import request_api_key
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidApiKey(Exception):
+    pass
+
+
+class Client(NamedTuple):
+    key: str
+    user_id: Optional[int]
+    requests_per_minute: Optional[int]
+    daily_token_budget: Optional[int]
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'lock')
+
+    def __init__(self, per_minute: int, now: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = now
+        self.lock = threading.Lock()
+
+    def take(self, cost: float, now: float) -> float:
+        """Take cost tokens; returns 0 on success, else the seconds until they are available"""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0.0
+            return (min(cost, self.capacity) - self.tokens) / self.rate
+
+    def remaining(self, now: float) -> int:
+        with self.lock:
+            return int(min(self.capacity, self.tokens + (now - self.updated) * self.rate))
+
+
+class DailyCounter:
+    """A client's usage for one day: what the database had at the last sync plus local increments"""
+    __slots__ = ('base_tokens', 'pending_tokens', 'pending_requests', 'lock')
+
+    def __init__(self, base_tokens: int):
+        self.base_tokens = base_tokens
+        self.pending_tokens = 0
+        self.pending_requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def tokens(self) -> int:
+        return self.base_tokens + self.pending_tokens
+
+
+def _seconds_until_tomorrow(now: datetime) -> int:
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return max(1, math.ceil((tomorrow - now).total_seconds()))
+
+
+class QuotaManager:
+    def __init__(self, app):
+        self.app = app
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.counters: Dict[Tuple[str, date], DailyCounter] = {}
+        self.api_keys: Dict[str, Tuple[float, Optional[Client]]] = {}
+        self.lock = threading.Lock()
+        self._flusher = None
+
+    @property
+    def config(self):
+        return self.app.config
+
+    # Clients
+
+    def resolve_client(self, req) -> Client:
+        api_key = request_api_key(req)
+        if not api_key:
+            # The client address as seen by the proxies in front of the app (see PROXY_FIX_X_FOR)
+            return Client(
+                f'ip:{req.remote_addr}',
+                None,
+                self.config.get('QUOTA_ANONYMOUS_REQUESTS_PER_MINUTE'),
+                self.config.get('QUOTA_ANONYMOUS_DAILY_TOKENS')
+            )
+
+        key_hash = User.hash_api_key(api_key)
+        cached = self.api_keys.get(key_hash)
+        if cached is None or cached[0] < time.monotonic():
+            user = User.query.filter_by(api_key_hash=key_hash).first()
+            client = None
+            if user is not None:
+                client = Client(
+                    f'user:{user.id}',
+                    user.id,
+                    user.requests_per_minute or self.config.get('QUOTA_REQUESTS_PER_MINUTE'),
+                    user.daily_token_budget or self.config.get('QUOTA_DAILY_TOKENS')
+                )
+            if len(self.api_keys) > 10000:
+                self.api_keys.clear()
+            cached = (time.monotonic() + self.config.get('QUOTA_CLIENT_CACHE_SECONDS', 60), client)
+            self.api_keys[key_hash] = cached
+
+        if cached[1] is None:
+            raise InvalidApiKey()
+        return cached[1]
+
+    # Counters
+
+    def _bucket(self, client: Client, now: float) -> Optional[TokenBucket]:
+        if not client.requests_per_minute:
+            return None
+        bucket = self.buckets.get(client.key)
+        if bucket is None or bucket.capacity != client.requests_per_minute:
+            with self.lock:
+                bucket = self.buckets.get(client.key)
+                if bucket is None or bucket.capacity != client.requests_per_minute:
+                    bucket = self.buckets[client.key] = TokenBucket(client.requests_per_minute, now)
+        return bucket
+
+    def _counter(self, client_key: str, day: date) -> DailyCounter:
+        counter = self.counters.get((client_key, day))
+        if counter is None:
+            # First use of this client today in this process: start from what was persisted
+            row = ClientUsage.query.filter_by(client=client_key, day=day).first()
+            with self.lock:
+                counter = self.counters.setdefault((client_key, day), DailyCounter(row.tokens if row else 0))
+        return counter
+
+    def check(self, client: Client, cost: float, llm: bool) -> Optional[Tuple[int, str]]:
+        """Returns (retry_after, reason) when the request must be refused"""
+        now = time.monotonic()
+        bucket = self._bucket(client, now)
+        if bucket is not None:
+            wait = bucket.take(cost, now)
+            if wait:
+                return max(1, math.ceil(wait)), f'Rate limit exceeded: {client.requests_per_minute} requests per minute'
+
+        if llm:
+            utcnow = datetime.utcnow()
+            counter = self._counter(client.key, utcnow.date())
+            with counter.lock:
+                counter.pending_requests += 1
+            if client.daily_token_budget and counter.tokens >= client.daily_token_budget:
+                return _seconds_until_tomorrow(utcnow), f'Daily token budget of {client.daily_token_budget} exhausted'
+        return None
+
+    def charge(self, client_key: str, tokens: int):
+        counter = self._counter(client_key, datetime.utcnow().date())
+        with counter.lock:
+            counter.pending_tokens += tokens
+
+    def status(self, client: Client) -> Dict:
+        now = time.monotonic()
+        bucket = self._bucket(client, now)
+        counter = self._counter(client.key, datetime.utcnow().date())
+        return {
+            'client': client.key,
+            'requests_per_minute': client.requests_per_minute,
+            'requests_remaining': bucket.remaining(now) if bucket else None,
+            'daily_token_budget': client.daily_token_budget,
+            'tokens_used_today': counter.tokens,
+        }
+
+    # Persistence
+
+    def flush(self):
+        """Add local increments to client_usage, then refresh each counter from the shared totals"""
+        today = datetime.utcnow().date()
+        for (client_key, day), counter in list(self.counters.items()):
+            with counter.lock:
+                tokens, requests = counter.pending_tokens, counter.pending_requests
+            if tokens or requests:
+                _add_usage(client_key, day, tokens, requests)
+                db.session.commit()
+            row = ClientUsage.query.filter_by(client=client_key, day=day).first()
+            with counter.lock:
+                counter.pending_tokens -= tokens
+                counter.pending_requests -= requests
+                counter.base_tokens = row.tokens if row else 0
+            if day < today and not (counter.pending_tokens or counter.pending_requests):
+                with self.lock:
+                    self.counters.pop((client_key, day), None)
+
+        # Forget buckets that have refilled completely
+        now = time.monotonic()
+        with self.lock:
+            for key, bucket in list(self.buckets.items()):
+                if bucket.remaining(now) >= bucket.capacity:
+                    del self.buckets[key]
+
+    def ensure_flusher(self):
+        """Start this process's flusher (lazily, so it runs in each worker)"""
+        if self._flusher is not None and self._flusher[0] == os.getpid():
+            return
+        with self.lock:
+            if self._flusher is not None and self._flusher[0] == os.getpid():
+                return
+            interval = self.config.get('QUOTA_FLUSH_INTERVAL', 10)
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        with self.app.app_context():
+                            self.flush()
+                    except Exception:
+                        logger.exception('Could not persist quota counters')
+
+            thread = threading.Thread(target=run, name='quota-flusher', daemon=True)
+            thread.start()
+            self._flusher = (os.getpid(), thread)
+
+
+def _add_usage(client_key: str, day: date, tokens: int, requests: int):
+    values = {ClientUsage.tokens: ClientUsage.tokens + tokens, ClientUsage.requests: ClientUsage.requests + requests}
+    if ClientUsage.query.filter_by(client=client_key, day=day).update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(ClientUsage(client=client_key, day=day, tokens=tokens, requests=requests))
+    except IntegrityError:
+        # Another process created the row in the meantime
+        ClientUsage.query.filter_by(client=client_key, day=day).update(values, synchronize_session=False)
+
+
+def llm_quota(cost: Optional[Callable] = None):
+    """Mark a view as LLM-backed: subject to the daily token budget, costing cost(request) rate tokens"""
+    def decorator(view):
+        view.quota_llm = True
+        view.quota_cost = cost
+        return view
+    return decorator
+
+
+def charge_tokens(tokens: int):
+    """Charge LLM tokens to the client of the current request"""
+    if not tokens or not has_request_context():
+        return
+    client = g.get('quota_client')
+    manager = current_app.extensions.get('quotas')
+    if client is not None and manager is not None:
+        manager.charge(client.key, tokens)
+
+
+def current_client() -> Optional[Client]:
+    return g.get('quota_client') if has_request_context() else None
+
+
+def _enforce_quotas():
+    if not request.path.startswith('/api/') or request.method == 'OPTIONS':
+        return None
+
+    manager = current_app.extensions['quotas']
+    manager.ensure_flusher()
+    try:
+        client = manager.resolve_client(request)
+    except InvalidApiKey:
+        return jsonify({'success': False, 'error': 'Invalid API key'}), 401
+    g.quota_client = client
+
+    view = current_app.view_functions.get(request.endpoint)
+    llm = getattr(view, 'quota_llm', False)
+    cost_fn = getattr(view, 'quota_cost', None)
+    try:
+        cost = max(1, cost_fn(request)) if cost_fn else 1
+    except Exception:
+        cost = 1
+
+    denied = manager.check(client, cost, llm)
+    if denied is None:
+        return None
+    retry_after, reason = denied
+    response = jsonify({'success': False, 'error': reason, 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def init_quotas(app):
+    """Enforce quotas on API requests when QUOTAS_ENABLED is set"""
+    if not app.config.get('QUOTAS_ENABLED'):
+        return
+    app.extensions['quotas'] = QuotaManager(app)
+    app.before_request(_enforce_quotas)
@@ -0,0 +1,220 @@
+"""Per-conversation ring buffer of recent messages for prompt assembly.
+
+Each AI turn needs the conversation's last few messages. Instead of querying
+and hydrating ``ChatMessage`` rows every time, each active conversation keeps
+its last ``RECENT_HISTORY_SIZE`` messages as plain records (the dict shape
+``format_messages`` reads), loaded on first use and appended to when a
+transaction that adds messages commits in this process.
+
+A ring is stamped with the conversation's ``updated_at``, which every message
+write bumps. Callers pass the conversation they already loaded; a stamp that
+no longer matches means another process wrote to it, and the ring is reloaded.
+A commit here only extends a ring when it started from a stamp the ring has
+held (concurrent writers in this process, like write-behind's flusher, race
+on ``updated_at``). Since ``updated_at`` is last-write-wins, a write from
+another process can still slip between two local ones, so rings are also
+reloaded every ``RECENT_HISTORY_REVALIDATE_SECONDS``. Edits and deletes drop
+the ring. Messages added but not yet committed by the current session, and
+those queued for write-behind, are merged in on read. Rings are evicted LRU
+beyond ``RECENT_HISTORY_MAX_CONVERSATIONS`` and after
+``RECENT_HISTORY_IDLE_SECONDS`` without use.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, load_only
+
+from src.models.ai_provider import db, ChatMessage, Conversation
+from src.services.forks import message_scope
+from src.services.metrics import REGISTRY
+from src.services.write_behind import pending_messages
+
+RECENT_HISTORY_REQUESTS = REGISTRY.counter(
+    'recent_history_requests_total', 'Recent-history ring lookups by outcome', ['outcome'])
+
+RECORD_COLUMNS = (ChatMessage.id, ChatMessage.conversation_id, ChatMessage.personality_id, ChatMessage.sender_type,
+                  ChatMessage.content, ChatMessage.created_at)
+
+
+def record_of(message) -> Dict:
+    """Lightweight record of a ChatMessage (or queued message), without its relationships"""
+    return {
+        'id': message.id,
+        'conversation_id': message.conversation_id,
+        'personality_id': message.personality_id,
+        'sender_type': message.sender_type,
+        'content': message.content,
+        'created_at': message.created_at
+    }
+
+
+def _order(record: Dict):
+    # Messages not flushed yet have no timestamp or id: they are the newest
+    return record['created_at'] or datetime.max, record['id'] or 0
+
+
+class _Ring:
+    __slots__ = ('records', 'stamp', 'stamps', 'loaded', 'used')
+
+    def __init__(self, records: deque, stamp: Optional[datetime]):
+        self.records = records
+        self.stamp = stamp
+        self.stamps = deque([stamp], maxlen=8)
+        self.loaded = self.used = time.monotonic()
+
+
+class RecentHistory:
+    def __init__(self, size: int = 10, max_conversations: int = 2000, idle_seconds: float = 900,
+                 revalidate_seconds: float = 30):
+        self.size = size
+        self.max_conversations = max_conversations
+        self.idle_seconds = idle_seconds
+        self.revalidate_seconds = revalidate_seconds
+        self.rings: 'OrderedDict[int, _Ring]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def records(self, conversation: Conversation) -> List[Dict]:
+        """The conversation's committed recent records, oldest first"""
+        with self.lock:
+            ring = self.rings.get(conversation.id)
+            now = time.monotonic()
+            if ring is not None and ring.stamp == conversation.updated_at and now - ring.loaded < self.revalidate_seconds:
+                self.rings.move_to_end(conversation.id)
+                ring.used = now
+                RECENT_HISTORY_REQUESTS.inc(outcome='hit')
+                return list(ring.records)
+
+        rows = ChatMessage.query.options(load_only(*RECORD_COLUMNS)).filter(
+            message_scope(conversation)
+        ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(self.size).all()
+        records = deque((record_of(row) for row in reversed(rows)), maxlen=self.size)
+        with self.lock:
+            self.rings[conversation.id] = _Ring(records, conversation.updated_at)
+            self.rings.move_to_end(conversation.id)
+            self._evict()
+        RECENT_HISTORY_REQUESTS.inc(outcome='miss' if ring is None else 'stale')
+        return list(records)
+
+    def invalidate(self, conversation_id: int):
+        with self.lock:
+            self.rings.pop(conversation_id, None)
+
+    def apply(self, appended: Dict[int, List[Dict]], stamps: Dict[int, tuple], invalid: set):
+        """Bring rings up to date with a committed transaction"""
+        with self.lock:
+            for conversation_id in invalid:
+                self.rings.pop(conversation_id, None)
+            for conversation_id in set(appended) | set(stamps):
+                ring = self.rings.get(conversation_id)
+                if ring is None:
+                    continue
+                records = sorted(appended.get(conversation_id, ()), key=_order)
+                previous, current = stamps.get(conversation_id, (ring.stamp, ring.stamp))
+                # Another process wrote in between, or the new messages do not sort last: reload on next use
+                if previous not in ring.stamps or (records and ring.records and _order(records[0]) <= _order(ring.records[-1])):
+                    del self.rings[conversation_id]
+                    continue
+                ring.records.extend(records)
+                if current != ring.stamp:
+                    ring.stamp = current
+                    ring.stamps.append(current)
+
+    def _evict(self):
+        # Least recently used first, so idle rings are at the front
+        now = time.monotonic()
+        while self.rings:
+            conversation_id, ring = next(iter(self.rings.items()))
+            if len(self.rings) <= self.max_conversations and now - ring.used <= self.idle_seconds:
+                break
+            del self.rings[conversation_id]
+
+
+def get_recent_history() -> Optional[RecentHistory]:
+    return current_app.extensions.get('recent_history')
+
+
+def recent_records(conversation: Conversation, limit: int = 10) -> List[Dict]:
+    """The conversation's last limit messages as records, newest first, including uncommitted and queued ones"""
+    cache = get_recent_history()
+    if cache is not None and limit <= cache.size:
+        records = cache.records(conversation)
+    else:
+        rows = ChatMessage.query.options(load_only(*RECORD_COLUMNS)).filter(
+            message_scope(conversation)
+        ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit).all()
+        records = [record_of(row) for row in rows]
+
+    # This transaction's own messages (a running auto-continue) and write-behind's queue
+    changes = db.session.info.get('recent_history_changes')
+    local = [record for record in changes['appended'] if record['conversation_id'] == conversation.id] if changes else []
+    local += [
+        record_of(obj) for obj in db.session.new
+        if isinstance(obj, ChatMessage) and obj.conversation_id == conversation.id
+    ]
+    local += [record_of(message) for message in pending_messages(conversation.id)]
+    if local:
+        seen = {record['id'] for record in records}
+        records = records + [record for record in local if record['id'] is None or record['id'] not in seen]
+    return sorted(records, key=_order, reverse=True)[:limit]
+
+
+def _collect_changes(session, flush_context):
+    """Note flushed messages and conversation stamps, applied to the rings once committed"""
+    if not has_app_context() or current_app.extensions.get('recent_history') is None:
+        return
+    changes = session.info.setdefault('recent_history_changes', {'appended': [], 'stamps': {}, 'invalid': set()})
+    for obj in session.new:
+        if isinstance(obj, ChatMessage):
+            changes['appended'].append(record_of(obj))
+    for obj in session.dirty:
+        if isinstance(obj, ChatMessage) and session.is_modified(obj, include_collections=False):
+            changes['invalid'].add(obj.conversation_id)
+        elif isinstance(obj, Conversation):
+            history = inspect(obj).attrs.updated_at.history
+            if history.added and history.deleted:
+                previous = changes['stamps'].get(obj.id, (history.deleted[0],))[0]
+                changes['stamps'][obj.id] = (previous, history.added[0])
+    for obj in session.deleted:
+        if isinstance(obj, ChatMessage):
+            changes['invalid'].add(obj.conversation_id)
+        elif isinstance(obj, Conversation):
+            changes['invalid'].add(obj.id)
+
+
+def _apply_changes(session):
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop('recent_history_changes', None)
+    cache = current_app.extensions.get('recent_history') if changes and has_app_context() else None
+    if cache is None:
+        return
+    appended = {}
+    for record in changes['appended']:
+        appended.setdefault(record['conversation_id'], []).append(record)
+    cache.apply(appended, changes['stamps'], changes['invalid'])
+
+
+def _discard_changes(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('recent_history_changes', None)
+
+
+def init_recent_history(app):
+    """Create the app's recent-history rings (RECENT_HISTORY_SIZE = 0 disables them)"""
+    size = app.config.get('RECENT_HISTORY_SIZE', 10)
+    app.extensions['recent_history'] = RecentHistory(
+        size,
+        app.config.get('RECENT_HISTORY_MAX_CONVERSATIONS', 2000),
+        app.config.get('RECENT_HISTORY_IDLE_SECONDS', 900),
+        app.config.get('RECENT_HISTORY_REVALIDATE_SECONDS', 30)
+    ) if size else None
+
+    if not event.contains(Session, 'after_flush', _collect_changes):
+        event.listen(Session, 'after_flush', _collect_changes)
+        event.listen(Session, 'after_commit', _apply_changes)
+        event.listen(Session, 'after_soft_rollback', _discard_changes)
@@ -0,0 +1,222 @@
+"""Read replica routing.
+
+With ``SQLALCHEMY_REPLICA_URIS`` set, each replica becomes a Flask-SQLAlchemy
+bind (``replica_0``, ``replica_1``, ...) and GET/HEAD requests run their
+SELECTs (lazy loads in serializers included) on one of them, through
+``RoutingSession``. Everything else stays on the primary:
+
+- non-GET requests, and a GET's queries once it has written anything;
+- views marked ``@primary_reads`` (e.g. the SSE stream, which must not miss
+  messages committed just before it subscribed);
+- requests sent with ``X-Read-Consistency: strong``;
+- clients that wrote recently: successful writes return the write time in
+  an ``X-Last-Write`` header (and a ``db_last_write`` cookie, for same-site
+  clients), and reads that send it back in ``X-Last-Write`` (or the cookie)
+  use a replica only once that replica's heartbeat shows it has replayed past
+  the write. Cross-site frontends never send the cookie back, so they must
+  echo the header.
+
+A background thread per process writes a heartbeat row on the primary and
+reads it back from every replica; a replica whose copy is older than
+``REPLICA_MAX_LAG_SECONDS`` (or that cannot be queried) is left out until it
+catches up, and with no usable replica reads fall back to the primary.
+"""
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import current_app, has_app_context, request
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from src.models import db
+from src.models.ai_provider import ReplicaHeartbeat
+from src.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+READ_ROUTING = REGISTRY.counter(
+    'db_read_routing_total', 'GET requests by the database their reads were sent to', ['target'])
+REPLICA_LAG = REGISTRY.gauge(
+    'db_replica_lag_seconds', 'Replica lag measured from the heartbeat row', ['bind'])
+
+LAST_WRITE_COOKIE = 'db_last_write'
+LAST_WRITE_HEADER = 'X-Last-Write'
+READ_METHODS = ('GET', 'HEAD')
+
+
+class ReplicaState:
+    __slots__ = ('bind', 'healthy', 'lag', 'replayed_at', 'error')
+
+    def __init__(self, bind: str):
+        self.bind = bind
+        self.healthy = False  # unknown until the first check
+        self.lag: Optional[float] = None
+        self.replayed_at: Optional[float] = None  # epoch of the newest heartbeat the replica has
+        self.error: Optional[str] = None
+
+
+class ReplicaRouter:
+    def __init__(self, app, binds: List[str]):
+        self.app = app
+        self.replicas: Dict[str, ReplicaState] = {bind: ReplicaState(bind) for bind in binds}
+        self.max_lag = app.config.get('REPLICA_MAX_LAG_SECONDS', 10)
+        self.interval = app.config.get('REPLICA_CHECK_INTERVAL', 1)
+        self._next = itertools.count()
+        self._monitor = None
+        self.lock = threading.Lock()
+
+    def choose(self, last_write: Optional[float] = None) -> Optional[str]:
+        """A healthy replica that has replayed past last_write (epoch), round robin; None means the primary"""
+        candidates = [
+            state.bind for state in self.replicas.values()
+            if state.healthy and (last_write is None or (state.replayed_at or 0) >= last_write)
+        ]
+        if not candidates:
+            return None
+        return candidates[next(self._next) % len(candidates)]
+
+    def mark_failed(self, bind: str, error: str):
+        state = self.replicas.get(bind)
+        if state is not None and state.healthy:
+            logger.warning('Replica %s failed, reading from the primary until it recovers: %s', bind, error)
+            state.healthy = False
+            state.error = error
+
+    def check(self):
+        """Read each replica's heartbeat, then write a new one on the primary"""
+        now = datetime.utcnow()
+        for bind, state in self.replicas.items():
+            try:
+                with db.engines[bind].connect() as connection:
+                    beat_at = connection.execute(
+                        select(ReplicaHeartbeat.beat_at).where(ReplicaHeartbeat.id == 1)
+                    ).scalar()
+            except Exception as e:
+                state.healthy, state.lag, state.error = False, None, str(e)
+                continue
+            if beat_at is None:
+                state.healthy, state.lag, state.error = False, None, 'No heartbeat replicated yet'
+                continue
+            state.lag = max(0.0, (now - beat_at).total_seconds())
+            state.replayed_at = (beat_at - datetime(1970, 1, 1)).total_seconds()
+            state.error = None if state.lag <= self.max_lag else f'Lagging {state.lag:.1f}s behind'
+            state.healthy = state.error is None
+            REPLICA_LAG.set(state.lag, bind=bind)
+
+        if not ReplicaHeartbeat.query.filter_by(id=1).update({'beat_at': now}, synchronize_session=False):
+            db.session.add(ReplicaHeartbeat(id=1, beat_at=now))
+        db.session.commit()
+
+    def ensure_monitor(self):
+        """Start this process's heartbeat thread (lazily, so it runs in each worker)"""
+        if self._monitor == os.getpid():
+            return
+        with self.lock:
+            if self._monitor == os.getpid():
+                return
+
+            def run():
+                while True:
+                    try:
+                        with self.app.app_context():
+                            self.check()
+                    except Exception:
+                        logger.exception('Replica heartbeat failed')
+                        db.session.rollback()
+                    time.sleep(self.interval)
+
+            threading.Thread(target=run, name='replica-monitor', daemon=True).start()
+            self._monitor = os.getpid()
+
+
+def primary_reads(view):
+    """Mark a GET view whose reads must see the latest commits"""
+    view.db_primary = True
+    return view
+
+
+def _last_write() -> Optional[float]:
+    latest = None
+    for value in (request.headers.get(LAST_WRITE_HEADER), request.cookies.get(LAST_WRITE_COOKIE)):
+        try:
+            written = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(written) and (latest is None or written > latest):
+            latest = written
+    return latest
+
+
+def _route_reads():
+    if request.method not in READ_METHODS:
+        return
+    router = current_app.extensions['replicas']
+    router.ensure_monitor()
+
+    view = current_app.view_functions.get(request.endpoint)
+    bind = None
+    if not getattr(view, 'db_primary', False) and request.headers.get('X-Read-Consistency', '').lower() != 'strong':
+        bind = router.choose(_last_write())
+    db.session.info['read_bind'] = bind
+    READ_ROUTING.inc(target=bind or 'primary')
+
+
+def _remember_write(response):
+    if request.method not in READ_METHODS and request.method != 'OPTIONS' and response.status_code < 400:
+        written = f'{time.time():.3f}'
+        response.headers[LAST_WRITE_HEADER] = written
+        response.set_cookie(
+            LAST_WRITE_COOKIE,
+            written,
+            max_age=int(current_app.config.get('REPLICA_STICKY_SECONDS', 60)),
+            httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+
+def _reset_routing(exc=None):
+    # The session outlives the request when an app context was pushed around it
+    if 'read_bind' in db.session.info:
+        db.session.info.pop('read_bind')
+
+
+def _replica_error(context):
+    """Stop using a replica whose queries fail at the connection level; the monitor brings it back"""
+    failed = context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError)
+    if not failed or not has_app_context():
+        return
+    router = current_app.extensions.get('replicas')
+    if router is None:
+        return
+    for bind in router.replicas:
+        if db.engines.get(bind) is context.engine:
+            router.mark_failed(bind, str(context.original_exception))
+
+
+def init_replicas(app):
+    """Register SQLALCHEMY_REPLICA_URIS as binds and route read requests to them (call before db.init_app)"""
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if not uris:
+        return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    names = []
+    for index, uri in enumerate(uris):
+        names.append(f'replica_{index}')
+        binds[names[-1]] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    app.extensions['replicas'] = ReplicaRouter(app, names)
+    app.before_request(_route_reads)
+    app.after_request(_remember_write)
+    app.teardown_request(_reset_routing)
+
+    if not event.contains(Engine, 'handle_error', _replica_error):
+        event.listen(Engine, 'handle_error', _replica_error)
@@ -0,0 +1,259 @@
+"""Priority scheduling of provider calls.
+
+Every ``AIAdapter.send_message`` takes a slot from its provider's queue before
+calling out, so each provider (adapter type and base URL) has at most
+``SCHEDULER_PROVIDER_CONCURRENCY`` calls in flight per process. Calls belong
+to a priority class, set by the route with ``call_priority``:
+
+- ``interactive``: a user waiting on ``send_message`` (the default);
+- ``background``: auto-continue turns;
+- ``probe``: provider health probes.
+
+Free slots go to the highest class first, and ``SCHEDULER_INTERACTIVE_RESERVE``
+slots are kept for interactive calls only, so a user's message never waits
+behind a batch job that already holds the provider. Within a class, calls are
+served weighted-fair between conversations (start-time fair queueing: each
+conversation's calls get increasing virtual tags, advanced by ``1 / weight``
+of their class), so one long auto-continue cannot monopolize the background
+share. A call that has waited ``SCHEDULER_AGING_SECONDS`` competes as an
+interactive one, which keeps batch work moving under sustained interactive
+load.
+
+A call waits at most until only ``min_call_seconds`` are left before the
+request deadline (or ``SCHEDULER_MAX_WAIT``), and stops waiting when its
+cancel token fires.
+"""
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Hashable, List, Optional
+
+from flask import current_app, has_app_context
+
+from src.services.metrics import REGISTRY
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PROBE = 'probe'
+
+# Strict order between classes (before aging)
+PRIORITY_RANKS = {INTERACTIVE: 0, BACKGROUND: 1, PROBE: 2}
+
+SCHEDULER_IN_FLIGHT = REGISTRY.gauge(
+    'scheduler_in_flight', 'Provider calls holding a scheduler slot', ['provider'])
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    'scheduler_queue_depth', 'Provider calls waiting for a slot', ['provider', 'priority'])
+SCHEDULER_WAIT = REGISTRY.histogram(
+    'scheduler_wait_seconds', 'Time provider calls waited for a slot', ['priority'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+SCHEDULER_REFUSED = REGISTRY.counter(
+    'scheduler_refused_total', 'Provider calls that gave up waiting for a slot', ['priority', 'reason'])
+
+_call_class: contextvars.ContextVar[tuple] = contextvars.ContextVar('call_priority', default=(INTERACTIVE, None))
+
+
+@contextmanager
+def call_priority(priority: str, flow: Optional[Hashable] = None):
+    """Schedule the provider calls of the block in a priority class, shared fairly per flow (conversation)"""
+    if priority not in PRIORITY_RANKS:
+        raise ValueError(f'Unknown call priority: {priority}')
+    context_token = _call_class.set((priority, flow))
+    try:
+        yield
+    finally:
+        _call_class.reset(context_token)
+
+
+def current_priority() -> tuple:
+    return _call_class.get()
+
+
+class Waiter:
+    __slots__ = ('priority', 'flow', 'tag', 'seq', 'enqueued', 'event', 'granted')
+
+    def __init__(self, priority: str, flow, tag: float, seq: int):
+        self.priority = priority
+        self.flow = flow
+        self.tag = tag
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.event = threading.Event()
+        self.granted = False
+
+
+class ProviderQueue:
+    """Slots of one provider and the calls waiting for them"""
+
+    def __init__(self, name: str, concurrency: int, reserve: int, aging: float, weights: Dict[str, float]):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.reserve = min(reserve, self.concurrency - 1)
+        self.aging = aging
+        self.weights = weights
+        self.active = 0
+        self.waiters: List[Waiter] = []
+        self.vclock = 0.0
+        self.flow_tags: Dict[tuple, float] = {}
+        self.granted: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._seq = itertools.count()
+
+    def acquire(self, priority: str, flow, max_wait: float, token=None) -> Optional[str]:
+        """Wait for a slot; returns why the call gave up otherwise ('cancelled' or 'timeout')"""
+        weight = self.weights.get(priority, 1.0)
+        with self.lock:
+            key = (priority, flow)
+            tag = max(self.vclock, self.flow_tags.get(key, 0.0)) + 1.0 / weight
+            self.flow_tags[key] = tag
+            waiter = Waiter(priority, flow, tag, next(self._seq))
+            self.waiters.append(waiter)
+            self._dispatch()
+        if waiter.granted:
+            SCHEDULER_WAIT.observe(0.0, priority=priority)
+            return None
+
+        remove_callback = token.add_callback(waiter.event.set) if token is not None else None
+        try:
+            deadline = waiter.enqueued + max_wait
+            while True:
+                now = time.monotonic()
+                # Wake up when the waiter ages, as it may then take a reserved slot
+                wake = deadline
+                if priority != INTERACTIVE and now < waiter.enqueued + self.aging:
+                    wake = min(wake, waiter.enqueued + self.aging)
+                waiter.event.wait(max(0.0, wake - now))
+                with self.lock:
+                    if waiter.granted:
+                        break
+                    if token is not None and token.cancelled:
+                        return self._give_up(waiter, 'cancelled')
+                    if time.monotonic() >= deadline:
+                        return self._give_up(waiter, 'timeout')
+                    waiter.event.clear()
+                    self._dispatch()
+                    if waiter.granted:
+                        break
+        finally:
+            if remove_callback is not None:
+                remove_callback()
+        SCHEDULER_WAIT.observe(time.monotonic() - waiter.enqueued, priority=priority)
+        return None
+
+    def _give_up(self, waiter: Waiter, reason: str) -> str:
+        self.waiters.remove(waiter)
+        SCHEDULER_REFUSED.inc(priority=waiter.priority, reason=reason)
+        return reason
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to the best eligible waiters (lock held)"""
+        now = time.monotonic()
+        while self.active < self.concurrency and self.waiters:
+            best, best_key = None, None
+            for waiter in self.waiters:
+                aged = now - waiter.enqueued >= self.aging
+                if waiter.priority != INTERACTIVE and not aged and self.active >= self.concurrency - self.reserve:
+                    continue
+                rank = 0 if aged else PRIORITY_RANKS[waiter.priority]
+                key = (rank, waiter.tag, waiter.seq)
+                if best_key is None or key < best_key:
+                    best, best_key = waiter, key
+            if best is None:
+                return
+            self.waiters.remove(best)
+            self.active += 1
+            self.granted[best.priority] = self.granted.get(best.priority, 0) + 1
+            # Virtual time follows the start tag of the call being served
+            self.vclock = max(self.vclock, best.tag - 1.0 / self.weights.get(best.priority, 1.0))
+            best.granted = True
+            best.event.set()
+        if len(self.flow_tags) > 1024:
+            self.flow_tags = {key: tag for key, tag in self.flow_tags.items() if tag > self.vclock}
+
+    def depth(self, priority: str) -> int:
+        return sum(1 for waiter in self.waiters if waiter.priority == priority)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'concurrency': self.concurrency,
+                'interactive_reserve': self.reserve,
+                'in_flight': self.active,
+                'queued': {priority: self.depth(priority) for priority in PRIORITY_RANKS},
+                'granted': dict(self.granted)
+            }
+
+
+class CallScheduler:
+    def __init__(self, concurrency: int, limits: Dict[str, int], reserve: int, aging: float,
+                 weights: Dict[str, float], max_wait: float):
+        self.concurrency = concurrency
+        self.limits = limits
+        self.reserve = reserve
+        self.aging = aging
+        self.weights = weights
+        self.max_wait = max_wait
+        self.queues: Dict[str, ProviderQueue] = {}
+        self.lock = threading.Lock()
+
+    def queue(self, provider: str) -> ProviderQueue:
+        with self.lock:
+            queue = self.queues.get(provider)
+            if queue is None:
+                concurrency = self.limits.get(provider, self.concurrency)
+                queue = ProviderQueue(provider, concurrency, self.reserve, self.aging, self.weights)
+                self.queues[provider] = queue
+            return queue
+
+    @contextmanager
+    def slot(self, provider: str, max_wait: float, token=None):
+        """Hold a slot of provider for the block; yields None, or why no slot was obtained"""
+        priority, flow = current_priority()
+        queue = self.queue(provider)
+        refused = queue.acquire(priority, flow, min(max_wait, self.max_wait), token)
+        try:
+            yield refused
+        finally:
+            if refused is None:
+                queue.release()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            queues = list(self.queues.values())
+        return {queue.name: queue.stats() for queue in queues}
+
+    def collect_in_flight(self, gauge):
+        for queue in list(self.queues.values()):
+            gauge.set(queue.active, provider=queue.name)
+
+    def collect_depth(self, gauge):
+        for queue in list(self.queues.values()):
+            for priority in PRIORITY_RANKS:
+                gauge.set(queue.depth(priority), provider=queue.name, priority=priority)
+
+
+def current_scheduler() -> Optional[CallScheduler]:
+    return current_app.extensions.get('scheduler') if has_app_context() else None
+
+
+def init_scheduler(app):
+    """Queue provider calls by priority when SCHEDULER_ENABLED is set"""
+    if not app.config.get('SCHEDULER_ENABLED'):
+        return
+    scheduler = CallScheduler(
+        concurrency=app.config.get('SCHEDULER_PROVIDER_CONCURRENCY', 4),
+        limits=app.config.get('SCHEDULER_PROVIDER_LIMITS') or {},
+        reserve=app.config.get('SCHEDULER_INTERACTIVE_RESERVE', 1),
+        aging=app.config.get('SCHEDULER_AGING_SECONDS', 10),
+        weights=app.config.get('SCHEDULER_WEIGHTS') or {},
+        max_wait=app.config.get('SCHEDULER_MAX_WAIT', 60)
+    )
+    app.extensions['scheduler'] = scheduler
+    SCHEDULER_IN_FLIGHT.collect = scheduler.collect_in_flight
+    SCHEDULER_QUEUE_DEPTH.collect = scheduler.collect_depth
@@ -0,0 +1,250 @@
+"""Speculative drafts of the next auto-continue turn.
+
+With ``SPECULATION_ENABLED``, each auto-continue request that adds turns to a
+conversation starts a background generation of the turn auto-continue would
+run next (the participant after the last speaker, with the same prompt), so
+only conversations being auto-continued pay for drafts. The reply is held in
+memory as a draft, not persisted. When auto-continue reaches that turn and
+builds the identical prompt, the draft is served instead of calling the
+provider; a draft still generating is waited for rather than duplicated, but
+one still queued behind the workers after
+``SPECULATION_PREPARE_WAIT_SECONDS`` is dropped and the call made directly.
+
+A draft is discarded when the conversation changes again (a user interjects,
+another turn is committed, a candidate is selected), when its prompt no longer
+matches the turn being run, or after ``SPECULATION_TTL_SECONDS``. Its tokens
+were spent all the same: they are added to the usage rollups like a cancelled
+call and counted in ``speculation_discarded_tokens_total``.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.models.ai_provider import db, AIPersonality, ChatMessage, Conversation
+from src.services.ai_adapter import AIAdapter
+from src.services.cancellation import cancellable
+from src.services.cassette import request_key
+from src.services.metrics import REGISTRY
+from src.services.scheduler import BACKGROUND, call_priority
+from src.services.turns import latest_message, next_speaker_index, prepare_turn
+from src.services.usage import extract_token_counts, record_aborted_usage
+
+logger = logging.getLogger(__name__)
+
+SPECULATION_DRAFTS = REGISTRY.counter(
+    'speculation_drafts_total', 'Speculative next-turn drafts by outcome', ['outcome'])
+SPECULATION_DISCARDED_TOKENS = REGISTRY.counter(
+    'speculation_discarded_tokens_total', 'Tokens spent on drafts that were never served')
+
+# Draft states
+RUNNING = 'running'
+READY = 'ready'
+SERVED = 'served'
+DISCARDED = 'discarded'
+
+
+class Draft:
+    def __init__(self, conversation_id: int):
+        self.conversation_id = conversation_id
+        self.personality_id = None
+        self.provider_id = None
+        self.key = None
+        self.result = None
+        self.token = None
+        self.state = RUNNING
+        self.created = time.monotonic()
+        self.prepared = threading.Event()
+        self.done = threading.Event()
+
+
+def _prompt_key(adapter: AIAdapter, messages: List[Dict]) -> tuple:
+    return adapter.scheduler_key, request_key(adapter.model, messages, adapter.max_tokens, adapter.temperature)
+
+
+class SpeculationManager:
+    def __init__(self, app):
+        self.app = app
+        self.ttl = app.config.get('SPECULATION_TTL_SECONDS', 300)
+        self.prepare_wait = app.config.get('SPECULATION_PREPARE_WAIT_SECONDS', 0.5)
+        self.executor = ThreadPoolExecutor(max_workers=app.config.get('SPECULATION_WORKERS', 2),
+                                           thread_name_prefix='speculation')
+        self.drafts: Dict[int, Draft] = {}
+        self.lock = threading.Lock()
+
+    def schedule(self, conversation_id: int):
+        """Replace the conversation's draft with one generated from its current history"""
+        draft = Draft(conversation_id)
+        with self.lock:
+            previous = self.drafts.get(conversation_id)
+            self.drafts[conversation_id] = draft
+        if previous is not None:
+            self._discard(previous, 'superseded')
+        self.executor.submit(self._generate, draft)
+
+    def discard(self, conversation_id: int, outcome: str = 'superseded'):
+        with self.lock:
+            draft = self.drafts.pop(conversation_id, None)
+        if draft is not None:
+            self._discard(draft, outcome)
+
+    def take(self, conversation_id: int, personality_id: int, adapter: AIAdapter, messages: List[Dict],
+             timeout: float) -> Optional[Dict]:
+        """The draft's result when it was generated for this exact turn (waiting up to timeout for it), else None"""
+        with self.lock:
+            draft = self.drafts.get(conversation_id)
+            if draft is None:
+                return None
+            if time.monotonic() - draft.created > self.ttl:
+                self.drafts.pop(conversation_id)
+                expired = True
+            else:
+                expired = False
+        if expired:
+            self._discard(draft, 'expired')
+            return None
+
+        # The prompt is known as soon as a worker picks the draft up; one still queued is not worth
+        # waiting for, and a draft for another turn is dropped without waiting for it
+        outcome = None
+        if not draft.prepared.wait(self.prepare_wait):
+            outcome = 'not_started'
+        elif draft.key != _prompt_key(adapter, messages) or draft.personality_id != personality_id:
+            outcome = 'mismatched'
+        elif not draft.done.wait(timeout):
+            outcome = 'timeout'
+        with self.lock:
+            if outcome is None and (draft.state != READY or not draft.result.get('success')):
+                outcome = 'failed'
+            if self.drafts.get(conversation_id) is draft:
+                self.drafts.pop(conversation_id)
+            if outcome is None:
+                draft.state = SERVED
+        if outcome is not None:
+            self._discard(draft, outcome)
+            return None
+        SPECULATION_DRAFTS.inc(outcome='served')
+        result = dict(draft.result)
+        result['speculative'] = True
+        return result
+
+    def _discard(self, draft: Draft, outcome: str):
+        with self.lock:
+            if draft.state in (SERVED, DISCARDED):
+                return
+            finished = draft.state == READY
+            draft.state = DISCARDED
+        SPECULATION_DRAFTS.inc(outcome=outcome)
+        if finished:
+            self.executor.submit(self._record_cost, draft)
+        elif draft.token is not None:
+            # The generating thread records what was spent once the call returns
+            draft.token.cancel('speculation_discarded')
+
+    def _generate(self, draft: Draft):
+        try:
+            with self.app.app_context():
+                if draft.state == RUNNING:
+                    self._run(draft)
+        except Exception:
+            logger.exception('Speculative draft for conversation %s failed', draft.conversation_id)
+        finally:
+            with self.lock:
+                if draft.state == RUNNING:
+                    draft.state = READY if draft.result is not None else DISCARDED
+                discarded = draft.state == DISCARDED and draft.result is not None
+            draft.prepared.set()
+            draft.done.set()
+        if discarded:
+            self._record_cost(draft)
+
+    def _run(self, draft: Draft):
+        conversation = db.session.get(Conversation, draft.conversation_id)
+        participants = conversation.get_participants() if conversation is not None else []
+        previous = latest_message(conversation) if len(participants) >= 2 else None
+        if previous is None:
+            return
+        personality = db.session.get(AIPersonality, participants[next_speaker_index(participants, previous)])
+        if personality is None or not personality.is_active:
+            return
+
+        adapter, messages = prepare_turn(conversation, personality)
+        draft.personality_id = personality.id
+        draft.provider_id = personality.provider_id
+        draft.key = _prompt_key(adapter, messages)
+        draft.prepared.set()
+        # Cancelling the conversation's jobs (or discarding the draft) stops the generation
+        with cancellable(draft.conversation_id) as token, call_priority(BACKGROUND, draft.conversation_id):
+            draft.token = token
+            if draft.state != RUNNING:
+                return
+            draft.result = adapter.send_message(messages)
+
+    def _record_cost(self, draft: Draft):
+        try:
+            with self.app.app_context():
+                record_aborted_usage(draft.provider_id, draft.personality_id, draft.result)
+                db.session.commit()
+        except Exception:
+            logger.exception('Recording the cost of a discarded draft failed')
+        prompt_tokens, completion_tokens = extract_token_counts(draft.result.get('usage'))
+        SPECULATION_DISCARDED_TOKENS.inc((prompt_tokens or 0) + (completion_tokens or 0))
+
+
+def get_speculation() -> Optional[SpeculationManager]:
+    return current_app.extensions.get('speculation')
+
+
+def speculate_next_turn(conversation_id: int):
+    """Draft the turn after the ones auto-continue just committed"""
+    manager = get_speculation()
+    if manager is not None:
+        manager.schedule(conversation_id)
+
+
+def _collect_changed(session, flush_context):
+    """Note conversations whose messages changed in this transaction (their drafts are stale)"""
+    if not has_app_context() or current_app.extensions.get('speculation') is None:
+        return
+    changed = session.info.setdefault('speculation_changed', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, ChatMessage) and obj.conversation_id is not None:
+            changed[obj.conversation_id] = True
+    for obj in session.deleted:
+        if isinstance(obj, ChatMessage) and obj.conversation_id is not None:
+            changed.setdefault(obj.conversation_id, True)
+        elif isinstance(obj, Conversation):
+            changed[obj.id] = False
+
+
+def _speculate_after_commit(session):
+    if session.in_nested_transaction():
+        return
+    changed = session.info.pop('speculation_changed', None)
+    manager = current_app.extensions.get('speculation') if changed and has_app_context() else None
+    if manager is None:
+        return
+    for conversation_id, exists in changed.items():
+        manager.discard(conversation_id, 'superseded' if exists else 'deleted')
+
+
+def _forget_changed(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('speculation_changed', None)
+
+
+def init_speculation(app):
+    """Draft the next auto-continue turn in the background when SPECULATION_ENABLED is set"""
+    if not app.config.get('SPECULATION_ENABLED'):
+        return
+    app.extensions['speculation'] = SpeculationManager(app)
+
+    if not event.contains(Session, 'after_flush', _collect_changed):
+        event.listen(Session, 'after_flush', _collect_changed)
+        event.listen(Session, 'after_commit', _speculate_after_commit)
+        event.listen(Session, 'after_soft_rollback', _forget_changed)
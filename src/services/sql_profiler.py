@@ -0,0 +1,158 @@
+"""Per-request SQL profiling and query-count budgets.
+
+With ``SQL_PROFILING`` enabled every response carries a ``Server-Timing``
+header with the number of statements, total database time and the slowest
+statements, and statements repeated ``SQL_N_PLUS_ONE_THRESHOLD`` times or more
+are logged as likely N+1 patterns. ``assert_max_queries`` works regardless of
+that setting and is meant for tests::
+
+    with assert_max_queries(12):
+        client.get('/api/conversations/1')
+"""
+import contextvars
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from flask import current_app, g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Profiles currently recording in this context (nested budgets are allowed)
+_active_profiles: contextvars.ContextVar[Tuple['QueryProfile', ...]] = contextvars.ContextVar('sql_profiles', default=())
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryProfile:
+    """Statements executed while the profile is active"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = Counter()
+        self.timings: List[Tuple[float, str]] = []
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.total_time += duration
+        self.statements[statement] += 1
+        self.timings.append((duration, statement))
+
+    def slowest(self, limit: int = 3) -> List[Tuple[float, str]]:
+        return sorted(self.timings, reverse=True)[:limit]
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Identical statements (same SQL, different parameters) run at least threshold times"""
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def report(self) -> str:
+        lines = [f'{self.count} queries in {self.total_time * 1000:.1f} ms']
+        for statement, count in self.statements.most_common():
+            lines.append(f'  {count}x {_shorten(statement, 200)}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profile_queries():
+    """Record every statement executed in this context"""
+    profile = QueryProfile()
+    token = _active_profiles.set(_active_profiles.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        _active_profiles.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Fail with QueryBudgetExceeded when the block runs more than limit statements"""
+    with profile_queries() as profile:
+        yield profile
+    if profile.count > limit:
+        raise QueryBudgetExceeded(f'Query budget exceeded: {profile.count} > {limit}\n{profile.report()}')
+
+
+def _shorten(statement: str, length: int) -> str:
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= length else statement[:length - 3] + '...'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profiles.get():
+        conn.info.setdefault('profiler_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiles = _active_profiles.get()
+    starts = conn.info.get('profiler_query_start')
+    if profiles and starts:
+        duration = time.perf_counter() - starts.pop()
+        for profile in profiles:
+            profile.record(statement, duration)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    starts = connection.info.get('profiler_query_start') if connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _start_request_profile():
+    if current_app.config.get('SQL_PROFILING'):
+        profile = QueryProfile()
+        g.sql_profile = (profile, _active_profiles.set(_active_profiles.get() + (profile,)))
+
+
+def _finish_request_profile(response):
+    state = g.get('sql_profile')
+    if state is None:
+        return response
+
+    profile = state[0]
+    entries = [f'db;dur={profile.total_time * 1000:.2f};desc="{profile.count} queries"']
+    for index, (duration, statement) in enumerate(profile.slowest(current_app.config.get('SQL_PROFILING_SLOWEST', 3))):
+        description = _shorten(statement, 80).replace('"', "'")
+        entries.append(f'sql-{index + 1};dur={duration * 1000:.2f};desc="{description}"')
+    response.headers.add('Server-Timing', ', '.join(entries))
+    response.headers['X-SQL-Query-Count'] = str(profile.count)
+
+    repeated = profile.repeated(current_app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+    if repeated:
+        response.headers['X-SQL-Repeated-Statements'] = str(len(repeated))
+        for statement, count in repeated:
+            logger.warning('Possible N+1 query: %dx %s', count, _shorten(statement, 200))
+
+    return response
+
+
+def _end_request_profile(exc=None):
+    # after_request does not run when the view raised: the profile must not outlive the request
+    state = g.pop('sql_profile', None)
+    if state is None:
+        return
+    try:
+        _active_profiles.reset(state[1])
+    except ValueError:
+        # The context changed since before_request (e.g. a streamed response)
+        _active_profiles.set(())
+
+
+def init_sql_profiler(app):
+    """Hook the profiler into the app's requests"""
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    app.teardown_request(_end_request_profile)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
@@ -0,0 +1,348 @@
+"""Lightweight tracing in the OpenTelemetry style.
+
+Spans cover the Flask request, auto-continue turns, prompt building, provider
+calls and SQL statements. Traces are sampled when the root span starts, at
+``TRACING_SAMPLE_RATE``; a request with a ``traceparent`` header joins the
+caller's trace, but its sampled flag is only followed with
+``TRACING_TRUST_TRACEPARENT`` (when every caller is a trusted service), so
+clients cannot force tracing. Finished spans go to an in-memory ring buffer readable from
+``/api/debug/traces`` or are appended to a JSONL file.
+"""
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    sampled = True
+
+    def __init__(self, tracer: 'Tracer', name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        self.attributes.update(attributes)
+
+    def record_exception(self, exc: BaseException):
+        self.status = 'error'
+        self.attributes['error.type'] = type(exc).__name__
+        self.attributes['error.message'] = str(exc)[:500]
+
+    def end(self):
+        if self.duration_ms is None:
+            self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+            self.tracer.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Stands in for spans of unsampled traces so callers never need to check"""
+
+    sampled = False
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class RingBufferExporter:
+    """Keeps the most recent finished spans in memory"""
+
+    def __init__(self, size: int = 2000):
+        self.spans = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self.lock:
+            self.spans.append(span.to_dict())
+
+    def traces(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most recent traces first, each with its spans in start order"""
+        with self.lock:
+            spans = list(self.spans)
+        grouped = OrderedDict()
+        for span in reversed(spans):
+            grouped.setdefault(span['trace_id'], []).append(span)
+            if len(grouped) > limit:
+                grouped.popitem()
+                break
+        return [_summarize_trace(trace_id, trace_spans) for trace_id, trace_spans in grouped.items()]
+
+    def trace(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            spans = [span for span in self.spans if span['trace_id'] == trace_id]
+        return _summarize_trace(trace_id, spans) if spans else None
+
+
+class JsonlExporter:
+    """Appends one JSON object per finished span to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock:
+            try:
+                with open(self.path, 'a') as handle:
+                    handle.write(line + '\n')
+            except OSError:
+                logger.exception('Could not write span to %s', self.path)
+
+
+def _summarize_trace(trace_id: str, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    spans = sorted(spans, key=lambda span: span['start_time'])
+    root = next((span for span in spans if span['parent_id'] is None), spans[0])
+    return {
+        'trace_id': trace_id,
+        'name': root['name'],
+        'start_time': root['start_time'],
+        'duration_ms': root['duration_ms'],
+        'span_count': len(spans),
+        'spans': spans,
+    }
+
+
+class Tracer:
+    def __init__(self, sample_rate: float = 0.0, exporter=None, trace_sql: bool = True,
+                 trust_remote_sampling: bool = False):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.trace_sql = trace_sql
+        self.trust_remote_sampling = trust_remote_sampling
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None and self.sample_rate > 0
+
+    def create_span(self, name: str, attributes: Optional[Dict[str, Any]] = None, new_trace: bool = True,
+                    remote_parent: Optional[tuple] = None):
+        """Start a child of the current span, or a new (sampled or not) trace when there is none"""
+        parent = _current_span.get()
+        if parent is not None:
+            if not parent.sampled:
+                return NOOP_SPAN
+            return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+        if not new_trace or not self.enabled:
+            return NOOP_SPAN
+        if remote_parent is not None and self.trust_remote_sampling:
+            trace_id, parent_id, sampled = remote_parent
+            return Span(self, name, trace_id, parent_id, attributes) if sampled else NOOP_SPAN
+        if random.random() >= self.sample_rate:
+            return NOOP_SPAN
+        if remote_parent is not None:
+            return Span(self, name, remote_parent[0], remote_parent[1], attributes)
+        return Span(self, name, f'{random.getrandbits(128):032x}', None, attributes)
+
+    def export(self, span: Span):
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextmanager
+def start_span(name: str, attributes: Optional[Dict[str, Any]] = None, new_trace: bool = True):
+    """Run the block inside a span that is a child of the current one"""
+    span = _tracer.create_span(name, attributes, new_trace)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.record_exception(exc)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def traced(name: str):
+    """Decorator form of start_span that never starts a trace of its own"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with start_span(name, new_trace=False):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple]:
+    """Read a W3C traceparent header into (trace_id, parent_id, sampled)"""
+    if not header:
+        return None
+    parts = header.strip().split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+# Flask and SQLAlchemy instrumentation
+
+def _start_request_span():
+    if not _tracer.enabled:
+        return
+    span = _tracer.create_span(
+        f'{request.method} {request.url_rule.rule if request.url_rule is not None else "unmatched"}',
+        {'http.method': request.method, 'http.target': request.path},
+        remote_parent=parse_traceparent(request.headers.get('traceparent'))
+    )
+    g.trace_span = (span, _current_span.set(span))
+
+
+def _finish_request_span(response):
+    state = g.get('trace_span')
+    if state is not None and state[0].sampled:
+        span = state[0]
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.status = 'error'
+        response.headers['traceresponse'] = f'00-{span.trace_id}-{span.span_id}-01'
+    return response
+
+
+def _end_request_span(exc=None):
+    state = g.pop('trace_span', None)
+    if state is None:
+        return
+    span, token = state
+    if exc is not None:
+        span.record_exception(exc)
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        _current_span.set(None)
+    span.end()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is None or not parent.sampled or not _tracer.trace_sql:
+        return
+    span = Span(_tracer, 'db.query', parent.trace_id, parent.span_id, {
+        'db.system': conn.dialect.name,
+        'db.statement': ' '.join(statement.split())[:500],
+        'db.executemany': executemany,
+    })
+    conn.info.setdefault('trace_spans', []).append(span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('trace_spans')
+    if spans:
+        span = spans.pop()
+        if cursor is not None and cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set_attribute('db.rowcount', cursor.rowcount)
+        span.end()
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get('trace_spans') if connection is not None else None
+    if spans:
+        span = spans.pop()
+        span.record_exception(exception_context.original_exception)
+        span.end()
+
+
+def init_tracing(app):
+    """Configure the tracer from the app config and instrument requests and SQL"""
+    global _tracer
+
+    exporter_name = app.config.get('TRACING_EXPORTER', 'memory')
+    if exporter_name == 'jsonl':
+        exporter = JsonlExporter(app.config.get('TRACING_FILE', 'traces.jsonl'))
+    elif exporter_name == 'memory':
+        exporter = RingBufferExporter(app.config.get('TRACING_BUFFER_SIZE', 2000))
+    else:
+        raise ValueError(f'Unknown tracing exporter: {exporter_name}')
+
+    _tracer = Tracer(
+        sample_rate=float(app.config.get('TRACING_SAMPLE_RATE', 0.0)),
+        exporter=exporter,
+        trace_sql=app.config.get('TRACING_SQL', True),
+        trust_remote_sampling=app.config.get('TRACING_TRUST_TRACEPARENT', False)
+    )
+    app.extensions['tracer'] = _tracer
+
+    app.before_request(_start_request_span)
+    app.after_request(_finish_request_span)
+    app.teardown_request(_end_request_span)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def app_tracer() -> Tracer:
+    return current_app.extensions.get('tracer', _tracer)
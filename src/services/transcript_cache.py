@@ -0,0 +1,174 @@
+"""Per-conversation cache of serialized messages.
+
+Messages are mostly append-only, so a conversation's messages are kept as JSON
+fragments and new ones are serialized and appended as they show up; serving a
+cached transcript is a byte concatenation. An entry is rebuilt when the
+conversation's message count and highest id no longer line up with it (a
+delete, or a message sorting before the cached ones), or when its version
+changed: any personality changed (messages embed names and colors) or a
+message was edited in place, which stamps the conversation's ``edited_at`` in
+the database so every process sees it. Edits and deletes made through this
+process's session also drop the entry right away. Memory is bounded by an LRU
+over the serialized size.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
+
+from src.models.ai_provider import ChatMessage, Conversation
+from src.services.metrics import REGISTRY
+
+TRANSCRIPT_CACHE_REQUESTS = REGISTRY.counter(
+    'transcript_cache_requests_total', 'Conversation transcript cache lookups by outcome', ['outcome'])
+
+
+class _Transcript:
+    __slots__ = ('count', 'last_id', 'last_created_at', 'version', 'fragments', 'size', 'joined')
+
+    def __init__(self, count: int, last_id: int, last_created_at: Optional[datetime], version,
+                 fragments: List[bytes]):
+        self.count = count
+        self.last_id = last_id
+        self.last_created_at = last_created_at
+        self.version = version
+        self.fragments = fragments
+        self.size = sum(len(fragment) for fragment in fragments) + len(fragments)
+        self.joined = None
+
+    def json(self) -> bytes:
+        if self.joined is None:
+            self.joined = b'[' + b','.join(self.fragments) + b']'
+        return self.joined
+
+
+def ordered_messages(query):
+    """Messages in transcript order, with their personality loaded up front"""
+    return query.options(joinedload(ChatMessage.personality)).order_by(
+        ChatMessage.created_at.asc(), ChatMessage.id.asc()
+    ).all()
+
+
+class TranscriptCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries: 'OrderedDict[int, _Transcript]' = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self, conversation_id: Optional[int] = None):
+        with self.lock:
+            if conversation_id is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            entry = self.entries.pop(conversation_id, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def _store(self, conversation_id: int, entry: _Transcript):
+        with self.lock:
+            previous = self.entries.pop(conversation_id, None)
+            if previous is not None:
+                self.size -= previous.size
+            # A single huge conversation is not allowed to flush everything else
+            if entry.size > self.max_bytes // 4:
+                return
+            self.entries[conversation_id] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def _get(self, conversation_id: int) -> Optional[_Transcript]:
+        with self.lock:
+            entry = self.entries.get(conversation_id)
+            if entry is not None:
+                self.entries.move_to_end(conversation_id)
+            return entry
+
+    def messages_json(self, conversation_id: int, count: int, last_id: Optional[int], version,
+                      dumps: Callable[[dict], bytes], scope=None) -> bytes:
+        """Serialized message list of a conversation whose current count, max id and version are known
+
+        version is what the serialized messages depend on besides them (personalities, in-place edits);
+        scope selects the messages when they are not just the conversation's own (a fork's).
+        """
+        last_id = last_id or 0
+        if scope is None:
+            scope = ChatMessage.conversation_id == conversation_id
+        entry = self._get(conversation_id)
+
+        if entry is not None and entry.version == version:
+            if entry.count == count and entry.last_id == last_id:
+                TRANSCRIPT_CACHE_REQUESTS.inc(outcome='hit')
+                return entry.json()
+
+            if count > entry.count and last_id > entry.last_id:
+                new_messages = ordered_messages(ChatMessage.query.filter(
+                    scope,
+                    ChatMessage.id > entry.last_id,
+                    ChatMessage.id <= last_id
+                ))
+                # Only a pure append keeps the cached order valid
+                if entry.count + len(new_messages) == count and (
+                    entry.last_created_at is None
+                    or all(message.created_at and message.created_at >= entry.last_created_at for message in new_messages)
+                ):
+                    appended = _Transcript(
+                        count,
+                        last_id,
+                        new_messages[-1].created_at,
+                        version,
+                        entry.fragments + [dumps(message.to_dict()) for message in new_messages]
+                    )
+                    self._store(conversation_id, appended)
+                    TRANSCRIPT_CACHE_REQUESTS.inc(outcome='append')
+                    return appended.json()
+
+        messages = ordered_messages(ChatMessage.query.filter(
+            scope,
+            ChatMessage.id <= last_id
+        ))
+        rebuilt = _Transcript(
+            len(messages),
+            max((message.id for message in messages), default=0),
+            messages[-1].created_at if messages else None,
+            version,
+            [dumps(message.to_dict()) for message in messages]
+        )
+        if rebuilt.count == count and rebuilt.last_id == last_id:
+            self._store(conversation_id, rebuilt)
+        TRANSCRIPT_CACHE_REQUESTS.inc(outcome='miss' if entry is None else 'rebuild')
+        return rebuilt.json()
+
+
+def get_transcript_cache() -> Optional[TranscriptCache]:
+    """The current app's cache (ids are only meaningful within one app's database)"""
+    return current_app.extensions.get('transcript_cache')
+
+
+def _invalidate_changed(session, flush_context):
+    """Drop entries whose messages were edited or deleted (appends are picked up on read)"""
+    cache = get_transcript_cache() if has_app_context() else None
+    if cache is None:
+        return
+    for instance in list(session.dirty) + list(session.deleted):
+        if isinstance(instance, ChatMessage) and instance.conversation_id is not None:
+            if instance in session.deleted or session.is_modified(instance, include_collections=False):
+                cache.invalidate(instance.conversation_id)
+        elif isinstance(instance, Conversation) and instance in session.deleted:
+            cache.invalidate(instance.id)
+
+
+def init_transcript_cache(app):
+    """Create the app's transcript cache (TRANSCRIPT_CACHE_MAX_BYTES = 0 disables it)"""
+    max_bytes = app.config.get('TRANSCRIPT_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+    app.extensions['transcript_cache'] = TranscriptCache(max_bytes) if max_bytes else None
+
+    if not event.contains(Session, 'after_flush', _invalidate_changed):
+        event.listen(Session, 'after_flush', _invalidate_changed)
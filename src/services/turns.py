@@ -0,0 +1,70 @@
+"""Preparation of auto-continue turns.
+
+Shared by ``auto_continue_conversation`` and speculative drafts, so a draft is
+generated from exactly the prompt the real turn would send.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from src.models.ai_provider import db, AIPersonality, Conversation
+from src.services.ai_adapter import PROMPT_HISTORY_SIZE, AIAdapter, AIAdapterFactory
+from src.services.embeddings import retrieve_relevant
+from src.services.recent_history import recent_records
+
+
+def next_speaker_index(participants: List[int], last_message: Optional[Dict]) -> int:
+    """Index in participants of who speaks after last_message (the first participant after a user message)"""
+    if last_message is not None and last_message['personality_id']:
+        try:
+            return (participants.index(last_message['personality_id']) + 1) % len(participants)
+        except ValueError:
+            return 0
+    return 0
+
+
+def latest_message(conversation: Conversation) -> Optional[Dict]:
+    return next(iter(recent_records(conversation, 1)), None)
+
+
+def prepare_turn(conversation: Conversation, personality: AIPersonality) -> Tuple[AIAdapter, List[Dict]]:
+    """Adapter and prompt of personality's next auto-continue turn"""
+    # Get recent conversation history
+    recent_messages = recent_records(conversation, 10)
+
+    # Create context message for the AI
+    if recent_messages:
+        last_msg = recent_messages[0]
+        if last_msg['personality_id'] and last_msg['personality_id'] != personality.id:
+            # Participants are usually in the session's identity map already
+            other_personality = db.session.get(AIPersonality, last_msg['personality_id'])
+            context_message = f"{other_personality.display_name if other_personality else 'Someone'} ha detto: \"{last_msg['content']}\". Rispondi a questa affermazione continuando la conversazione."
+        else:
+            context_message = "Continua la conversazione basandoti sui messaggi precedenti."
+    else:
+        context_message = "Inizia o continua la conversazione."
+
+    # Create AI adapter
+    provider = personality.provider
+    adapter = AIAdapterFactory.create_adapter(
+        api_type=provider.api_type,
+        api_key=provider.api_key,
+        api_base_url=provider.api_base_url,
+        model=provider.default_model,
+        max_tokens=provider.max_tokens,
+        temperature=provider.temperature
+    )
+
+    # Older messages relevant to the latest one, beyond the ones the prompt includes
+    relevant_messages = retrieve_relevant(
+        conversation,
+        recent_messages[0]['content'] if recent_messages else context_message,
+        exclude_ids=[msg['id'] for msg in recent_messages[:PROMPT_HISTORY_SIZE] if msg['id'] is not None]
+    )
+
+    # Format messages for AI
+    messages = adapter.format_messages(
+        system_prompt=personality.system_prompt,
+        user_message=context_message,
+        conversation_history=recent_messages[::-1],
+        relevant_history=[msg.to_dict() for msg in relevant_messages]
+    )
+    return adapter, messages
@@ -0,0 +1,198 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from src.models.ai_provider import db, ChatMessage, UsageRollup
+from src.services.quotas import charge_tokens
+
+# Dimensions accepted by ``query_usage(group_by=...)``
+USAGE_DIMENSIONS = {
+    'day': UsageRollup.day,
+    'provider': UsageRollup.provider_id,
+    'personality': UsageRollup.personality_id,
+    'model': UsageRollup.model,
+}
+
+
+def extract_token_counts(usage: Optional[Dict]) -> Tuple[Optional[int], Optional[int]]:
+    """Get (prompt_tokens, completion_tokens) from a provider usage payload"""
+    if not usage:
+        return None, None
+
+    prompt_tokens = usage.get('prompt_tokens', usage.get('input_tokens'))
+    completion_tokens = usage.get('completion_tokens', usage.get('output_tokens'))
+    return (
+        int(prompt_tokens) if prompt_tokens is not None else None,
+        int(completion_tokens) if completion_tokens is not None else None,
+    )
+
+
+def record_usage(message: ChatMessage):
+    """Add an AI message's usage to its daily rollup bucket.
+
+    Runs inside the caller's transaction, so the rollup is committed (or rolled
+    back) together with the message itself.
+    """
+    if message.sender_type != 'ai' or not message.provider_id or not message.personality_id:
+        return
+
+    _add_to_rollup(
+        (message.created_at or datetime.utcnow()).date(),
+        message.provider_id,
+        message.personality_id,
+        message.model or '',
+        {
+            'message_count': 1,
+            'prompt_tokens': message.prompt_tokens or 0,
+            'completion_tokens': message.completion_tokens or 0,
+            'total_latency_ms': message.latency_ms or 0,
+        }
+    )
+
+
+def record_aborted_usage(provider_id: int, personality_id: int, result: Dict):
+    """Add the tokens of a cancelled or failed provider call (which stores no message) to the rollups.
+
+    ``rebuild_rollups`` recomputes from messages only, so it drops these.
+    """
+    prompt_tokens, completion_tokens = extract_token_counts(result.get('usage'))
+    if not prompt_tokens and not completion_tokens:
+        return
+
+    _add_to_rollup(datetime.utcnow().date(), provider_id, personality_id, result.get('model') or '', {
+        'message_count': 0,
+        'aborted_count': 1,
+        'prompt_tokens': prompt_tokens or 0,
+        'completion_tokens': completion_tokens or 0,
+        'total_latency_ms': result.get('latency_ms') or 0,
+    })
+
+
+def _add_to_rollup(day, provider_id: int, personality_id: int, model: str, increments: Dict):
+    # Provider tokens are spent even if this transaction is rolled back later
+    charge_tokens(increments['prompt_tokens'] + increments['completion_tokens'])
+
+    bucket = {
+        'day': day,
+        'provider_id': provider_id,
+        'personality_id': personality_id,
+        'model': model,
+    }
+
+    if _increment_rollup(bucket, increments):
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(UsageRollup(**bucket, **increments))
+    except IntegrityError:
+        # Another writer created the bucket in the meantime
+        _increment_rollup(bucket, increments)
+
+
+def _increment_rollup(bucket: Dict, increments: Dict) -> bool:
+    """Atomically add increments to an existing bucket, returns False if it does not exist"""
+    # coalesce: columns added by upgrade_schema are NULL in existing buckets
+    values = {
+        getattr(UsageRollup, name): func.coalesce(getattr(UsageRollup, name), 0) + amount
+        for name, amount in increments.items()
+    }
+    updated = UsageRollup.query.filter_by(**bucket).update(values, synchronize_session=False)
+    return updated > 0
+
+
+def rebuild_rollups() -> int:
+    """Recompute every rollup bucket from the message table"""
+    UsageRollup.query.delete(synchronize_session=False)
+
+    day = func.date(ChatMessage.created_at)
+    rows = db.session.query(
+        day,
+        ChatMessage.provider_id,
+        ChatMessage.personality_id,
+        func.coalesce(ChatMessage.model, ''),
+        func.count(ChatMessage.id),
+        func.coalesce(func.sum(ChatMessage.prompt_tokens), 0),
+        func.coalesce(func.sum(ChatMessage.completion_tokens), 0),
+        func.coalesce(func.sum(ChatMessage.latency_ms), 0),
+    ).filter(
+        ChatMessage.sender_type == 'ai',
+        ChatMessage.provider_id.isnot(None),
+        ChatMessage.personality_id.isnot(None),
+    ).group_by(
+        day, ChatMessage.provider_id, ChatMessage.personality_id, func.coalesce(ChatMessage.model, '')
+    ).all()
+
+    for row_day, provider_id, personality_id, model, count, prompt_tokens, completion_tokens, latency in rows:
+        if isinstance(row_day, str):
+            row_day = datetime.strptime(row_day, '%Y-%m-%d').date()
+        db.session.add(UsageRollup(
+            day=row_day,
+            provider_id=provider_id,
+            personality_id=personality_id,
+            model=model,
+            message_count=count,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_latency_ms=latency
+        ))
+
+    db.session.commit()
+    return len(rows)
+
+
+def query_usage(start=None, end=None, group_by: Optional[List[str]] = None, **filters) -> List[Dict]:
+    """Aggregate rollup buckets between two dates (inclusive)"""
+    if group_by is None:
+        group_by = list(USAGE_DIMENSIONS)
+    group_columns = [USAGE_DIMENSIONS[name] for name in group_by]
+
+    message_count = func.sum(UsageRollup.message_count)
+    aborted_count = func.sum(func.coalesce(UsageRollup.aborted_count, 0))
+    prompt_tokens = func.sum(UsageRollup.prompt_tokens)
+    completion_tokens = func.sum(UsageRollup.completion_tokens)
+    total_latency = func.sum(UsageRollup.total_latency_ms)
+
+    query = db.session.query(
+        *group_columns, message_count, aborted_count, prompt_tokens, completion_tokens, total_latency
+    )
+    if start:
+        query = query.filter(UsageRollup.day >= start)
+    if end:
+        query = query.filter(UsageRollup.day <= end)
+    for name, value in filters.items():
+        if value is not None:
+            query = query.filter(USAGE_DIMENSIONS[name] == value)
+    if group_columns:
+        query = query.group_by(*group_columns).order_by(*group_columns)
+
+    results = []
+    for row in query.all():
+        keys = row[:len(group_columns)]
+        count, aborted, prompt, completion, latency = row[len(group_columns):]
+        # Buckets of aborted calls only have no messages but did spend tokens
+        calls = int(count or 0) + int(aborted or 0)
+        if not calls and not prompt and not completion:
+            continue
+
+        entry = {}
+        for name, value in zip(group_by, keys):
+            if name == 'day':
+                entry['day'] = value.isoformat() if value else None
+            elif name in ('provider', 'personality'):
+                entry[f'{name}_id'] = value
+            else:
+                entry[name] = value
+        entry.update({
+            'message_count': int(count or 0),
+            'aborted_count': int(aborted or 0),
+            'prompt_tokens': int(prompt or 0),
+            'completion_tokens': int(completion or 0),
+            'total_tokens': int((prompt or 0) + (completion or 0)),
+            'avg_latency_ms': round((latency or 0) / calls, 1) if calls else None,
+        })
+        results.append(entry)
+
+    return results
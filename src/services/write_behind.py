@@ -0,0 +1,428 @@
+"""Write-behind group commit for user messages (SQLite).
+
+On SQLite every commit is a round of fsyncs under the single writer lock, so a
+burst of users sending messages queues up on ``database is locked``. With
+``WRITE_BEHIND_ENABLED`` a user message is given its id up front, appended to
+this process's log (``WRITE_BEHIND_LOG_DIR``, fsynced; without it the queue is
+memory only) and acknowledged; a background flusher then inserts the queued
+messages in one transaction every ``WRITE_BEHIND_INTERVAL`` seconds. When the
+queue holds ``WRITE_BEHIND_MAX_PENDING`` messages, callers fall back to
+committing synchronously.
+
+Ids come from blocks reserved in ``id_blocks``. Messages inserted through the
+ORM while write-behind is on get ids above every reserved block, so they never
+collide with queued ones. Readers merge the queued messages of a conversation
+(``pending_messages`` / ``with_pending``) until they are committed. Logs of
+processes that died are replayed by the next flusher that starts.
+
+A message that still fails when committed on its own stays queued and is
+retried; after ``WRITE_BEHIND_MAX_ATTEMPTS`` failures it is appended to
+``dead-letter.jsonl`` in the log dir (logged in full without one) and counted
+in ``write_behind_dropped_total``.
+"""
+import atexit
+import base64
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import case, event, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+from src.models.ai_provider import db, ChatMessage, Conversation, IdBlock, select_fields
+from src.services.events import get_hub
+from src.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_MESSAGES = REGISTRY.counter(
+    'write_behind_messages_total', 'User messages by how they were written', ['path'])
+WRITE_BEHIND_BATCH = REGISTRY.histogram(
+    'write_behind_batch_size', 'Messages per group commit', [], buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+WRITE_BEHIND_DROPPED = REGISTRY.counter(
+    'write_behind_dropped_total', 'Acknowledged messages that were never committed', ['reason'])
+
+ID_BLOCK_NAME = 'chat_messages'
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+
+class PendingMessage:
+    """An acknowledged message that is not committed yet; reads like a ChatMessage"""
+    __slots__ = ('values', 'data', 'attempts')
+
+    def __init__(self, values: Dict, data: Dict):
+        self.values = values
+        self.data = data
+        self.attempts = 0
+
+    def __getattr__(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def to_dict(self, fields=None):
+        return select_fields(self.data, fields)
+
+    def to_record(self) -> str:
+        values = dict(self.values)
+        values['created_at'] = values['created_at'].isoformat()
+        if values.get('embedding') is not None:
+            values['embedding'] = base64.b64encode(values['embedding']).decode('ascii')
+        return json.dumps({'values': values, 'data': self.data})
+
+    @classmethod
+    def from_record(cls, line: str) -> 'PendingMessage':
+        record = json.loads(line)
+        values = record['values']
+        values['created_at'] = datetime.fromisoformat(values['created_at'])
+        if values.get('embedding') is not None:
+            values['embedding'] = base64.b64decode(values['embedding'])
+        return cls(values, record['data'])
+
+
+def _advance_ids(connection, count: int) -> int:
+    """Reserve count ids in the connection's transaction; returns the end of the reserved range"""
+    table = IdBlock.__table__
+    # Never below what is already in the table (rows written while write-behind was off)
+    floor = select(func.coalesce(func.max(ChatMessage.id), 0) + 1).scalar_subquery()
+    connection.execute(sqlite_insert(table).values(name=ID_BLOCK_NAME, next_id=floor).on_conflict_do_nothing())
+    connection.execute(update(table).where(table.c.name == ID_BLOCK_NAME).values(
+        next_id=case((table.c.next_id > floor, table.c.next_id), else_=floor) + count
+    ))
+    return connection.execute(select(table.c.next_id).where(table.c.name == ID_BLOCK_NAME)).scalar()
+
+
+class IdAllocator:
+    """Hands out chat message ids from blocks reserved in id_blocks"""
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self.next = 0
+        self.limit = 0
+        self.lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self.lock:
+            if self.next >= self.limit:
+                with db.engine.begin() as connection:
+                    self.limit = _advance_ids(connection, self.block_size)
+                self.next = self.limit - self.block_size
+            self.next += 1
+            return self.next - 1
+
+
+def _assign_orm_id(mapper, connection, target):
+    """Give messages inserted outside write-behind an id above every reserved block.
+
+    The id is taken from id_blocks in the inserting transaction, so it is given
+    back if that transaction rolls back.
+    """
+    if target.id is None and has_app_context() and get_write_behind() is not None:
+        target.id = _advance_ids(connection, 1) - 1
+
+
+class WriteBehind:
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get('WRITE_BEHIND_INTERVAL', 0.005)
+        self.batch_size = app.config.get('WRITE_BEHIND_BATCH_SIZE', 500)
+        self.max_pending = app.config.get('WRITE_BEHIND_MAX_PENDING', 5000)
+        self.max_attempts = app.config.get('WRITE_BEHIND_MAX_ATTEMPTS', 3)
+        self.log_dir = app.config.get('WRITE_BEHIND_LOG_DIR')
+        self.ids = IdAllocator(app.config.get('WRITE_BEHIND_ID_BLOCK', 100))
+        self.queue: deque = deque()
+        self.by_conversation: Dict[int, List[PendingMessage]] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self._flusher = None
+        self._log = None
+
+    # Submitting
+
+    def submit(self, message: ChatMessage) -> Optional[PendingMessage]:
+        """Queue a new (not added) message; None when the queue is full and the caller must commit it"""
+        if len(self.queue) >= self.max_pending:
+            WRITE_BEHIND_MESSAGES.inc(path='sync')
+            return None
+        self.ensure_flusher()
+
+        message.id = self.ids.next_id()
+        message.created_at = message.created_at or datetime.utcnow()
+        message.message_type = message.message_type or 'text'
+        values = {attr.key: getattr(message, attr.key) for attr in ChatMessage.__mapper__.column_attrs}
+        pending = PendingMessage(values, message.to_dict())
+
+        with self.lock:
+            log = self._open_log() if self.log_dir else None
+            if log is not None:
+                log.write(pending.to_record() + '\n')
+                log.flush()
+            self._enqueue(pending)
+        if log is not None:
+            os.fsync(log.fileno())
+        self.wakeup.set()
+        if has_app_context() and 'event_hub' in current_app.extensions:
+            # Subscribers get the message now; the copy published on commit has the same id and is skipped
+            get_hub().publish([{'id': pending.id, 'type': 'message', 'conversation_id': pending.conversation_id,
+                                'data': pending.data}])
+        WRITE_BEHIND_MESSAGES.inc(path='queued')
+        return pending
+
+    def _enqueue(self, pending: PendingMessage):
+        self.queue.append(pending)
+        self.by_conversation.setdefault(pending.conversation_id, []).append(pending)
+
+    def pending(self, conversation_id: int) -> List[PendingMessage]:
+        with self.lock:
+            return list(self.by_conversation.get(conversation_id, ()))
+
+    def pending_counts(self) -> Dict[int, int]:
+        with self.lock:
+            return {conversation_id: len(messages) for conversation_id, messages in self.by_conversation.items()}
+
+    # Log
+
+    def _open_log(self):
+        if self._log is None or self._log[0] != os.getpid():
+            os.makedirs(self.log_dir, exist_ok=True)
+            path = os.path.join(self.log_dir, f'write-behind-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl')
+            log = open(path, 'a', encoding='utf-8')
+            # Held while the process lives: a log whose lock can be taken belongs to a dead process
+            fcntl.flock(log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._log = (os.getpid(), log)
+        return self._log[1]
+
+    def _truncate_log(self):
+        if self._log is not None and self._log[0] == os.getpid():
+            self._log[1].truncate(0)
+
+    def recover(self):
+        """Queue the messages left in the logs of processes that died before flushing them"""
+        if not self.log_dir:
+            return 0
+        recovered = 0
+        for path in glob.glob(os.path.join(self.log_dir, 'write-behind-*.jsonl')):
+            if self._log is not None and self._log[1].name == path:
+                continue
+            with open(path, 'r+', encoding='utf-8') as orphan:
+                try:
+                    fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # its process is alive
+                lines = [line for line in orphan.read().splitlines() if line.strip()]
+                with self.lock:
+                    log = self._open_log()
+                    for line in lines:
+                        try:
+                            pending = PendingMessage.from_record(line)
+                        except (ValueError, KeyError):
+                            logger.warning('Skipping a corrupt write-behind record in %s', path)
+                            continue
+                        log.write(line + '\n')
+                        self._enqueue(pending)
+                        recovered += 1
+                    log.flush()
+                os.fsync(log.fileno())
+            os.remove(path)
+        if recovered:
+            logger.info('Recovered %d queued messages from write-behind logs', recovered)
+        return recovered
+
+    # Flushing
+
+    def flush(self) -> int:
+        """Group-commit up to batch_size queued messages; returns how many were written"""
+        with self.lock:
+            batch = [self.queue[index] for index in range(min(self.batch_size, len(self.queue)))]
+        if not batch:
+            return 0
+
+        failed = []
+        try:
+            written = self._write(batch)
+        except OperationalError:
+            # Typically 'database is locked': keep the batch for the next round
+            db.session.rollback()
+            raise
+        except Exception:
+            db.session.rollback()
+            logger.exception('Group commit failed, writing %d messages one by one', len(batch))
+            written = 0
+            for pending in batch:
+                try:
+                    written += self._write([pending])
+                except OperationalError:
+                    # Messages written so far are skipped when the batch is retried
+                    db.session.rollback()
+                    raise
+                except Exception:
+                    db.session.rollback()
+                    pending.attempts += 1
+                    failed.append(pending)
+                    logger.exception('Could not write queued message %s (attempt %d)', pending.id, pending.attempts)
+
+        retry = [pending for pending in failed if pending.attempts < self.max_attempts]
+        dead = [pending for pending in failed if pending.attempts >= self.max_attempts]
+        kept = set(retry)
+        with self.lock:
+            for pending in batch:
+                self.queue.popleft()
+                if pending in kept:
+                    continue
+                messages = self.by_conversation.get(pending.conversation_id)
+                if messages is not None:
+                    messages.remove(pending)
+                    if not messages:
+                        del self.by_conversation[pending.conversation_id]
+            # Still acknowledged and in the log: try again after the rest of the queue
+            self.queue.extend(retry)
+            if dead:
+                self._dead_letter(dead)
+            if not self.queue:
+                self._truncate_log()
+        WRITE_BEHIND_BATCH.observe(len(batch))
+        return written
+
+    def _dead_letter(self, messages: List[PendingMessage]):
+        WRITE_BEHIND_DROPPED.inc(len(messages), reason='failed')
+        if not self.log_dir:
+            for pending in messages:
+                logger.error('Dropping queued message %s: %s', pending.id, pending.to_record())
+            return
+        path = os.path.join(self.log_dir, DEAD_LETTER_FILE)
+        with open(path, 'a', encoding='utf-8') as dead_letter:
+            dead_letter.write(''.join(pending.to_record() + '\n' for pending in messages))
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+        logger.error('Moved %d queued messages that could not be committed to %s', len(messages), path)
+
+    def _write(self, batch: List[PendingMessage]) -> int:
+        ids = [pending.id for pending in batch]
+        # Replayed logs may hold messages that were committed just before a crash
+        existing = {row[0] for row in db.session.query(ChatMessage.id).filter(ChatMessage.id.in_(ids))}
+        conversations = {
+            conversation.id: conversation
+            for conversation in Conversation.query.filter(
+                Conversation.id.in_({pending.conversation_id for pending in batch})
+            )
+        }
+        written = [
+            pending for pending in batch
+            if pending.id not in existing and pending.conversation_id in conversations
+        ]
+        db.session.add_all([ChatMessage(**pending.values) for pending in written])
+        now = datetime.utcnow()
+        for conversation_id in {pending.conversation_id for pending in written}:
+            conversations[conversation_id].updated_at = now
+        db.session.commit()
+        orphaned = sum(1 for pending in batch if pending.conversation_id not in conversations)
+        if orphaned:
+            WRITE_BEHIND_DROPPED.inc(orphaned, reason='conversation_deleted')
+        return len(written)
+
+    def drain(self):
+        while self.queue:
+            self.flush()
+
+    def ensure_flusher(self):
+        """Start this process's flusher (lazily, so it runs in each worker)"""
+        if self._flusher == os.getpid():
+            return
+        with self.lock:
+            if self._flusher == os.getpid():
+                return
+            self._flusher = os.getpid()
+        threading.Thread(target=self._run, name='write-behind', daemon=True).start()
+        atexit.register(self._drain_at_exit)
+
+    def _run(self):
+        try:
+            with self.app.app_context():
+                self.recover()
+        except Exception:
+            logger.exception('Could not recover write-behind logs')
+        if self.queue:
+            self.wakeup.set()
+
+        backoff = self.interval
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # Let more messages arrive, so they share the commit
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    while self.flush() == self.batch_size:
+                        pass
+                backoff = self.interval
+            except Exception:
+                logger.warning('Write-behind flush failed, retrying in %.2fs', backoff, exc_info=True)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 1.0)
+            if self.queue:
+                self.wakeup.set()
+
+    def _drain_at_exit(self):
+        if self._flusher != os.getpid() or not self.queue:
+            return
+        try:
+            with self.app.app_context():
+                self.drain()
+        except Exception:
+            logger.exception('Could not flush %d queued messages at exit', len(self.queue))
+
+
+def get_write_behind() -> Optional[WriteBehind]:
+    return current_app.extensions.get('write_behind')
+
+
+def pending_messages(conversation_id: int) -> List[PendingMessage]:
+    writer = get_write_behind()
+    return writer.pending(conversation_id) if writer is not None else []
+
+
+def pending_counts() -> Dict[int, int]:
+    writer = get_write_behind()
+    return writer.pending_counts() if writer is not None else {}
+
+
+def with_pending(conversation_id: int, messages: List, limit: Optional[int] = None) -> List:
+    """Newest-first messages (as queried) merged with the conversation's queued ones"""
+    pending = pending_messages(conversation_id)
+    if not pending:
+        return messages
+    committed = {message.id for message in messages}
+    merged = list(messages) + [message for message in pending if message.id not in committed]
+    merged.sort(key=lambda message: (message.created_at or datetime.min, message.id), reverse=True)
+    return merged[:limit] if limit is not None else merged
+
+
+def _start_flusher():
+    current_app.extensions['write_behind'].ensure_flusher()
+
+
+def init_write_behind(app):
+    """Queue user messages for group commit when WRITE_BEHIND_ENABLED is set (SQLite only)"""
+    if not app.config.get('WRITE_BEHIND_ENABLED'):
+        return
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        logger.warning('WRITE_BEHIND_ENABLED only applies to SQLite; messages are committed synchronously')
+        return
+    app.extensions['write_behind'] = WriteBehind(app)
+    if app.config.get('WRITE_BEHIND_LOG_DIR'):
+        # Start the flusher with the first request, so logs left by dead workers are replayed promptly
+        app.before_request(_start_flusher)
+
+    if not event.contains(ChatMessage, 'before_insert', _assign_orm_id):
+        event.listen(ChatMessage, 'before_insert', _assign_orm_id)
@@ -0,0 +1,4 @@
+"""Production entry point: gunicorn -c gunicorn.conf.py src.wsgi:app"""
+from src.main import create_app
+
+app = create_app()
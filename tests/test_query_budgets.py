@@ -0,0 +1,73 @@
+"""Query-count budgets of the conversation read routes.
+
+The budgets do not grow with the number of conversations, participants or
+messages, so an N+1 (a lazy load in ``to_dict``, a query per participant)
+fails here instead of showing up as a slow endpoint.
+"""
+import json
+
+import pytest
+
+from src.cli import init_db
+from src.main import create_app
+from src.models.ai_provider import db, AIPersonality, AIProvider, ChatMessage, Conversation
+from src.services.sql_profiler import QueryBudgetExceeded, assert_max_queries
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'budgets.db'}"})
+    with app.app_context():
+        init_db()
+        provider = AIProvider(name='budget-stub', api_type='manus', api_base_url='http://127.0.0.1:9',
+                              api_key='budget', default_model='stub-model')
+        db.session.add(provider)
+        db.session.flush()
+        personalities = [
+            AIPersonality(name=f'budget-{index}', display_name=f'Budget {index}', provider_id=provider.id,
+                          system_prompt='Sei un partecipante a un test.')
+            for index in range(4)
+        ]
+        db.session.add_all(personalities)
+        db.session.flush()
+
+        app.conversation_ids = []
+        for conversation_index in range(6):
+            conversation = Conversation(title=f'Budget {conversation_index}', topic='budgets',
+                                        participants=json.dumps([personality.id for personality in personalities]))
+            db.session.add(conversation)
+            db.session.flush()
+            app.conversation_ids.append(conversation.id)
+            db.session.add_all([
+                ChatMessage(conversation_id=conversation.id, personality_id=personalities[index % 4].id,
+                            content=f'Messaggio {index}', sender_type='ai')
+                for index in range(12)
+            ])
+        db.session.commit()
+    return app
+
+
+def test_conversation_list_budget(app):
+    client = app.test_client()
+    with assert_max_queries(2):
+        response = client.get('/api/conversations')
+    assert response.status_code == 200
+    assert len(response.get_json()['conversations']) == 6
+
+
+def test_conversation_detail_budget(app):
+    client = app.test_client()
+    conversation_id = app.conversation_ids[0]
+    # Cold transcript cache, then warm
+    for _ in range(2):
+        with assert_max_queries(5):
+            response = client.get(f'/api/conversations/{conversation_id}')
+        assert response.status_code == 200
+        assert len(response.get_json()['messages']) == 12
+
+
+def test_budget_exceeded_fails():
+    with pytest.raises(QueryBudgetExceeded):
+        with assert_max_queries(1) as profile:
+            profile.record('SELECT 1', 0.0)
+            profile.record('SELECT 1', 0.0)
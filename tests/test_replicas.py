@@ -0,0 +1,126 @@
+"""Read replica routing, against a primary and a replica SQLite file.
+
+Replication is simulated by copying the primary's file over the replica's;
+heartbeats are driven by the tests instead of the monitor thread.
+"""
+import shutil
+import sqlite3
+
+import pytest
+
+from src.cli import init_db
+from src.main import create_app
+from src.models.ai_provider import db, Conversation
+
+
+@pytest.fixture
+def replicated(tmp_path):
+    primary = tmp_path / 'primary.db'
+    replica = tmp_path / 'replica.db'
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{primary}',
+        'SQLALCHEMY_REPLICA_URIS': [f'sqlite:///{replica}'],
+        'REPLICA_MAX_LAG_SECONDS': 30,
+    })
+    router = app.extensions['replicas']
+    router.ensure_monitor = lambda: None
+
+    def replicate():
+        """Copy the primary (with a fresh heartbeat) to the replica and measure it"""
+        with app.app_context():
+            router.check()
+            db.engines['replica_0'].dispose()
+            shutil.copy(primary, replica)
+            router.check()
+
+    with app.app_context():
+        init_db()
+        db.session.add(Conversation(title='replicated', participants='[]'))
+        db.session.commit()
+    replicate()
+    with app.app_context():
+        db.session.add(Conversation(title='primary only', participants='[]'))
+        db.session.commit()
+
+    app.replicate = replicate
+    app.replica_path = replica
+    return app
+
+
+def titles(client, **kwargs):
+    response = client.get('/api/conversations', **kwargs)
+    assert response.status_code == 200
+    return {conversation['title'] for conversation in response.get_json()['conversations']}
+
+
+def test_get_reads_from_healthy_replica(replicated):
+    assert titles(replicated.test_client()) == {'replicated'}
+
+
+def test_strong_consistency_reads_primary(replicated):
+    client = replicated.test_client()
+    assert titles(client, headers={'X-Read-Consistency': 'strong'}) == {'replicated', 'primary only'}
+
+
+def test_client_reads_its_writes_until_replica_replays_them(replicated):
+    client = replicated.test_client()
+    with replicated.app_context():
+        conversation_id = Conversation.query.filter_by(title='replicated').first().id
+
+    response = client.put(f'/api/conversations/{conversation_id}', json={'title': 'renamed'})
+    assert response.status_code == 200
+    assert client.get_cookie('db_last_write') is not None
+    # The replica has not seen the write: this client reads the primary
+    assert 'renamed' in titles(client)
+    # Other clients keep reading the replica
+    assert titles(replicated.test_client()) == {'replicated'}
+
+    replicated.replicate()
+    assert titles(client) == {'renamed', 'primary only'}
+    assert replicated.extensions['replicas'].choose(float(client.get_cookie('db_last_write').value)) == 'replica_0'
+
+
+def test_lagging_replica_is_left_out(replicated):
+    router = replicated.extensions['replicas']
+    with sqlite3.connect(replicated.replica_path) as connection:
+        connection.execute("UPDATE replica_heartbeats SET beat_at = '2000-01-01 00:00:00.000000'")
+    with replicated.app_context():
+        router.check()
+
+    state = router.replicas['replica_0']
+    assert not state.healthy
+    assert state.lag > 30
+    assert router.choose() is None
+    assert titles(replicated.test_client()) == {'replicated', 'primary only'}
+
+    replicated.replicate()
+    assert router.replicas['replica_0'].healthy
+
+
+def test_failing_replica_read_is_retried_on_primary(replicated):
+    router = replicated.extensions['replicas']
+    with sqlite3.connect(replicated.replica_path) as connection:
+        connection.execute('DROP TABLE conversations')
+
+    # The failing read is answered from the primary, and the replica is left out from then on
+    assert titles(replicated.test_client()) == {'replicated', 'primary only'}
+    assert not router.replicas['replica_0'].healthy
+    assert router.choose() is None
+
+
+def test_cross_site_client_reads_its_writes_with_header(replicated):
+    # A cross-site frontend never sends the cookie back
+    client = replicated.test_client(use_cookies=False)
+    with replicated.app_context():
+        conversation_id = Conversation.query.filter_by(title='replicated').first().id
+
+    response = client.put(f'/api/conversations/{conversation_id}', json={'title': 'renamed'},
+                          headers={'Origin': 'http://localhost:5173'})
+    assert response.status_code == 200
+    assert 'X-Last-Write' in response.headers['Access-Control-Expose-Headers']
+    last_write = {'X-Last-Write': response.headers['X-Last-Write']}
+
+    assert 'renamed' in titles(client, headers=last_write)
+    assert titles(client) == {'replicated'}
+    replicated.replicate()
+    assert titles(client, headers=last_write) == {'renamed', 'primary only'}
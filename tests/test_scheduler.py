@@ -0,0 +1,166 @@
+"""Priority scheduling of provider calls and admission pools.
+
+The queues are driven directly from threads: each waiter records its name
+when it is granted a slot, and the test releases slots one at a time.
+"""
+import threading
+import time
+
+from src.cli import init_db
+from src.main import create_app
+from src.services.admission import Pool
+from src.services.cancellation import CancelToken
+from src.services.scheduler import BACKGROUND, INTERACTIVE, CallScheduler, ProviderQueue, call_priority
+
+WEIGHTS = {'interactive': 4, 'background': 1, 'probe': 1}
+
+
+def make_queue(concurrency=1, reserve=0, aging=60.0):
+    return ProviderQueue('stub', concurrency, reserve, aging, WEIGHTS)
+
+
+def enqueue(queue, granted, name, priority, flow=None, max_wait=5.0, token=None):
+    """Start a waiter in a thread and return once it is queued (or served)"""
+    results = {}
+
+    def run():
+        results[name] = queue.acquire(priority, flow, max_wait, token)
+        if results[name] is None:
+            granted.append(name)
+
+    queued = len(queue.waiters)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 2
+    while len(queue.waiters) == queued and name not in results and time.monotonic() < deadline:
+        time.sleep(0.001)
+    thread.results = results
+    return thread
+
+
+def release_and_wait(queue, granted, count):
+    queue.release()
+    deadline = time.monotonic() + 2
+    while len(granted) < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_interactive_call_goes_ahead_of_background():
+    queue = make_queue()
+    assert queue.acquire(BACKGROUND, 'batch', 1.0) is None
+    granted = []
+    enqueue(queue, granted, 'background', BACKGROUND, 'batch')
+    enqueue(queue, granted, 'interactive', INTERACTIVE, 'user')
+
+    release_and_wait(queue, granted, 1)
+    assert granted == ['interactive']
+    release_and_wait(queue, granted, 2)
+    assert granted == ['interactive', 'background']
+
+
+def test_reserve_is_kept_for_interactive_calls():
+    queue = make_queue(concurrency=2, reserve=1)
+    assert queue.acquire(BACKGROUND, 'batch', 1.0) is None
+    # The last free slot is reserved
+    assert queue.acquire(BACKGROUND, 'batch', 0.05) == 'timeout'
+    assert queue.acquire(INTERACTIVE, 'user', 0.05) is None
+    assert queue.stats()['in_flight'] == 2
+
+
+def test_background_calls_share_slots_fairly_between_conversations():
+    queue = make_queue()
+    assert queue.acquire(INTERACTIVE, 'user', 1.0) is None
+    granted = []
+    for name in ('a1', 'a2', 'a3'):
+        enqueue(queue, granted, name, BACKGROUND, 'a')
+    enqueue(queue, granted, 'b1', BACKGROUND, 'b')
+
+    for count in range(1, 5):
+        release_and_wait(queue, granted, count)
+    assert granted == ['a1', 'b1', 'a2', 'a3']
+
+
+def test_waiting_background_call_ages_into_the_reserve():
+    queue = make_queue(concurrency=2, reserve=1, aging=0.1)
+    assert queue.acquire(BACKGROUND, 'batch', 1.0) is None
+    started = time.monotonic()
+    assert queue.acquire(BACKGROUND, 'batch', 2.0) is None
+    assert 0.1 <= time.monotonic() - started < 1.0
+
+
+def test_timeout_gives_up_and_leaves_the_queue():
+    queue = make_queue()
+    assert queue.acquire(INTERACTIVE, 'user', 1.0) is None
+    assert queue.acquire(INTERACTIVE, 'user', 0.05) == 'timeout'
+    assert queue.waiters == []
+
+    queue.release()
+    assert queue.stats()['in_flight'] == 0
+    assert queue.acquire(BACKGROUND, 'batch', 0.05) is None
+
+
+def test_cancel_stops_waiting():
+    queue = make_queue()
+    assert queue.acquire(INTERACTIVE, 'user', 1.0) is None
+    token = CancelToken()
+    granted = []
+    thread = enqueue(queue, granted, 'cancelled', INTERACTIVE, 'user', max_wait=5.0, token=token)
+
+    started = time.monotonic()
+    token.cancel('client_closed')
+    thread.join(2)
+    assert thread.results['cancelled'] == 'cancelled'
+    assert time.monotonic() - started < 1.0
+    assert queue.waiters == [] and granted == []
+
+
+def test_scheduler_slot_releases_on_exit():
+    scheduler = CallScheduler(1, {}, 0, 60.0, WEIGHTS, max_wait=1.0)
+    with call_priority(BACKGROUND, 'batch'):
+        with scheduler.slot('stub', 1.0) as refused:
+            assert refused is None
+            assert scheduler.stats()['stub']['in_flight'] == 1
+            with scheduler.slot('stub', 0.05) as refused:
+                assert refused == 'timeout'
+    assert scheduler.stats()['stub']['in_flight'] == 0
+    assert scheduler.stats()['stub']['granted'] == {'background': 1}
+
+
+def test_admission_pool_sheds_when_queue_is_full():
+    pool = Pool('default', concurrency=1, queue=1, queue_timeout=2.0)
+    assert pool.acquire() is None
+    results = []
+    thread = threading.Thread(target=lambda: results.append(pool.acquire()), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 2
+    while pool.waiting == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+    assert pool.acquire() == 'queue_full'
+    pool.release(0.2)
+    thread.join(2)
+    assert results == [None]
+    assert pool.stats()['in_flight'] == 1
+    assert pool.stats()['shed'] == {'queue_full': 1}
+
+
+def test_admission_pool_sheds_after_queue_timeout():
+    pool = Pool('default', concurrency=1, queue=1, queue_timeout=0.05)
+    assert pool.acquire() is None
+    assert pool.acquire() == 'queue_timeout'
+    assert pool.stats()['queue_depth'] == 0
+
+
+def test_admission_releases_slots_of_finished_requests(tmp_path):
+    pools = {'default': {'concurrency': 2, 'queue': 0}, 'llm': {'concurrency': 1, 'queue': 0},
+             'stream': {'concurrency': 1, 'queue': 0}}
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'admission.db'}",
+                      'ADMISSION_ENABLED': True, 'ADMISSION_POOLS': pools})
+    with app.app_context():
+        init_db()
+    client = app.test_client()
+    for _ in range(5):
+        assert client.get('/api/conversations').status_code == 200
+    stats = app.extensions['admission'].stats()['default']
+    assert stats['in_flight'] == 0
+    assert stats['admitted'] == 5
@@ -0,0 +1,78 @@
+"""Write-behind group commit: recovery of logs left by dead workers and dead-lettering.
+
+The flusher thread is not started; the tests call ``flush`` themselves.
+"""
+from datetime import datetime
+
+import pytest
+
+from src.cli import init_db
+from src.main import create_app
+from src.models.ai_provider import db, ChatMessage, Conversation
+from src.services.write_behind import DEAD_LETTER_FILE, WRITE_BEHIND_DROPPED, PendingMessage, get_write_behind
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'write_behind.db'}",
+        'WRITE_BEHIND_ENABLED': True,
+        'WRITE_BEHIND_LOG_DIR': str(tmp_path / 'log'),
+        'WRITE_BEHIND_MAX_ATTEMPTS': 2,
+    })
+    with app.app_context():
+        init_db()
+        conversation = Conversation(title='Write-behind', topic='test', participants='[]')
+        db.session.add(conversation)
+        db.session.commit()
+        app.conversation_id = conversation.id
+        app.extensions['write_behind'].ensure_flusher = lambda: None
+    return app
+
+
+def submit(conversation_id, content):
+    return get_write_behind().submit(ChatMessage(conversation_id=conversation_id, content=content,
+                                                 sender_type='user'))
+
+
+def dropped(reason):
+    return sum(value for labels, value in WRITE_BEHIND_DROPPED.snapshot() if labels == [reason])
+
+
+def test_failing_message_ends_up_in_dead_letter_file(app, tmp_path):
+    with app.app_context():
+        writer = get_write_behind()
+        good = submit(app.conversation_id, 'Messaggio valido')
+        bad = submit(app.conversation_id, 'Messaggio non valido')
+        bad.values['content'] = None  # violates NOT NULL on every attempt
+        dropped_before = dropped('failed')
+
+        assert writer.flush() == 1
+        # Retried once, then dropped
+        assert [pending.id for pending in writer.queue] == [bad.id]
+        assert writer.flush() == 0
+        assert not writer.queue
+        assert writer.pending(app.conversation_id) == []
+
+        assert db.session.get(ChatMessage, good.id).content == 'Messaggio valido'
+        assert db.session.get(ChatMessage, bad.id) is None
+        assert dropped('failed') == dropped_before + 1
+
+    lines = (tmp_path / 'log' / DEAD_LETTER_FILE).read_text().splitlines()
+    assert [PendingMessage.from_record(line).id for line in lines] == [bad.id]
+
+
+def test_recovers_messages_logged_by_a_dead_worker(app, tmp_path):
+    with app.app_context():
+        record = PendingMessage({'id': 900001, 'conversation_id': app.conversation_id, 'content': 'Recuperato',
+                                 'sender_type': 'user', 'message_type': 'text', 'created_at': datetime.utcnow()},
+                                {'id': 900001})
+        log_dir = tmp_path / 'log'
+        log_dir.mkdir()
+        (log_dir / 'write-behind-1-dead.jsonl').write_text(record.to_record() + '\n')
+
+        writer = get_write_behind()
+        assert writer.recover() == 1
+        assert not (log_dir / 'write-behind-1-dead.jsonl').exists()
+        assert writer.flush() == 1
+        assert db.session.get(ChatMessage, 900001).content == 'Recuperato'